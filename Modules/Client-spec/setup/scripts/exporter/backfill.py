@@ -0,0 +1,189 @@
+"""
+SCANS spectrometer log backfill
+
+Convert years of spectrometer logs into an OpenMetrics file, keeping the original log
+timestamps, so that the history can be loaded into the prom-long database with:
+
+    promtool tsdb create-blocks-from openmetrics <output file> <prom-long data directory>
+
+Logs are read line by line and every metric family is spooled to its own temporary file,
+so memory use stays constant whatever the size of the log directory.
+"""
+
+import os
+import sys
+import time
+import shutil
+import argparse
+import tempfile
+import subprocess
+from datetime import datetime
+
+import speclogs
+
+# Job names of the historical prom-long scrape configs, for data scraped on the legacy ports
+LEGACY_JOBS = {'helium': 'HeliumMetrics', 'nitrogen': 'NitrogenMetrics', 'field': 'FieldMetrics',
+               'shims': 'ShimMetrics', 'events': 'EventLogs'}
+DEFAULT_JOB = 'SpectrometerMetrics'
+REPORT_EVERY = 1000000 # lines between progress reports
+
+
+# Argparse block
+def parse_arguments():
+    parser = argparse.ArgumentParser(description="Convert spectrometer logs into OpenMetrics for a prom-long backfill.")
+    parser.add_argument('paths', nargs='+', help='Log files, or directories containing them')
+    parser.add_argument('-o', '--output', required=True, help='OpenMetrics file to write')
+    parser.add_argument('-n', '--instance', required=True,
+                        help='Machine name used in prom-long (the alias given to setup, e.g. 600MHz)')
+    parser.add_argument('--legacy-jobs', action='store_true',
+                        help='Label the data with the per-metric grok jobs and ports instead of the SCANS exporter')
+    parser.add_argument('-s', '--start', help='Skip readings before this date (YYYY-MM-DD), e.g. beyond retention')
+    parser.add_argument('--create-blocks', metavar='DATA_DIR',
+                        help='Run promtool on the output to write TSDB blocks into DATA_DIR')
+    return parser.parse_args()
+
+
+def find_logs(paths):
+    """
+    Expand the given files and directories into (path, parser) pairs for every known log.
+
+    Raises:
+        ValueError: If an explicitly given file is not a known spectrometer log.
+    """
+    logs = []
+    for path in paths:
+        if os.path.isdir(path):
+            for name in sorted(os.listdir(path)):
+                try:
+                    logs.append((os.path.join(path, name), speclogs.get_parser(name)))
+                except ValueError:
+                    continue
+        else:
+            logs.append((path, speclogs.get_parser(os.path.basename(path))))
+    return logs
+
+
+def read_records(path, parser):
+    """
+    Generate the parsed samples of a log file, one list per line, without loading the file.
+    """
+    with open(path, 'r', encoding='utf-8', errors='replace') as file:
+        for line in file:
+            yield parser(line)
+
+
+def series_labels(sample, instance, legacy_jobs):
+    """
+    Add the job and instance labels Prometheus would have attached when scraping the sample.
+    """
+    group = speclogs.describe(sample.name)[0]
+    if legacy_jobs and group in LEGACY_JOBS:
+        job, port = LEGACY_JOBS[group], speclogs.GROUP_PORTS[group]
+    else:
+        job, port = DEFAULT_JOB, speclogs.EXPORTER_PORT
+    return sample.labels + (('instance', f"{instance}:{port}"), ('job', job))
+
+
+def format_sample(name, labels, value, timestamp):
+    escaped = (text.replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n') for _, text in labels)
+    label_text = ','.join(f'{key}="{text}"' for (key, _), text in zip(labels, escaped))
+    return f"{name}{{{label_text}}} {value!r} {timestamp:.3f}\n"
+
+
+def convert(logs, output, instance, legacy_jobs=False, start=None):
+    """
+    Stream every log into per-family spool files, then join them into one OpenMetrics file.
+
+    Args:
+        logs (list): (path, parser) pairs from find_logs.
+        output (str): Path of the OpenMetrics file to write.
+        instance (str): Machine name for the instance label.
+        legacy_jobs (bool): Use the per-metric grok job names and ports.
+        start (float): Epoch seconds before which readings are skipped.
+
+    Returns:
+        tuple: Total lines read and samples written.
+    """
+    spool_dir = tempfile.mkdtemp(prefix='scans-backfill-', dir=os.path.dirname(os.path.abspath(output)))
+    spools = {}
+    last_timestamps = {}
+    total_lines = total_samples = 0
+    begin = time.time()
+
+    try:
+        for path, parser in logs:
+            file_begin = time.time()
+            lines = samples = 0
+            for record in read_records(path, parser):
+                lines += 1
+                for sample in record:
+                    if start is not None and sample.timestamp < start:
+                        continue
+                    # Prometheus rejects duplicate or out-of-order samples within a series.
+                    # Labelled series (events) carry their own date, so only plain gauges are tracked.
+                    if not sample.labels:
+                        if sample.timestamp <= last_timestamps.get(sample.name, float('-inf')):
+                            continue
+                        last_timestamps[sample.name] = sample.timestamp
+                    if sample.name not in spools:
+                        spools[sample.name] = open(os.path.join(spool_dir, sample.name), 'w', encoding='utf-8')
+                    labels = series_labels(sample, instance, legacy_jobs)
+                    spools[sample.name].write(format_sample(sample.name, labels, sample.value, sample.timestamp))
+                    samples += 1
+                if lines % REPORT_EVERY == 0:
+                    print(f"  {path}: {lines} lines ({lines / (time.time() - file_begin):.0f} rows/s)")
+
+            elapsed = max(time.time() - file_begin, 1e-9)
+            print(f"{path}: {lines} lines, {samples} samples in {elapsed:.2f} s ({lines / elapsed:.0f} rows/s)")
+            total_lines += lines
+            total_samples += samples
+
+        # Metric families must not be interleaved in OpenMetrics, so they are written one after the other
+        with open(output, 'w', encoding='utf-8') as out:
+            for name in sorted(spools):
+                spools[name].close()
+                out.write(f"# HELP {name} {speclogs.describe(name)[1]}\n")
+                out.write(f"# TYPE {name} gauge\n")
+                with open(os.path.join(spool_dir, name), 'r', encoding='utf-8') as spool:
+                    shutil.copyfileobj(spool, out)
+            out.write("# EOF\n")
+    finally:
+        for spool in spools.values():
+            spool.close()
+        shutil.rmtree(spool_dir, ignore_errors=True)
+
+    elapsed = max(time.time() - begin, 1e-9)
+    print(f"\nTotal: {total_lines} lines, {total_samples} samples in {elapsed:.2f} s ({total_lines / elapsed:.0f} rows/s)")
+    return total_lines, total_samples
+
+
+def main():
+    args = parse_arguments()
+    start = datetime.strptime(args.start, '%Y-%m-%d').timestamp() if args.start else None
+
+    try:
+        logs = find_logs(args.paths)
+    except ValueError as e:
+        print(f"Error: {e}")
+        sys.exit(1)
+    if not logs:
+        print("No spectrometer logs found.")
+        sys.exit(1)
+
+    convert(logs, args.output, args.instance, args.legacy_jobs, start)
+    print(f"OpenMetrics written to {args.output}")
+
+    command = ['promtool', 'tsdb', 'create-blocks-from', 'openmetrics', args.output]
+    if args.create_blocks:
+        if shutil.which('promtool') is None:
+            print("promtool was not found in your path.")
+            sys.exit(1)
+        subprocess.run(command + [args.create_blocks], check=True)
+    else:
+        print("\nTo load it into prom-long, copy the file to the monitor and run, for example:")
+        print(f"sudo docker cp {args.output} prom-long:/prometheus/backfill.om")
+        print("sudo docker exec prom-long " + ' '.join(command[:-1]) + " /prometheus/backfill.om /prometheus")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,147 @@
+"""
+Benchmark of the columnar rtshims.log parser against the grok path
+
+A synthetic rtshims.log is generated (shim currents change rarely, the shimcoil temperature
+more often) and parsed twice:
+  - grok: every line goes through each regex of the grok shim.yml configuration, one capture
+    per column, as grok-exporter does for each of its metrics (emulated here with Python's re)
+  - columnar: lines are parsed in blocks by shimlog.ShimParser, emitting changed channels only
+Throughput is reported in lines per second, and allocations as the tracemalloc peak.
+
+Usage: python3 bench_shims.py [--lines 2000000] [--alloc-lines 200000]
+"""
+
+import os
+import re
+import time
+import random
+import argparse
+import tempfile
+import tracemalloc
+from itertools import islice
+
+import yaml
+
+import shimlog
+import speclogs
+
+GROK_CONFIG = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'grok', 'mics', 'shim.yml')
+
+# Python equivalents of the grok patterns used by the SCANS configurations
+GROK_PATTERNS = {
+    'NUMBER': r'[+-]?(?:\d+(?:\.\d+)?|\.\d+)',
+    'TIMESTAMP_ISO8601': r'\d{4}-\d{2}-\d{2}[T ]\d{2}:?\d{2}(?::?\d{2}(?:\.\d+)?)?(?:Z|[+-]\d{2}:?\d{2})?',
+    'GREEDYDATA': r'.*',
+}
+
+
+# Argparse block
+def parse_arguments():
+    parser = argparse.ArgumentParser(description="Benchmark the columnar shim parser against the grok regexes.")
+    parser.add_argument('-n', '--lines', type=int, default=2000000, help='Lines in the synthetic rtshims.log')
+    parser.add_argument('-a', '--alloc-lines', type=int, default=200000, help='Lines parsed under tracemalloc')
+    parser.add_argument('-k', '--keep', action='store_true', help='Keep the synthetic log file')
+    return parser.parse_args()
+
+
+def grok_to_regex(match):
+    """
+    Translate a grok match expression into a compiled Python regex.
+    """
+    def replace(found):
+        pattern, _, name = found.group(1).partition(':')
+        return f"(?P<{name}>{GROK_PATTERNS[pattern]})" if name else f"(?:{GROK_PATTERNS[pattern]})"
+    return re.compile(re.sub(r'%\{(\w+(?::\w+)?)\}', replace, match))
+
+
+def write_synthetic_log(path, lines):
+    """
+    Write a synthetic rtshims.log: the temperature changes every ~100 lines, one shim every ~50000.
+    """
+    random.seed(1)
+    shims = [random.randint(-50000, 50000) for _ in range(len(shimlog.CHANNELS) - 1)]
+    temperature = 20.0
+    start = 1600000000
+    with open(path, 'w') as file:
+        file.write("# timestamp ; shimcoil temp [C] ; " + ' ; '.join(speclogs.SHIM_COLUMNS) + "\n")
+        for i in range(lines):
+            if random.random() < 0.01:
+                temperature = round(temperature + random.choice((-1, 1)), 2)
+            if random.random() < 0.00002:
+                shims[random.randrange(len(shims))] += random.randint(-100, 100)
+            stamp = time.strftime('%Y-%m-%dT%H:%M:%S', time.gmtime(start + i * 60)) + '.000+0000'
+            file.write(f"{stamp};{temperature:.2f};" + ';'.join(map(str, shims)) + "\n")
+
+
+def run_grok(path, limit, regexes):
+    values = {}
+    count = 0
+    with open(path, 'r') as file:
+        for line in islice(file, limit):
+            count += 1
+            for name, regex in regexes:
+                match = regex.match(line)
+                if match:
+                    values[name] = float(match.group(name))
+    return count
+
+
+def run_columnar(path, limit):
+    values = {}
+    count = 0
+    parser = shimlog.ShimParser()
+    with open(path, 'r') as file:
+        lines = islice(file, limit)
+        while True:
+            block = list(islice(lines, shimlog.BLOCK_SIZE))
+            if not block:
+                break
+            count += len(block)
+            for sample in parser.parse_lines(block):
+                values[sample.name] = sample.value
+    return count
+
+
+def measure(label, function, *args):
+    begin = time.perf_counter()
+    lines = function(*args)
+    elapsed = time.perf_counter() - begin
+    print(f"{label:>10}: {lines} lines in {elapsed:.2f} s ({lines / elapsed:,.0f} lines/s)")
+    return lines / elapsed
+
+
+def measure_allocations(label, function, *args):
+    tracemalloc.start()
+    function(*args)
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    print(f"{label:>10}: peak {peak / 1024:,.0f} KiB allocated")
+
+
+def main():
+    args = parse_arguments()
+    with open(GROK_CONFIG) as file:
+        config = yaml.safe_load(file)
+    regexes = [(metric['name'], grok_to_regex(metric['match'])) for metric in config['metrics']]
+
+    path = os.path.join(tempfile.gettempdir(), 'scans-bench-rtshims.log')
+    print(f"Writing {args.lines} synthetic lines to {path}")
+    write_synthetic_log(path, args.lines)
+    print(f"{os.path.getsize(path) / 1024 ** 2:.0f} MiB, {len(regexes)} grok regexes from {os.path.basename(GROK_CONFIG)}\n")
+
+    try:
+        print("Throughput")
+        grok_rate = measure('grok', run_grok, path, args.lines, regexes)
+        columnar_rate = measure('columnar', run_columnar, path, args.lines)
+        print(f"{'speed-up':>10}: x{columnar_rate / grok_rate:.1f}\n")
+
+        print(f"Allocations ({args.alloc_lines} lines)")
+        measure_allocations('grok', run_grok, path, args.alloc_lines, regexes)
+        measure_allocations('columnar', run_columnar, path, args.alloc_lines)
+    finally:
+        if not args.keep:
+            os.remove(path)
+
+
+if __name__ == "__main__":
+    main()
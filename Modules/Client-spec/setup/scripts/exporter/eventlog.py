@@ -0,0 +1,157 @@
+"""
+Incremental ingester for events.log
+
+The spectrometer repeats the same few messages (e.g. GYR_CF: JAC/CMU Communication Error)
+for years, each with a new timestamp. Exporting every line as its own labelled series makes
+prom-long churn through one series per event. Here repeated messages are folded into
+counters with first-seen and last-seen timestamps, and totals are kept per severity and
+equipment category, so the number of series stays bounded however chatty the spectrometer is.
+
+The file is followed with logtail.FileTail, and the counters are kept in the same state as
+its offset, so a restart neither re-reads the whole log nor loses or double-counts events.
+"""
+
+import logging
+
+import speclogs
+import logtail
+
+# Severity codes of the second events.log column
+SEVERITIES = {'0': 'notification', '1': 'warning', '2': 'error', '3': 'alert'}
+MAX_MESSAGES = 200 # distinct messages exported; the least recently seen are dropped first
+STATE_KEY = 'events' # entry of the tail state holding the counters
+
+
+def normalise_description(description):
+    """
+    Flatten a multi-line description: the #CRLF markers (and any real line breaks) become spaces.
+    """
+    return ' '.join(description.replace('#CRLF;', ' ').replace('#CRLF', ' ').split())
+
+
+class EventLog:
+    """
+    Follow events.log and fold its records into bounded-cardinality metrics.
+
+    Args:
+        path (str): Path of events.log.
+        state (logtail.TailState): State shared with the other tails (None keeps it in memory).
+        max_messages (int): Number of distinct messages exported with their description.
+    """
+
+    def __init__(self, path, state=None, max_messages=MAX_MESSAGES):
+        self.state = state if state is not None else logtail.TailState()
+        self.tail = logtail.FileTail(path, self.state, from_start=True)
+        self.max_messages = max_messages
+
+        saved = self.state.data.get(STATE_KEY, {})
+        try:
+            self.totals = {(severity, cat): [count, last] for severity, cat, count, last in saved.get('totals', [])}
+            self.messages = {(severity, cat, description): [count, first, last]
+                             for severity, cat, description, count, first, last in saved.get('messages', [])}
+            self.pending = saved.get('pending', '')
+        except (TypeError, ValueError) as e:
+            logging.warning(f"Ignoring the saved event counters: {e}")
+            self.totals, self.messages, self.pending = {}, {}, ''
+
+    def poll(self):
+        """
+        Ingest the records appended since the last poll.
+
+        Returns:
+            tuple: Samples of the series that changed, and the (name, labels) keys of the
+            series that were dropped to stay within max_messages.
+        """
+        changed_totals, changed_messages = set(), set()
+        lines = self.tail.read()
+        while lines:
+            for severity, cat, description, timestamp in self._records(lines):
+                total = self.totals.setdefault((severity, cat), [0, timestamp])
+                total[0] += 1
+                total[1] = max(total[1], timestamp)
+                message = self.messages.setdefault((severity, cat, description), [0, timestamp, timestamp])
+                message[0] += 1
+                message[2] = max(message[2], timestamp)
+                changed_totals.add((severity, cat))
+                changed_messages.add((severity, cat, description))
+            lines = self.tail.read()
+
+        stale = self._evict()
+        changed_messages.difference_update(stale)
+        self._remember()
+        return self._samples(changed_totals, changed_messages), self._keys(stale)
+
+    def samples(self):
+        """
+        Return the samples of every exported series (used to seed the store at start-up).
+        """
+        return self._samples(self.totals, self.messages)
+
+    def _records(self, lines):
+        """
+        Generate (severity, cat, description, timestamp) for the complete records in lines.
+
+        A record normally fits on one line, but a description with a real line break continues
+        on the following lines; the record is complete once it ends with its equipment category.
+        """
+        for line in lines:
+            if not line.strip() or line.startswith('#'):
+                continue
+            # A line starting with a timestamp begins a new record; an incomplete one before it is dropped
+            self.pending = f"{self.pending} {line}" if self.pending and not starts_record(line) else line
+            samples = speclogs.parse_event_line(self.pending)
+            if samples:
+                sample = samples[0]
+                labels = dict(sample.labels)
+                severity = SEVERITIES.get(str(int(sample.value)), 'unknown')
+                yield severity, labels['cat'], normalise_description(labels['description']), sample.timestamp
+                self.pending = ''
+
+    def _evict(self):
+        """
+        Drop the least recently seen messages beyond max_messages, returning their keys.
+        """
+        excess = len(self.messages) - self.max_messages
+        if excess <= 0:
+            return set()
+        stale = set(sorted(self.messages, key=lambda key: self.messages[key][2])[:excess])
+        for key in stale:
+            del self.messages[key]
+        return stale
+
+    def _samples(self, totals, messages):
+        samples = []
+        for severity, cat in totals:
+            count, last_seen = self.totals[(severity, cat)]
+            labels = (('cat', cat), ('severity', severity))
+            samples.append(speclogs.Sample('events_total', labels, float(count), last_seen))
+            samples.append(speclogs.Sample('events_last_seen_timestamp_seconds', labels, last_seen, last_seen))
+        for key in messages:
+            count, first_seen, last_seen = self.messages[key]
+            labels = message_labels(key)
+            samples.append(speclogs.Sample('events_message_total', labels, float(count), last_seen))
+            samples.append(speclogs.Sample('events_message_first_seen_timestamp_seconds', labels, first_seen, last_seen))
+            samples.append(speclogs.Sample('events_message_last_seen_timestamp_seconds', labels, last_seen, last_seen))
+        return samples
+
+    def _keys(self, messages):
+        return [(name, message_labels(key)) for key in messages
+                for name in ('events_message_total', 'events_message_first_seen_timestamp_seconds',
+                             'events_message_last_seen_timestamp_seconds')]
+
+    def _remember(self):
+        # Stored next to the tail offset, so both are saved together by TailState.save
+        self.state.data[STATE_KEY] = {
+            'totals': [[*key, *value] for key, value in self.totals.items()],
+            'messages': [[*key, *value] for key, value in self.messages.items()],
+            'pending': self.pending,
+        }
+
+
+def starts_record(line):
+    return len(line) > 10 and line[4] == '-' and line[7] == '-' and line[10] == 'T' and line[:4].isdigit()
+
+
+def message_labels(key):
+    severity, cat, description = key
+    return (('cat', cat), ('description', description), ('severity', severity))
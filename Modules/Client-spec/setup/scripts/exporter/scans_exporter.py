@@ -0,0 +1,230 @@
+"""
+SCANS spectrometer exporter
+
+A single-process replacement for the grok-exporter containers of the Client-spec module.
+All MICS or diskless logs are followed by one process, every line is parsed once, and all
+metrics are served from a single /metrics endpoint. With --legacy-ports the metrics are
+also split over the historical per-metric ports (9144-9148) for existing Prometheus configs.
+
+events.log is folded into counters per severity, equipment category and message (see
+eventlog.py) rather than exported line by line.
+
+Logs are followed with the shared logtail module: rotation and truncation are detected from
+the inode and size, inotify wakes the exporter as soon as a log is written, and the offsets
+are saved in --state-dir so a restart reads only what was written while it was stopped.
+
+With --timestamps the latest reading of every series is exposed with its log timestamp
+rather than the scrape time, once per new reading: a scrape holds at most one sample per
+series, so Prometheus never receives them out of order. Readings superseded between two
+scrapes are not exposed; they are loaded from the logs by backfill.py. Only a scrape naming
+itself with ?consumer=<name> (set in the scrape params of prom-long) marks the readings as
+served; any other GET, such as the probes of the monitor discovery or a manual curl, gets the
+latest values without timestamps and leaves the readings to the consumers.
+"""
+
+import os
+import sys
+import logging
+import argparse
+import threading
+from urllib.parse import urlsplit, parse_qs
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+# Shared SCANS modules: copied into ./shared by setup, or found in Modules/Shared of a checkout
+sys.path += [os.path.join(HERE, 'shared'), os.path.join(HERE, '..', '..', '..', '..', 'Shared')]
+
+import logtail
+import speclogs
+import shimlog
+import eventlog
+
+POLL_INTERVAL = 5 # maximum seconds between checks of the log files (inotify usually wakes the exporter sooner)
+STATE_FILE = 'tail.state.json' # log offsets and event counters, in --state-dir
+UNSTAMPED = speclogs.COUNTERS | {'scans_exporter_info'} # always exposed without a log timestamp
+
+
+# Argparse block
+def parse_arguments():
+    parser = argparse.ArgumentParser(description="Export spectrometer log metrics for Prometheus.")
+    parser.add_argument('-m', '--method', required=True, choices=sorted(speclogs.METHOD_LOGS),
+                        help='The log layout chosen by setup (mics, separate or combined)')
+    parser.add_argument('-l', '--log-dir', default='/opt/logs', help='Directory containing the spectrometer logs')
+    parser.add_argument('-p', '--port', type=int, default=speclogs.EXPORTER_PORT, help='Port of the combined /metrics endpoint')
+    parser.add_argument('--legacy-ports', action='store_true', help='Also serve each metric group on its historical grok port')
+    parser.add_argument('-i', '--interval', type=float, default=POLL_INTERVAL, help='Maximum seconds between checks of the log files')
+    parser.add_argument('-t', '--timestamps', action='store_true',
+                        help='Expose the latest reading of each series with its log timestamp, once per new reading')
+    parser.add_argument('-s', '--state-dir', default='/app/state', help='Writable directory for the log offsets')
+    parser.add_argument('--max-messages', type=int, default=eventlog.MAX_MESSAGES,
+                        help='Number of distinct event messages exported with their description')
+    parser.add_argument('--log-stdout', action='store_true', help='Enable logging messages to STDOUT')
+    return parser.parse_args()
+
+
+class MetricStore:
+    """
+    Thread-safe store of the parsed samples, rendered in the Prometheus text format.
+
+    By default only the latest value of every series is served, as grok-exporter does. With
+    timestamps, each consumer (a scraper naming itself, on one endpoint) is served the latest
+    reading of every series updated since its own previous scrape, with its log timestamp, and
+    nothing for the other series, so every sample it receives is newer than the previous one
+    of its series. Counters and scans_exporter_info are always served, without a timestamp.
+    Without a consumer, the latest values are served without timestamps.
+    """
+
+    def __init__(self, timestamps=False):
+        self._lock = threading.Lock()
+        self._values = {}
+        self._timestamps = timestamps
+        self._updated = {}
+        self._sequence = 0
+        self._cursors = {}
+
+    def remove(self, keys):
+        with self._lock:
+            for key in keys:
+                self._values.pop(key, None)
+                self._updated.pop(key, None)
+
+    def update(self, samples):
+        with self._lock:
+            for sample in samples:
+                key = (sample.name, sample.labels)
+                self._values[key] = sample
+                self._sequence += 1
+                self._updated[key] = self._sequence
+
+    def render(self, groups=None, consumer=None):
+        with self._lock:
+            series = [(key, sample, self._updated[key]) for key, sample in sorted(self._values.items())]
+            since = None
+            if self._timestamps and consumer is not None:
+                since = self._cursors.get(consumer, 0)
+                self._cursors[consumer] = self._sequence
+
+        lines = []
+        current = None
+        for (name, labels), latest, updated in series:
+            group, help_text = speclogs.describe(name)
+            if groups is not None and group not in groups:
+                continue
+            stamped = since is not None and name not in UNSTAMPED and latest.timestamp is not None
+            if stamped and updated <= since:
+                # Already served: repeating it would only be dropped or rejected as out of bounds
+                continue
+            if name != current:
+                lines.append(f"# HELP {name} {help_text}")
+                lines.append(f"# TYPE {name} {'counter' if name in speclogs.COUNTERS else 'gauge'}")
+                current = name
+            stamp = f" {int(latest.timestamp * 1000)}" if stamped else ''
+            lines.append(f"{name}{format_labels(labels)} {latest.value!r}{stamp}")
+        return '\n'.join(lines) + '\n'
+
+
+def format_labels(labels):
+    if not labels:
+        return ''
+    escaped = (text.replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n') for _, text in labels)
+    return '{' + ','.join(f'{key}="{text}"' for (key, _), text in zip(labels, escaped)) + '}'
+
+
+def get_block_parser(log_name):
+    """
+    Return a function parsing a list of new lines of the given log into samples.
+
+    rtshims.log goes through the columnar shim parser, which only emits the channels that changed.
+    """
+    if log_name == 'rtshims.log':
+        return shimlog.ShimParser().parse_lines
+    parser = speclogs.get_parser(log_name)
+    return lambda lines: [sample for line in lines for sample in parser(line)]
+
+
+def make_handler(store, groups=None, endpoint=None):
+    """
+    Build a request handler serving the metrics of the given groups (all groups if None).
+    In --timestamps mode, what was served is tracked per endpoint and ?consumer= parameter.
+    """
+    class MetricsHandler(BaseHTTPRequestHandler):
+        def do_GET(self):
+            url = urlsplit(self.path)
+            if url.path not in ('/', '/metrics'):
+                self.send_error(404)
+                return
+            consumer = parse_qs(url.query).get('consumer', [None])[0]
+            body = store.render(groups, (endpoint, consumer) if consumer else None).encode('utf-8')
+            self.send_response(200)
+            self.send_header('Content-Type', 'text/plain; version=0.0.4; charset=utf-8')
+            self.send_header('Content-Length', str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def log_message(self, format, *args):
+            logging.debug(format % args)
+
+    return MetricsHandler
+
+
+def start_server(port, handler):
+    server = ThreadingHTTPServer(('', port), handler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    logging.info(f"Serving metrics on port {port}")
+    return server
+
+
+def main():
+    args = parse_arguments()
+    if args.log_stdout:
+        logging.basicConfig(level=logging.INFO)
+
+    store = MetricStore(args.timestamps)
+    store.update([speclogs.Sample('scans_exporter_info', (('method', args.method),), 1.0, None)])
+    start_server(args.port, make_handler(store, endpoint=args.port))
+    if args.legacy_ports:
+        for group, port in speclogs.GROUP_PORTS.items():
+            start_server(port, make_handler(store, {group}, endpoint=port))
+
+    state_path = os.path.join(args.state_dir, STATE_FILE) if os.access(args.state_dir, os.W_OK) else None
+    if state_path is None:
+        logging.warning(f"{args.state_dir} is not writable, log offsets will not survive a restart")
+    state = logtail.TailState(state_path)
+
+    logs = speclogs.METHOD_LOGS[args.method]
+    paths = [os.path.join(args.log_dir, name) for name in logs]
+    sources = []
+    for name, path in zip(logs, paths):
+        if name == 'events.log':
+            continue
+        tail = logtail.FileTail(path, state)
+        parser = get_block_parser(name)
+        # First sight of a log: only report its latest line, as grok does with readall: false
+        if not tail.resumed:
+            seed = tail.last_line()
+            if seed:
+                store.update(parser([seed]))
+        sources.append((tail, parser))
+
+    events = None
+    if 'events.log' in logs:
+        events = eventlog.EventLog(os.path.join(args.log_dir, 'events.log'), state, args.max_messages)
+        store.update(events.samples())
+
+    watcher = logtail.Watcher(paths)
+    while True:
+        for tail, parser in sources:
+            lines = tail.read()
+            while lines:
+                store.update(parser(lines))
+                lines = tail.read()
+        if events:
+            samples, stale = events.poll()
+            store.remove(stale)
+            store.update(samples)
+        state.save()
+        watcher.wait(args.interval)
+
+
+if __name__ == "__main__":
+    main()
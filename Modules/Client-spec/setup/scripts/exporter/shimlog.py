@@ -0,0 +1,127 @@
+"""
+Columnar parser for rtshims.log
+
+Every rtshims.log line carries the shimcoil temperature and 39 gradient currents, most of
+which stay constant for weeks. Lines are parsed a block at a time into a preallocated NumPy
+structured array, and only the channels that changed since the previous line become samples.
+"""
+
+import warnings
+
+import numpy as np
+
+import speclogs
+
+BLOCK_SIZE = 4096 # lines parsed per block
+
+# Metric names of the rtshims.log columns following the timestamp
+CHANNELS = speclogs.COLUMN_LOGS['rtshims.log']
+
+# One row per log line; all fields are float64 so a block can also be viewed as a 2D matrix
+SHIM_DTYPE = np.dtype([('timestamp', 'f8')] + [(name, 'f8') for name in CHANNELS])
+
+
+class ShimParser:
+    """
+    Parse rtshims.log lines into samples, a block at a time.
+
+    Args:
+        block_size (int): Number of rows of the preallocated structured array.
+        changes_only (bool): Only emit the channels whose value differs from the previous line.
+            The first line ever parsed always emits every channel.
+    """
+
+    def __init__(self, block_size=BLOCK_SIZE, changes_only=True):
+        self.block_size = block_size
+        self.changes_only = changes_only
+        self.block = np.zeros(block_size, dtype=SHIM_DTYPE)
+        self._matrix = self.block.view(np.float64).reshape(block_size, len(CHANNELS) + 1)
+        self._previous = None
+        self._offsets = {}
+
+    def parse_lines(self, lines):
+        """
+        Parse any number of raw lines (comments and malformed lines are skipped).
+
+        Returns:
+            list: Samples in line order.
+        """
+        rows = [line.strip() for line in lines]
+        rows = [row for row in rows if row and not row.startswith('#')]
+
+        samples = []
+        for start in range(0, len(rows), self.block_size):
+            count = self._fill(rows[start:start + self.block_size])
+            if count:
+                samples.extend(self._samples(count))
+        return samples
+
+    def _fill(self, rows):
+        """
+        Write rows into the preallocated block, returning the number of rows written.
+        """
+        rows = [row for row in rows if row.count(';') == len(CHANNELS)]
+        if not rows:
+            return 0
+
+        stamps, values = zip(*(row.split(';', 1) for row in rows))
+        try:
+            with warnings.catch_warnings():
+                warnings.simplefilter('ignore')
+                numbers = np.fromstring(';'.join(values), sep=';')
+            if numbers.size != len(rows) * len(CHANNELS):
+                raise ValueError("malformed value in block")
+            count = len(rows)
+            self._matrix[:count, 1:] = numbers.reshape(count, len(CHANNELS))
+            self._matrix[:count, 0] = self._timestamps(stamps)
+            return count
+        except ValueError:
+            return self._fill_slowly(rows)
+
+    def _fill_slowly(self, rows):
+        """
+        Row-by-row fallback for blocks containing malformed lines, which are skipped.
+        """
+        count = 0
+        for row in rows:
+            stamp, values = row.split(';', 1)
+            try:
+                self._matrix[count, 1:] = [float(value) for value in values.split(';')]
+                self._matrix[count, 0] = speclogs.parse_iso_timestamp(stamp)
+            except ValueError:
+                continue
+            count += 1
+        return count
+
+    def _timestamps(self, stamps):
+        """
+        Vectorised conversion of MICS timestamps (2020-10-13T15:54:23.704+0200) to epoch seconds.
+        """
+        local = np.array([stamp[:23] for stamp in stamps], dtype='datetime64[ms]').astype(np.int64) / 1000.0
+        return local - np.array([self._offset(stamp[23:]) for stamp in stamps])
+
+    def _offset(self, text):
+        # Only a handful of UTC offsets ever appear (summer/winter time), so they are cached
+        if text not in self._offsets:
+            if len(text) != 5 or text[0] not in '+-' or not text[1:].isdigit():
+                raise ValueError(f"Invalid UTC offset: {text}")
+            seconds = int(text[1:3]) * 3600 + int(text[3:5]) * 60
+            self._offsets[text] = -seconds if text[0] == '-' else seconds
+        return self._offsets[text]
+
+    def _samples(self, count):
+        channels = self._matrix[:count, 1:]
+        timestamps = self._matrix[:count, 0]
+
+        if self.changes_only:
+            # Compare every row with the one before it; NaN never compares equal, so a first row emits everything
+            previous = np.empty_like(channels)
+            previous[0] = np.nan if self._previous is None else self._previous
+            previous[1:] = channels[:-1]
+            rows, columns = np.nonzero(channels != previous)
+        else:
+            rows, columns = np.indices(channels.shape).reshape(2, -1)
+        self._previous = channels[count - 1].copy()
+
+        return [speclogs.Sample(CHANNELS[column], (), float(channels[row, column]), float(timestamps[row]))
+                for row, column in zip(rows.tolist(), columns.tolist())]
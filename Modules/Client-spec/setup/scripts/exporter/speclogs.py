@@ -0,0 +1,212 @@
+"""
+Parsers for the Bruker spectrometer logs (MICS, old-style and new-style diskless)
+
+Every parser turns a single log line into a list of Sample tuples, so the same code
+can feed the live SCANS exporter and any offline tools working on the log files.
+"""
+
+import re
+from collections import namedtuple
+from datetime import datetime
+from functools import lru_cache, partial
+
+# One parsed reading: metric name, label pairs, value and log timestamp (epoch seconds, or None)
+Sample = namedtuple('Sample', ['name', 'labels', 'value', 'timestamp'])
+
+# Gradient columns of rtshims.log (after the timestamp and shimcoil temperature)
+SHIM_COLUMNS = ['Z', 'Z2', 'Z3', 'Z4', 'Z5', 'X', 'XZ', 'XZ2', '(X2-Y2)', 'XY', 'Y', 'YZ', 'YZ2',
+                '(X2-Y2)Z2', 'XZ4', 'XZ3', 'Z6', '(X2-Y2)Z', 'YZ4', 'YZ3', 'XYZ2', 'XYZ', 'X3Z', 'X3',
+                'Y3Z', 'Y3', 'Z7', 'Z8', 'Z9', 'Z10', 'XZ5', 'YZ5', '(X2-Y2)Z3', '(X2-Y2)Z4',
+                '(X2-Y2)Z5', 'XYZ3', 'XYZ4', 'XYZ5', 'Z0']
+
+# Default port of the SCANS exporter and the historical grok port of each metric group
+EXPORTER_PORT = 9156
+GROUP_PORTS = {'helium': 9144, 'nitrogen': 9145, 'field': 9146, 'shims': 9147, 'events': 9148}
+
+# Log files followed for each setup method (see setup_spectrometer in setup_scans.py)
+METHOD_LOGS = {
+    'mics': ['heliumlogcache.log', 'nitrogenlogcache.log', 'field.log', 'rtshims.log', 'events.log'],
+    'separate': ['helium.log', 'nitrogen.log', 'field.log', 'rtshims.log', 'events.log'],
+    'combined': ['heliumlog'],
+}
+
+
+def shim_metric_name(column):
+    """
+    Build the metric name of a shim gradient column, e.g. '(X2-Y2)Z2' -> 'shimcoil_x2_y2_z2'.
+    """
+    return 'shimcoil_' + re.sub(r'[^a-z0-9]+', '_', column.lower()).strip('_')
+
+
+# Metric group and help text for every metric the parsers can produce.
+# Names match the historical grok configurations so existing dashboards keep working.
+METRICS = {
+    'helium_level': ('helium', 'The helium level value as stored in the spectrometer logs'),
+    'nitrogen_level': ('nitrogen', 'The nitrogen level value as stored in the spectrometer logs'),
+    'field': ('field', 'The field parameter as stored in the Bruker logs'),
+    'field_fu': ('field', 'The field level value (FU) as stored in the spectrometer logs'),
+    'field_hz': ('field', 'The field level value (Hz) as stored in the spectrometer logs'),
+    'field_1h': ('field', 'The field level value (1H) as stored in the spectrometer logs'),
+    'shimcoil_temp': ('shims', 'The shimcoil temp as stored in the spectrometer logs'),
+    'events': ('events', 'The events recorded in the spectrometer logs'),
+    'events_total': ('events', 'Number of events recorded in the spectrometer logs per severity and equipment category'),
+    'events_last_seen_timestamp_seconds': ('events', 'Time of the latest event per severity and equipment category'),
+    'events_message_total': ('events', 'Number of times each recent event message was recorded'),
+    'events_message_first_seen_timestamp_seconds': ('events', 'Time each recent event message was first recorded'),
+    'events_message_last_seen_timestamp_seconds': ('events', 'Time each recent event message was last recorded'),
+    'scans_exporter_info': ('exporter', 'SCANS exporter identification (always 1), used by the monitor setup'),
+}
+for _column in SHIM_COLUMNS:
+    METRICS[shim_metric_name(_column)] = ('shims', f'The {_column} shim current as stored in the spectrometer logs')
+
+# Metrics exposed as counters; every other metric is a gauge
+COUNTERS = {'events_total', 'events_message_total'}
+
+# Metric columns (after the timestamp) of the semicolon separated MICS and old diskless logs
+COLUMN_LOGS = {
+    'helium.log': ['helium_level'],
+    'heliumlogcache.log': ['helium_level'],
+    'nitrogen.log': ['nitrogen_level'],
+    'nitrogenlogcache.log': ['nitrogen_level'],
+    'field.log': ['field_fu', 'field_hz', 'field_1h'],
+    'rtshims.log': ['shimcoil_temp'] + [shim_metric_name(column) for column in SHIM_COLUMNS],
+}
+
+MONTHS = {month: number for number, month in enumerate(
+    ['Jan', 'Feb', 'Mar', 'Apr', 'May', 'Jun', 'Jul', 'Aug', 'Sep', 'Oct', 'Nov', 'Dec'], 1)}
+
+
+@lru_cache(maxsize=None)
+def metric_name(label):
+    """
+    Build a metric name from a heliumlog label, e.g. 'helium level' -> 'helium_level'.
+    """
+    return re.sub(r'[^a-z0-9]+', '_', label.lower()).strip('_')
+
+
+def describe(name):
+    """
+    Return the (group, help) pair of a metric. Labels Bruker adds to heliumlog in the
+    future are not known here; they are exported in an 'other' group with a generic help.
+    """
+    return METRICS.get(name, ('other', f"The {name.replace('_', ' ')} value as stored in the Bruker logs"))
+
+
+def parse_ctime(text):
+    """
+    Convert a ctime timestamp (e.g. Tue Oct 18 04:15:01 2022, local time) to epoch seconds.
+    """
+    _, month, day, clock, year = text.split()
+    hour, minute, second = clock.split(':')
+    return datetime(int(year), MONTHS[month], int(day), int(hour), int(minute), int(second)).timestamp()
+
+
+def parse_iso_timestamp(text):
+    """
+    Convert a MICS/diskless timestamp (e.g. 2020-10-13T15:52:00.000+0200) to epoch seconds.
+    """
+    return datetime.strptime(text, '%Y-%m-%dT%H:%M:%S.%f%z').timestamp()
+
+
+def parse_column_line(columns, line):
+    """
+    Parse one line of a semicolon separated log into samples.
+
+    Args:
+        columns (list): Metric names of the columns following the timestamp.
+        line (str): The raw log line.
+
+    Returns:
+        list: Samples for every numeric column, empty for comments or malformed lines.
+    """
+    line = line.strip()
+    if not line or line.startswith('#'):
+        return []
+
+    fields = line.split(';')
+    try:
+        timestamp = parse_iso_timestamp(fields[0])
+    except ValueError:
+        return []
+
+    samples = []
+    for name, text in zip(columns, fields[1:]):
+        try:
+            samples.append(Sample(name, (), float(text), timestamp))
+        except ValueError:
+            continue
+    return samples
+
+
+def parse_event_line(line):
+    """
+    Parse one line of events.log into a single 'events' sample.
+
+    The description itself can contain semicolons (the #CRLF continuations), so only the
+    first two fields and the trailing equipment category are split off.
+    """
+    line = line.strip()
+    if not line or line.startswith('#'):
+        return []
+
+    fields = line.split(';', 2)
+    if len(fields) < 3:
+        return []
+    description, _, category = fields[2].rpartition(';')
+    if not category.isdigit():
+        return []
+
+    try:
+        timestamp = parse_iso_timestamp(fields[0])
+        level = float(fields[1])
+    except ValueError:
+        return []
+
+    labels = (('cat', category), ('description', description), ('eventdate', fields[0]))
+    return [Sample('events', labels, level, timestamp)]
+
+
+def parse_heliumlog_line(line):
+    """
+    Parse one line of the new-style diskless heliumlog in a single pass, e.g.
+    Tue Oct 18 04:15:01 2022 : helium level =  94 %, nitrogen level =  68 %, field =     0.0
+
+    Every 'label = value' pair becomes a sample (the same labels extract_labels finds in
+    setup_scans.py), so fields added by Bruker are picked up without changing the parser.
+    """
+    stamp, separator, data = line.partition(' : ')
+    if not separator:
+        return []
+
+    try:
+        timestamp = parse_ctime(stamp.strip())
+    except (ValueError, KeyError):
+        return []
+
+    samples = []
+    for item in data.split(','):
+        label, equals, value = item.partition('=')
+        fields = value.split()
+        if not equals or not fields:
+            continue
+        try:
+            samples.append(Sample(metric_name(label), (), float(fields[0]), timestamp))
+        except ValueError:
+            continue
+    return samples
+
+
+def get_parser(log_name):
+    """
+    Return the line parser for a given log file name.
+
+    Raises:
+        ValueError: If the log file is not a known spectrometer log.
+    """
+    if log_name in COLUMN_LOGS:
+        return partial(parse_column_line, COLUMN_LOGS[log_name])
+    if log_name == 'events.log':
+        return parse_event_line
+    if log_name == 'heliumlog':
+        return parse_heliumlog_line
+    raise ValueError(f"Unknown spectrometer log: {log_name}")
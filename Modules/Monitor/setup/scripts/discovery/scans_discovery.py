@@ -0,0 +1,121 @@
+"""
+SCANS target discovery daemon
+
+Keeps the scrape targets of prom-short and prom-long up to date without re-running setup.
+The machines listed in the extra_hosts of the Monitor docker-compose.yml are probed every
+few minutes for running exporters (see shared/discovery.py), and the results are written
+as Prometheus file_sd JSON files. Both Prometheus instances are asked to reload only when
+a target file actually changed.
+
+A target that stops answering is kept for --forget-after seconds, so an exporter that is
+down still shows up as down in Prometheus instead of silently disappearing.
+"""
+
+import os
+import sys
+import time
+import logging
+import argparse
+import urllib.request
+
+import yaml
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+# Shared SCANS modules: copied into ./shared by setup, or found in Modules/Shared of a checkout
+sys.path += [os.path.join(HERE, 'shared'), os.path.join(HERE, '..', '..', '..', '..', 'Shared')]
+
+import discovery
+
+INTERVAL = 300 # seconds between two scans of the inventory
+FORGET_AFTER = 86400 # seconds a target may stay unanswered before it is removed
+PROMETHEUS = ['http://prom-short:9090', 'http://prom-long:9090']
+
+
+# Argparse block
+def parse_arguments():
+    parser = argparse.ArgumentParser(description="Discover SCANS exporters and keep Prometheus file_sd targets up to date.")
+    parser.add_argument('-c', '--compose', default='/app/docker-compose.yml',
+                        help='Monitor docker-compose file whose extra_hosts list the machines')
+    parser.add_argument('-d', '--targets-dir', default='/app/targets', help='Directory of the file_sd JSON files')
+    parser.add_argument('-x', '--exclude', action='append', default=[],
+                        help='Machine alias not to probe (e.g. the server, already scraped statically)')
+    parser.add_argument('-i', '--interval', type=float, default=INTERVAL, help='Seconds between two scans')
+    parser.add_argument('--forget-after', type=float, default=FORGET_AFTER,
+                        help='Seconds a target may stay unanswered before it is removed')
+    parser.add_argument('-p', '--prometheus', action='append',
+                        help=f"Prometheus URL to reload on changes (default: {', '.join(PROMETHEUS)})")
+    parser.add_argument('--once', action='store_true', help='Scan once and exit')
+    parser.add_argument('--log-stdout', action='store_true', help='Enable logging messages to STDOUT')
+    return parser.parse_args()
+
+
+def read_inventory(compose_file, exclude):
+    """
+    Return {machine alias: IP address} from the extra_hosts of every service in the compose file.
+    """
+    try:
+        with open(compose_file, 'r') as file:
+            compose = yaml.safe_load(file)
+    except (OSError, yaml.YAMLError) as e:
+        logging.error(f"Cannot read the inventory from {compose_file}: {e}")
+        return {}
+
+    hosts = {}
+    for service in (compose.get('services') or {}).values():
+        for entry in service.get('extra_hosts') or []:
+            name, _, ip = str(entry).partition(':')
+            if name and ip and name not in exclude:
+                hosts[name] = ip
+    return hosts
+
+
+def reload_prometheus(urls):
+    for url in urls:
+        try:
+            request = urllib.request.Request(f"{url.rstrip('/')}/-/reload", method='POST')
+            with urllib.request.urlopen(request, timeout=10):
+                logging.info(f"Reloaded {url}")
+        except OSError as e:
+            logging.error(f"Could not reload {url}: {e}")
+
+
+def main():
+    args = parse_arguments()
+    logging.basicConfig(level=logging.INFO if args.log_stdout else logging.WARNING)
+    prometheus = args.prometheus or PROMETHEUS
+
+    # Targets already on file count as seen now, so a restart does not drop anything
+    now = time.time()
+    last_seen = {(machine, service): (port, now)
+                 for machine, services_found in discovery.read_target_files(args.targets_dir).items()
+                 for service, port in services_found.items()}
+
+    while True:
+        begin = time.time()
+        hosts = read_inventory(args.compose, args.exclude)
+        for machine, services_found in discovery.found_services(discovery.discover(hosts)).items():
+            for service, port in services_found.items():
+                last_seen[(machine, service)] = (port, begin)
+
+        found = {}
+        for (machine, service), (port, seen) in list(last_seen.items()):
+            if machine not in hosts or begin - seen > args.forget_after:
+                logging.info(f"Removing {service} of {machine}, not seen since {time.ctime(seen)}")
+                del last_seen[(machine, service)]
+                continue
+            found.setdefault(machine, {})[service] = port
+        discovery.prune_superseded(found)
+
+        changed = discovery.write_target_files(args.targets_dir, discovery.target_groups(found, hosts))
+        if changed:
+            logging.info(f"Targets changed for: {', '.join(changed)}")
+            reload_prometheus(prometheus)
+        logging.info(f"Scanned {len(hosts)} machines in {time.time() - begin:.1f} s")
+
+        if args.once:
+            break
+        time.sleep(max(0, args.interval - (time.time() - begin)))
+
+
+if __name__ == "__main__":
+    main()
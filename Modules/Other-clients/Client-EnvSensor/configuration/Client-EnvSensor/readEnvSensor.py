@@ -1,18 +1,31 @@
-import requests
 import os
-import csv
+import sys
+import json
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+# Shared SCANS modules: mounted in ./shared by docker-compose, or found in Modules/Shared of a checkout
+sys.path += [os.path.join(HERE, 'shared'), os.path.join(HERE, '..', '..', '..', '..', 'Shared')]
+
+import csvlog
+import metrics
+import fetchcache
 
 SERVER = "http://192.168.103.20"
 OUTPUT_DIR = "/app/logs"
 FILE_LIMIT = 289 # i.e. keep 24 hours of data (plus header)
+CACHE_FILE = "fetch-cache.json" # validators and hash of the reading already logged, in the output directory
+METRICS_PORT = 9155 # port of the former env grok-exporter, served by a long-lived collector
 
-def getResponse(url):
-    # Send a GET request without authentication
-    response = requests.get(url)
+# Same metrics as configuration/grok/env.yml
+registry = metrics.registry(METRICS_PORT)
+lab_temperature = registry.gauge('lab_temperature', 'The temperature from the laboratory sensor (Celcius)')
+lab_humidity = registry.gauge('lab_humidity', 'The humidity from the laboratory sensor (%)')
+lab_pressure = registry.gauge('lab_pressure', 'The pressure from the laboratory sensor (Bar)')
 
-    # Check if the request was successful
-    if response.status_code == 200:
-        data = response.json()
+def getResponse(content):
+    # Decode the body of a successful GET request
+    if content is not None:
+        data = json.loads(content)
 
         temperature = data["temperature"]
         humidity = data["humidity"]
@@ -25,42 +38,36 @@ def getResponse(url):
             print("Failed to retrieve data from the server.")
             return None
 
-def clear_data_lines_in_csv(path):
+def writeToFile(row, output_dir=OUTPUT_DIR):
     try:
-        with open(path, 'r') as csvfile:
-            lines = csvfile.readlines()
-            if len(lines) >= FILE_LIMIT:
-                with open(path, 'w', newline='') as csvfile:
-                    csvfile.truncate(0)
+        log = csvlog.open_log(os.path.join(output_dir, "log.txt"), FILE_LIMIT - 1, ["#Temperature, #Humidity, #Pressure"])
+        log.write(row.split(','))
     except Exception as e:
-        print(f'Error clearing data lines in CSV: {e}')
-
-def csv_file_exists(path):
-    try:
-        with open(path, 'r') as csvfile:
-            return csvfile.read().strip() != ''
-    except FileNotFoundError:
-        return False
-    
-def writeToFile(row):
+        print(f'Error writing to log file: {e}')
 
-    file_path = os.path.join(OUTPUT_DIR, "log.txt")
-    
-    if csv_file_exists(file_path):
-        clear_data_lines_in_csv(file_path)
-    else:
-        print("creating log file")
+def updateMetrics(row):
+    temperature, humidity, pressure = (float(value) for value in row.split(','))
+    lab_temperature.set(temperature)
+    lab_humidity.set(humidity)
+    lab_pressure.set(pressure)
 
-    try:
-        with open(file_path, 'a', newline='') as csvfile:
-            writer = csv.writer(csvfile)
-            if csvfile.tell() == 0:
-                writer.writerow(["#Temperature, #Humidity, #Pressure"])  # Write header if file is empty
-            writer.writerow(row.split(','))
-    except Exception as e:
-        print(f'Error writing to log file: {e}')
+# Read the sensor once and log its values (also called by the SCANS collector scheduler)
+# The CSV log is only needed by a grok-exporter: the metrics are updated either way
+# A reading identical to the one already logged is neither decoded nor logged again
+def collect(server=SERVER, output_dir=OUTPUT_DIR, write_csv=True):
+    cache = fetchcache.open_cache(os.path.join(output_dir, CACHE_FILE) if write_csv else None, registry)
+    # Send a GET request without authentication
+    page = cache.fetch(server, timeout=10)
+    if page is not None and not page.changed:
+        print("Reading unchanged.")
+        cache.done()
+        return
+    result = getResponse(page.content if page else None)
+    if result:
+        updateMetrics(result)
+        if write_csv:
+            writeToFile(result, output_dir)
+        cache.done(page)
 
 if __name__ == "__main__":
-    result = getResponse(SERVER)
-    if result:
-        writeToFile(result)
+    collect()
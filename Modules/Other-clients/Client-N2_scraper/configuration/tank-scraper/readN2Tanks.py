@@ -1,10 +1,13 @@
 import os
+import re
 import time
 import logging
 import json
-import csv
+import sys
 import argparse
-from datetime import datetime, timedelta
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timedelta, timezone
 import yaml
 import requests
 from selenium import webdriver
@@ -15,6 +18,13 @@ from selenium.webdriver.common.by import By
 from selenium.webdriver.support.ui import WebDriverWait
 from selenium.webdriver.support import expected_conditions as EC
 
+HERE = os.path.dirname(os.path.abspath(__file__))
+# Shared SCANS modules: mounted in ./shared by docker-compose, or found in Modules/Shared of a checkout
+sys.path += [os.path.join(HERE, 'shared'), os.path.join(HERE, '..', '..', '..', '..', 'Shared')]
+
+import csvlog
+import metrics
+
 ########################## VARIABLES #########################
 CONFIG_FILE = "/app/config.yml"
 OUTPUT_DIR = "/app/logs"
@@ -22,15 +32,39 @@ TANK_FILE_HEADER = ["TimeStamp", "TankPercentage", "AlarmStatus", "NextDelivery"
 SPI_FILE_HEADER = ["TimeStamp", "SPIpressure", "SPIflow"]
 FILE_LIMIT = 145 # i.e. keep 24 hours of data (plus header)
 TIMEZONE = "Europe/Paris"
+TIME_FORMAT = "%Y-%m-%dT%H:%M:%S" # local time of the readings, in the logs, metric labels and history
+API_URL = "https://myinstallations.airliquide.com/france/server/api/v2"
+SESSION_FILE = "/app/session.json" # cached AirLiquide session cookies
+MAX_WORKERS = 16 # API requests in flight at once
+REQUEST_DEADLINE = 20 # seconds allowed for one API request, retries included
+HISTORY_FILE = "/app/history.json" # time of the latest level point fetched for each tank
+TANK_METRICS_PORT = 9149 # port of the former tank grok-exporter, served by a long-lived collector
+SPI_METRICS_PORT = 9150 # port of the former spi grok-exporter
+MAX_SERIES = 2000 # series kept per time-labelled metric, i.e. several days of 10 minute readings of a few tanks
 ##############################################################
 
 os.environ['TZ'] = TIMEZONE
 time.tzset()
 
+# Same metrics as configuration/grok/tank.yml and spi.yml
+# Series labelled with a time are all kept, as grok did, up to MAX_SERIES (the oldest are dropped first)
+tank_registry = metrics.registry(TANK_METRICS_PORT)
+tank_level = tank_registry.gauge('tank_level', 'The level of the AirLiquide N2 tank')
+tank_last_measured = tank_registry.counter('tank_last_measured', 'The time of monitoring the AirLiquide N2 tank', max_series=MAX_SERIES)
+tank_alarm_status = tank_registry.counter('tank_alarm_status', 'The status of the built-in tank alarm (normally only disactivated when filling).')
+tank_next_delivery = tank_registry.gauge('tank_next_delivery', 'The next scheduled delivery for this tank according to AirLiquide website.', max_series=MAX_SERIES)
+spi_registry = metrics.registry(SPI_METRICS_PORT)
+spi_pressure = spi_registry.gauge('spi_pressure', 'The pressure of AirLiquide N2 SPI 1')
+spi_flow = spi_registry.gauge('spi_flow', 'The flow of AirLiquide N2 SPI 1')
+spi_last_measured = spi_registry.counter('spi_last_measured', 'The time of monitoring the AirLiquide N2 SPI', max_series=MAX_SERIES)
+
 # Argparse block
 def parse_arguments():
     parser = argparse.ArgumentParser(description="Script to retrieve AirLiquide Logs and store data to csv logfiles.")
     parser.add_argument("--log-stdout", action="store_true", help="Enable logging messages to STDOUT")
+    parser.add_argument("--api-url", help=f"Base URL of the AirLiquide API (default: {API_URL})")
+    parser.add_argument("--session-file", default=SESSION_FILE, help="File caching the session cookies between runs")
+    parser.add_argument("--history-file", default=HISTORY_FILE, help="File keeping the latest level point fetched for each tank")
     return parser.parse_args()
 
 # Read the configuration file and return the config dictionary.
@@ -83,32 +117,133 @@ def get_al_cookies(driver, wait, username, password):
     except Exception as e:
         logging.error(f"Error navigating second cookies popup: {e}")
 
-    cookies_json = driver.get_cookies()
-    cookies_str = ''.join(map(lambda c: '%s=%s; ' % (c['name'], c['value']), cookies_json))
-    return cookies_str
+    return driver.get_cookies()
 
-def make_api_request(url, cookies, max_retries=3, retry_delay=15):
-    headers = {
-        "User-Agent": "Mozilla/5.0 (Macintosh; Intel Mac OS X 10.15; rv:109.0) Gecko/20100101 Firefox/113.0",
-    }
-
-    response = None  # Initialize the response variable
+# Log in through the browser and return the session cookies, caching them on disk
+def browser_login(url, username, password, session_file):
+    driver = configure_driver()
+    try:
+        wait = WebDriverWait(driver, 30)
+        driver.get(url)
+        cookies_json = get_al_cookies(driver, wait, username, password)
+    finally:
+        close_browser(driver)
+    save_session(session_file, cookies_json)
+    return {c['name']: c['value'] for c in cookies_json}
+
+# Save the cookies, without an expiry: the expiries of the site's tracking cookies say nothing of the login,
+# so the cached session is used until the API refuses it (401), which logs in again
+def save_session(path, cookies_json):
+    session = {"cookies": {c['name']: c['value'] for c in cookies_json}}
+    try:
+        # The cookies give access to the account: readable by the owner only
+        fd = os.open(path + ".tmp", os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0o600)
+        with os.fdopen(fd, 'w') as file:
+            json.dump(session, file)
+        os.replace(path + ".tmp", path)
+    except OSError as e:
+        logging.error(f"Error saving the session cookies: {e}")
+
+# Return the cached cookies, or None if there are none
+def load_session(path):
+    try:
+        with open(path) as file:
+            session = json.load(file)
+    except (OSError, ValueError):
+        return None
+    if not session.get("cookies"):
+        logging.info("No cached session.")
+        return None
+    logging.info("Using the cached session.")
+    return session["cookies"]
+
+# Session cookies shared by the worker threads
+# When the API refuses them, a single browser login renews them for every request
+class CookieJar:
+    def __init__(self, cookies, login):
+        self.cookies = cookies
+        self.login = login
+        self.lock = threading.Lock()
+        self.renewed = False
+
+    # Return True if the request refused with these cookies can be retried
+    def renew(self, refused):
+        with self.lock:
+            if self.cookies is not refused:
+                # Already renewed by another request
+                return True
+            if self.renewed:
+                return False
+            self.renewed = True
+            logging.info("Session refused, logging in again.")
+            self.cookies = self.login()
+            return True
+
+# Create the HTTP session shared by all requests, keeping the connections to the API open
+def create_session(workers):
+    session = requests.Session()
+    session.headers["User-Agent"] = "Mozilla/5.0 (Macintosh; Intel Mac OS X 10.15; rv:109.0) Gecko/20100101 Firefox/113.0"
+    adapter = requests.adapters.HTTPAdapter(pool_connections=1, pool_maxsize=workers)
+    session.mount("https://", adapter)
+    session.mount("http://", adapter)
+    return session
+
+def make_api_request(session, url, jar, max_retries=3, retry_delay=1, deadline=REQUEST_DEADLINE):
+    end = time.monotonic() + deadline
     for retry in range(max_retries):
+        cookies = jar.cookies
+        response = None
         try:
-            response = requests.get(url, headers=headers, cookies=cookies, timeout=2)
+            response = session.get(url, cookies=cookies, timeout=(2, max(0.1, end - time.monotonic())))
             response.raise_for_status()
             return response
         except requests.exceptions.RequestException as e:
             logging.error(f"Error making API request: {e}")
-            if response is not None and response.status_code == 401 and retry < max_retries - 1:
-                print(f"Retrying API request in {retry_delay} seconds...")
-                time.sleep(retry_delay)
-            else:
+            if retry == max_retries - 1:
+                break
+            if response is not None and response.status_code == 401:
+                # The session was refused: log in again (once per run) and retry straight away
+                if not jar.renew(cookies):
+                    break
+                # The deadline does not include the time spent logging in
+                end = time.monotonic() + deadline
+                continue
+            if response is not None and response.status_code < 500:
                 break
+            # Network error or server error: back off, without holding up the other requests
+            delay = retry_delay * 2 ** retry
+            if time.monotonic() + delay >= end:
+                break
+            time.sleep(delay)
     return None
 
-# Handle the API response and write to CSV file.
-def handle_tank_response(tank_name, api_data, nextDeliv):
+# Update the tank metrics with data rows, in time order
+# A gauge holds one value: tank_level only shows the latest point of a run, every point is kept in the CSV log
+# (and counted in tank_last_measured, one series per measurement_time)
+def update_tank_metrics(rows):
+    for name, measurement_time, level, alarm_status, next_delivery in rows:
+        try:
+            tank_level.set(float(level), name=name)
+        except (TypeError, ValueError):
+            continue
+        tank_last_measured.inc(name=name, measurement_time=measurement_time)
+        tank_alarm_status.inc(name=name, alarm_status=alarm_status)
+        tank_next_delivery.set(float(next_delivery), name=name, next_delivery=next_delivery)
+
+# Update the SPI metrics with a data row; a reading without pressure or flow is skipped
+def update_spi_metrics(row):
+    name, measurement_time, pressure, flow = row
+    try:
+        spi_pressure.set(float(pressure), name=name)
+        spi_flow.set(float(flow), name=name)
+    except (TypeError, ValueError):
+        return
+    spi_last_measured.inc(name=name, measurement_time=measurement_time)
+
+# Handle the API response, update the metrics and write to CSV file.
+# The level points of the chart fetched since the previous run are written first, in time order
+# Return True if the rows were handled (written to the log, if any), so the level history can move on
+def handle_tank_response(tank_name, api_data, nextDeliv, level_points=(), output_dir=OUTPUT_DIR, write_csv=True):
     try:
         value = api_data.get("Value")
         timestamp = api_data.get("Timestamp")
@@ -125,26 +260,19 @@ def handle_tank_response(tank_name, api_data, nextDeliv):
             # Replace whitespace with underscore in tank name
             tank_name = tank_name.replace(" ", "_")
 
-            # Prepare the data row
-            row = [tank_name, timestamp, value, is_in_alarm, nextDeliv]
+            # Prepare the data rows
+            rows = [[tank_name, point.get('LocalTime'), point.get('Value'), is_in_alarm, nextDeliv] for point in level_points]
+            rows.append([tank_name, timestamp, value, is_in_alarm, nextDeliv])
+            update_tank_metrics(rows)
 
-            # Prepare the file path
-            file_path = os.path.join(OUTPUT_DIR, "tanks", "log.txt")
-
-            if csv_file_exists(file_path):
-                clear_data_lines_in_csv(file_path)
-            else:
-                logging.info("creating log file")
-            
-            try:
-                with open(file_path, 'a', newline='') as csvfile:
-                    writer = csv.writer(csvfile)
-                    if csvfile.tell() == 0:
-                        # Write header if file is empty
-                        writer.writerow(TANK_FILE_HEADER)
-                    writer.writerow(row)
-            except Exception as e:
-                logging.error(f"Error writing to log file: {e}")
+            if write_csv:
+                try:
+                    log = csvlog.open_log(os.path.join(output_dir, "tanks", "log.txt"), FILE_LIMIT - 1, TANK_FILE_HEADER)
+                    log.write_rows(rows)
+                except Exception as e:
+                    logging.error(f"Error writing to log file: {e}")
+                    return False
+            return True
 
         else:
             print("API response empty.")
@@ -152,10 +280,11 @@ def handle_tank_response(tank_name, api_data, nextDeliv):
         print(f"Error parsing API response: {e}")
     except Exception as e:
         print(f"An unexpected error occurred: {e}")
+    return False
 
 
-#Handle the API response and write to CSV file.
-def handle_spi_response(name, pres_response, flow_response):
+#Handle the API response, update the metrics and write to CSV file.
+def handle_spi_response(name, pres_response, flow_response, output_dir=OUTPUT_DIR, write_csv=True):
     try:
         pres_data = json.loads(pres_response.text)
         flow_data = json.loads(flow_response.text)
@@ -167,7 +296,7 @@ def handle_spi_response(name, pres_response, flow_response):
 
         if flow_data.get("Value") is not None:
             spi_flow = flow_data.get("Value")
-            spi_time = flow_data.get("Timestamp")
+            spi_time = api_time(flow_data.get("Timestamp"), utc=True).strftime(TIME_FORMAT)
         else:
             spi_flow = ''
             spi_time = ''
@@ -180,23 +309,14 @@ def handle_spi_response(name, pres_response, flow_response):
 
         # Prepare the data row
         row = [name, spi_time, spi_pres, spi_flow]
+        update_spi_metrics(row)
 
-        # Prepare the file path
-        file_path = os.path.join(OUTPUT_DIR, "spi", "log.txt")
-
-        if csv_file_exists(file_path):
-            clear_data_lines_in_csv(file_path)
-        else:
-            print("creating log file")
-            
-        try:
-            with open(file_path, 'a', newline='') as csvfile:
-                writer = csv.writer(csvfile)
-                if csvfile.tell() == 0:
-                    writer.writerow(SPI_FILE_HEADER)  # Write header if file is empty
-                writer.writerow(row)
-        except Exception as e:
-            logging.error(f"Error writing to log file: {e}")
+        if write_csv:
+            try:
+                log = csvlog.open_log(os.path.join(output_dir, "spi", "log.txt"), FILE_LIMIT - 1, SPI_FILE_HEADER)
+                log.write(row)
+            except Exception as e:
+                logging.error(f"Error writing to log file: {e}")
 
     except ValueError as e:
         logging.error(f"Error parsing API 3/4 response: {e}")
@@ -204,23 +324,6 @@ def handle_spi_response(name, pres_response, flow_response):
         logging.error(f"An unexpected error occurred: {e}")
 
 
-def clear_data_lines_in_csv(path):
-    try:
-        with open(path, 'r') as csvfile:
-            lines = csvfile.readlines()
-            if len(lines) >= FILE_LIMIT:
-                with open(path, 'w', newline='') as csvfile:
-                    csvfile.truncate(0)
-    except Exception as e:
-        logging.error(f"Error clearing data lines in CSV: {e}")
-
-def csv_file_exists(path):
-    try:
-        with open(path, 'r') as csvfile:
-            return csvfile.read().strip() != ''
-    except FileNotFoundError:
-        return False
-
 # Function to create some standard dates relative to now
 def get_relativedates():
     now = datetime.now()
@@ -229,23 +332,130 @@ def get_relativedates():
     oneweek = (now + timedelta(days=7)).replace(hour=1, minute=0, second=0, microsecond=0)
     return now, yesterday, tomorrow, oneweek
 
-def main():
+# Parse an API time into a naive local time: a LocalTime is local, a Timestamp (requested with isUtc=true) is UTC
+# unless it carries its own Z or offset; milliseconds are dropped
+def api_time(text, utc=False):
+    found = re.match(r'^(\d{4}-\d\d-\d\dT\d\d:\d\d:\d\d)(?:\.\d+)?(Z|[+-]\d\d:?\d\d)?$', (text or '').strip())
+    if not found:
+        raise ValueError(f"Unexpected time: {text}")
+    parsed = datetime.strptime(found.group(1), TIME_FORMAT)
+    zone = found.group(2) or ('Z' if utc else None)
+    if zone:
+        offset = timedelta() if zone == 'Z' else (1 if zone[0] == '+' else -1) * timedelta(hours=int(zone[1:3]), minutes=int(zone[-2:]))
+        parsed = parsed.replace(tzinfo=timezone(offset)).astimezone().replace(tzinfo=None)
+    return parsed
+
+# Format a naive local time as the UTC time of an API request
+def utc_string(local):
+    return datetime.utcfromtimestamp(local.timestamp()).strftime('%Y-%m-%dT%H:%M:%S.%f')[:-3]
+
+# Read the time of the latest level point fetched for each tank
+def load_history(path):
+    try:
+        with open(path) as file:
+            return json.load(file)
+    except (OSError, ValueError):
+        return {}
+
+def save_history(path, history):
+    try:
+        with open(path + ".tmp", 'w') as file:
+            json.dump(history, file)
+        os.replace(path + ".tmp", path)
+    except OSError as e:
+        logging.error(f"Error saving the level history: {e}")
+
+# Start of the level chart request: just before the latest point already fetched (at most back to yesterday)
+# Both are local times, compared before the result is converted to the UTC of the request
+def level_start(history, tank_id, yesterday):
+    start = yesterday
+    last = history.get(tank_id)
+    if last:
+        start = max(start, api_time(last))
+    return utc_string(start)
+
+# Combine the current level, level chart and deliveries of a tank, and write them to the CSV file
+# Only the chart points newer than the latest one of the previous run are written; history is updated in place,
+# once they are written, so points whose write failed are fetched again on the next run
+def handle_tank_requests(tank, response1, response2, response3, now, now_string, history, output_dir=OUTPUT_DIR, write_csv=True):
+    new_points = []
+    mark = None
+    if response1 is not None: 
+        r1_json = json.loads(response1.text)
+        r1_time = api_time(r1_json.get("Timestamp"), utc=True)
+        #Take the body of the response from the API response 1, with its time in the format of the chart points
+        response = json.loads(response1.text)
+        response["Timestamp"] = r1_time.strftime(TIME_FORMAT)
+
+        #Get tank API data from chart page
+        if response2 is not None: 
+            last = api_time(history[tank['tankID']]) if history.get(tank['tankID']) else datetime.min
+            r2_json = []
+            for point in json.loads(response2.text):
+                if point.get('LocalTime') and api_time(point['LocalTime']) > last:
+                    # One time format for every row of the log
+                    point['LocalTime'] = api_time(point['LocalTime']).strftime(TIME_FORMAT)
+                    r2_json.append(point)
+            new_points = r2_json[:-1]
+            if r2_json:
+                mark = r2_json[-1].get('LocalTime')
+            r2_time = api_time(r2_json[-1].get('LocalTime')) if r2_json else r1_time
+
+            # update the timestamp and value depending on the latest reading
+            if r2_time > r1_time:
+                logging.info("latest value = API2")
+                response["Timestamp"] = r2_json[-1].get('LocalTime')
+                response["Value"] = r2_json[-1].get('Value')
+            else:
+                logging.info("latest value = API1")          
+                new_points = r2_json
+        else:
+            logging.error("API response 2 empty")
+    else:
+        logging.error("API response 1 empty")
     
-    args = parse_arguments()
-    if args.log_stdout:
-        logging.basicConfig(level=logging.INFO)
+    if response1 and response2:
+        print(f"API request successful @ {now_string}")
+        print("---")
+
+        desired_status = "Planned"
+        delDate = "0"
+
+        if response3 is not None:
+            for item in json.loads(response3.text):
+                if item["Status"] == desired_status:
+                    date_string = item["DeliveryDate"]
+                    tidyDate = date_string.split(".")[0]
+                    datetime_obj = datetime.strptime(tidyDate, "%Y-%m-%dT%H:%M:%S")
+                    eval_date = datetime_obj.date()
+
+                    # If the delivery date was in the past - discard it.
+                    if (now.date() > eval_date):
+                        delDate = "0"
+                    else:
+                        delDate = datetime_obj.timestamp()
+                    break
+
+        if handle_tank_response(tank['name'], response, delDate, new_points, output_dir, write_csv) and mark:
+            history[tank['tankID']] = mark
+
+# Read every tank and SPI once and log their values (also called by the SCANS collector scheduler)
+# The CSV logs are only needed by the grok-exporters: the metrics are updated either way
+def collect(config_file=CONFIG_FILE, api_url=None, session_file=SESSION_FILE, history_file=HISTORY_FILE, output_dir=OUTPUT_DIR,
+            write_csv=True):
 
     # Retrieve API config, login credentials, and installation details
-    config = read_config(CONFIG_FILE)
+    config = read_config(config_file)
     username, password, url = config["Credentials"]["Username"], config["Credentials"]["Password"], config["Credentials"]["loginURL"]
     tanks, spis = config["ALTanks"]["tanks"], config["SPIs"]
-    
-    # Create a webdriver and retrieve cookies 
-    driver = configure_driver()
-    wait = WebDriverWait(driver, 30)
-    driver.get(url)
-    cookies = get_al_cookies(driver, wait, username, password)
-    cookies = {"cookies": cookies}
+    api_url = (api_url or config["Credentials"].get("apiURL") or API_URL).rstrip("/")
+
+    # Reuse the cached session cookies; the browser only logs in when there are none or they are refused
+    cookies = load_session(session_file)
+    if cookies is None:
+        cookies = browser_login(url, username, password, session_file)
+    jar = CookieJar(cookies, lambda: browser_login(url, username, password, session_file))
+    history = load_history(history_file)
 
     # Set relative dates and formatted strings
     now, yesterday, tomorrow, oneweek = get_relativedates()
@@ -254,77 +464,37 @@ def main():
     tomorrow_string = tomorrow.strftime('%Y-%m-%dT%H:%M:%S.%f')[:-3]
     oneweek_string = oneweek.strftime('%Y-%m-%dT%H:%M:%S.%f')[:-3]
 
-    for tank in tanks:
-        
-        #Get tank API data from top-page
-        api_url1 = "https://myinstallations.airliquide.com/france/server/api/v2/tank/"+tank['tankID']+"/currentlevel"
-        logging.info(f"API request 1 = {api_url1}")
-        response1 = make_api_request(api_url1, cookies)
-        
-        if response1 is not None: 
-            r1_json = json.loads(response1.text)
-            r1_time = datetime.strptime(r1_json.get("Timestamp"), "%Y-%m-%dT%H:%M:%S")
-            #Take the body of the response from the API response 1
-            response = json.loads(response1.text)
-
-            #Get tank API data from chart page
-            api_url2 = "https://myinstallations.airliquide.com/france/server/api/v2/tank/"+tank['tankID']+"/level?startDate="+yesterday_string+"Z&endDate="+tomorrow_string+"Z&isUtc=true"
-            logging.info(f"API request 2 = {api_url2}")
-            response2 = make_api_request(api_url2, cookies)
-
-            if response2 is not None: 
-                r2_json = json.loads(response2.text)
-                r2_time = datetime.strptime(r2_json[-1].get('LocalTime'), "%Y-%m-%dT%H:%M:%S")
-            else:
-                logging.error("API response 2 empty")
-
-            # update the timestamp and value depending on the latest reading
-            if r2_time > r1_time:
-                logging.info("latest value = API2")
-                response["Timestamp"] = r2_json[-1].get('LocalTime')
-                response["Value"] = r2_json[-1].get('Value')
-            else:
-                logging.info("latest value = API1")          
-        else:
-            logging.error("API response 1 empty")
-        
-        if response1 and response2:
-            print(f"API request successful @ {now_string}")
-            print("---")
-            api_url3 = "https://myinstallations.airliquide.com/france/server/api/v2/installation/"+tank['delID']+"/deliveries?startDate="+yesterday_string+"Z&endDate="+oneweek_string+"Z&isUtc=true"
-            logging.info(f"API request 3 = {api_url3}")
-            response3 = make_api_request(api_url3, cookies)
-
-            desired_status = "Planned"
-            delDate = "0"
-
-            if response3 is not None:
-                for item in json.loads(response3.text):
-                    if item["Status"] == desired_status:
-                        date_string = item["DeliveryDate"]
-                        tidyDate = date_string.split(".")[0]
-                        datetime_obj = datetime.strptime(tidyDate, "%Y-%m-%dT%H:%M:%S")
-                        eval_date = datetime_obj.date()
-
-                        # If the delivery date was in the past - discard it.
-                        if (now.date() > eval_date):
-                            delDate = "0"
-                        else:
-                            delDate = datetime_obj.timestamp()
-                        break
-
-            handle_tank_response(tank['name'], response, delDate)
-
-    for spi in spis:
-        spi_pres_api_url = "https://myinstallations.airliquide.com/france/server/api/v2/tank/"+spi['ID']+"/currentpressure"
-        spi_flow_api_url = "https://myinstallations.airliquide.com/france/server/api/v2/tank/"+spi['ID']+"/flowmeter/currentvalue"
-        
-        pres_response = make_api_request(spi_pres_api_url, cookies)
-        flow_response = make_api_request(spi_flow_api_url, cookies)
-
-        handle_spi_response(spi['name'], pres_response, flow_response)
+    # Issue every request of every tank and SPI at once; the run takes as long as the slowest one
+    session = create_session(MAX_WORKERS)
+    with ThreadPoolExecutor(max_workers=MAX_WORKERS) as executor:
+        def fetch(api_request_url):
+            logging.info(f"API request = {api_request_url}")
+            return executor.submit(make_api_request, session, api_request_url, jar)
+
+        tank_requests = [(tank,
+                          fetch(api_url+"/tank/"+tank['tankID']+"/currentlevel"),
+                          fetch(api_url+"/tank/"+tank['tankID']+"/level?startDate="+level_start(history, tank['tankID'], yesterday)+"Z&endDate="+tomorrow_string+"Z&isUtc=true"),
+                          fetch(api_url+"/installation/"+tank['delID']+"/deliveries?startDate="+yesterday_string+"Z&endDate="+oneweek_string+"Z&isUtc=true"))
+                         for tank in tanks]
+        spi_requests = [(spi,
+                         fetch(api_url+"/tank/"+spi['ID']+"/currentpressure"),
+                         fetch(api_url+"/tank/"+spi['ID']+"/flowmeter/currentvalue"))
+                        for spi in spis]
+
+        # The results are written in the order of the configuration file
+        for tank, request1, request2, request3 in tank_requests:
+            handle_tank_requests(tank, request1.result(), request2.result(), request3.result(), now, now_string, history, output_dir, write_csv)
+
+        for spi, pres_request, flow_request in spi_requests:
+            handle_spi_response(spi['name'], pres_request.result(), flow_request.result(), output_dir, write_csv)
+    session.close()
+    save_history(history_file, history)
 
-    close_browser(driver)
+def main():
+    args = parse_arguments()
+    if args.log_stdout:
+        logging.basicConfig(level=logging.INFO)
+    collect(CONFIG_FILE, args.api_url, args.session_file, args.history_file)
 
 if __name__ == "__main__":  
     main()
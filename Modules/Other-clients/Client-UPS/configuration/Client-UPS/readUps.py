@@ -1,94 +1,72 @@
-import requests
-import pandas as pd
-from bs4 import BeautifulSoup
 import os
-import csv
+import sys
 from requests.auth import HTTPBasicAuth
 
+HERE = os.path.dirname(os.path.abspath(__file__))
+# Shared SCANS modules: mounted in ./shared by docker-compose, or found in Modules/Shared of a checkout
+sys.path += [os.path.join(HERE, 'shared'), os.path.join(HERE, '..', '..', '..', '..', 'Shared')]
+
+import csvlog
+import metrics
+import pagescrape
+import fetchcache
+
 ## This is specifically for a Network connected SOCOMEC UPS system.
 ## Probably won't be of direct use, but an example of how to scrape values off a web page to a log file
-
-address_dict = {'server-ups':
-                {'status': {'url': 'http://192.168.X.X/cgi.ssp?a=000', 'tag': 't1', 'table':'n'},
-                'battery': {'url': 'http://192.168.X.X/cgi.ssp?a=004', 'tag': 't3','table':'y', 'cell_location': (1, 1)}}
-            }
+## The pages, elements and cells read for each UPS are listed in pages.yml
 
 USERNAME = ""
 PASSWORD = ""
 OUTPUT_DIR = "/app/logs"
+PAGES_FILE = os.path.join(HERE, "pages.yml")
+CACHE_FILE = "fetch-cache.json" # validators and hashes of the pages already logged, in the output directory
 FILE_LIMIT = 289 # i.e. keep 24 hours of data (plus header)
+METRICS_PORT = 9154 # port of the former ups grok-exporter, served by a long-lived collector
+MAX_SERIES = 100 # ups_status series kept (one per UPS and status seen), the least recent are dropped beyond
 
-def getResponse(url, tag, tabled, cell_location=None):
-    # Send a GET request with authentication
-    response = requests.get(url, auth=HTTPBasicAuth(USERNAME, PASSWORD))
+# Same metrics as configuration/grok/ups.yml
+registry = metrics.registry(METRICS_PORT)
+battery_level = registry.gauge('battery_level', 'The current Battery % level as defined in the UPS web interface')
+ups_status = registry.counter('ups_status', 'The status of the UPS backup', max_series=MAX_SERIES)
 
-    # Check if the request was successful
-    if response.status_code == 200:
-        # Parse the HTML content using BeautifulSoup
-        soup = BeautifulSoup(response.content, "html.parser")
-        
-        # Find the element with the specified tag
-        target = soup.find(class_=tag)
-        
-        if target:
-            if tabled == 'y':
-                table = soup.find_all('table')
-                df = pd.read_html(str(table))[1]
-                text = df.iloc[cell_location[0], cell_location[1]]
-                return text.strip()
-            else:
-                text = target.get_text()
-                return text.strip()
-        else:
-            print("Element with class '{}' not found on the page.".format(tag))
-            return None
-    else:
-        print("Failed to fetch the page. Status code:", response.status_code)
-        return None
-
-def clear_data_lines_in_csv(path):
+def writeToFile(row, output_dir=OUTPUT_DIR):
     try:
-        with open(path, 'r') as csvfile:
-            lines = csvfile.readlines()
-            if len(lines) >= FILE_LIMIT:
-                with open(path, 'w', newline='') as csvfile:
-                    csvfile.truncate(0)
+        log = csvlog.open_log(os.path.join(output_dir, "log.txt"), FILE_LIMIT - 1, ["#Status, #Battery%"])
+        log.write(row)
     except Exception as e:
-        print(f'Error clearing data lines in CSV: {e}')
+        print(f'Error writing to log file: {e}')
 
-def csv_file_exists(path):
+def updateMetrics(row):
     try:
-        with open(path, 'r') as csvfile:
-            return csvfile.read().strip() != ''
-    except FileNotFoundError:
-        return False
-    
-def writeToFile(row):
-
-    file_path = os.path.join(OUTPUT_DIR, "log.txt")
-    
-    if csv_file_exists(file_path):
-                clear_data_lines_in_csv(file_path)
-    else:
-        print("creating log file")
+        name, status, battery = row
+        battery_level.set(float(battery), name=name)
+    except ValueError:
+        print(f'Incomplete reading, metrics not updated: {row}')
+        return
+    ups_status.inc(name=name, status=status)
 
-    try:
-        with open(file_path, 'a', newline='') as csvfile:
-            writer = csv.writer(csvfile)
-            if csvfile.tell() == 0:
-                writer.writerow(["#Status, #Battery%"])  # Write header if file is empty
-            writer.writerow(row)
-    except Exception as e:
-        print(f'Error writing to log file: {e}')
+# Read every UPS once and log its values (also called by the SCANS collector scheduler)
+# The CSV log is only needed by a grok-exporter: the metrics are updated either way
+# Pages identical to the ones already logged are neither parsed nor logged again
+def collect(output_dir=OUTPUT_DIR, write_csv=True, pages_file=PAGES_FILE):
+    cache = fetchcache.open_cache(os.path.join(output_dir, CACHE_FILE) if write_csv else None, registry)
+    for ups, values in pagescrape.load(pages_file).items():
+        pages, changed = cache.fetch_all(pagescrape.urls(values), auth=HTTPBasicAuth(USERNAME, PASSWORD), timeout=10)
+        if not changed:
+            print("ups: {} unchanged".format(ups))
+            cache.done()
+            continue
 
-if __name__ == "__main__":
-    row = []
-    for ups, properties in address_dict.items():
-        row.append(ups)
-        for page, props in properties.items():
-            result = getResponse(props['url'], props['tag'], props['table'], props.get('cell_location'))
+        row = [ups]
+        for page, result in pagescrape.scrape(values, lambda url: pages[url].content if pages[url] else None).items():
             if result:
                 print("ups: {} = {}".format(page, result))
                 row.append(result)
 
-        writeToFile(row)
+        updateMetrics(row)
+        if write_csv:
+            writeToFile(row, output_dir)
+        cache.done(*pages.values())
+
+if __name__ == "__main__":
+    collect()
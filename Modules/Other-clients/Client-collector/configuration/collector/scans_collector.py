@@ -0,0 +1,120 @@
+"""
+SCANS collector scheduler
+
+One long-lived process running the Other-clients collectors (UPS, HLMU, environment sensor,
+N2 tanks, remote compressor) instead of one cron container per collector. Each collector
+script is loaded once as a plugin, so interpreter start-up and heavy imports (lxml,
+selenium, paramiko) are paid once, and state kept by a collector between runs (SSH
+connections, cached sessions) survives from one run to the next.
+
+Every collector script exposes collect(**options), which reads its instrument once and
+writes its log. Each one is scheduled on its own interval, with some random jitter so they
+do not all fire at once, and the next run is only scheduled when the previous one finished,
+so a slow instrument never has two runs in flight.
+
+With `metrics: true` in the configuration, the collectors also serve their Prometheus
+metrics themselves (see shared/metrics.py), on the ports of the grok-exporters they replace,
+and their CSV logs can be turned off.
+"""
+
+import os
+import sys
+import random
+import asyncio
+import logging
+import argparse
+import importlib.util
+from functools import partial
+from concurrent.futures import ThreadPoolExecutor
+
+import yaml
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+# Shared SCANS modules: mounted in ./shared by docker-compose, or found in Modules/Shared of a checkout
+sys.path += [os.path.join(HERE, 'shared'), os.path.join(HERE, '..', '..', '..', '..', 'Shared')]
+
+import metrics
+
+CONFIG_FILE = '/app/collector.yml'
+JITTER = 10 # maximum random delay (seconds) added to every run
+
+
+# Argparse block
+def parse_arguments():
+    parser = argparse.ArgumentParser(description="Run the SCANS Other-clients collectors in one process.")
+    parser.add_argument('-c', '--config', default=CONFIG_FILE, help='YAML file listing the collectors and their intervals')
+    parser.add_argument('--once', action='store_true', help='Run every enabled collector once and exit')
+    parser.add_argument('--log-stdout', action='store_true', help='Enable logging messages to STDOUT')
+    return parser.parse_args()
+
+
+def load_collector(name, script):
+    """
+    Import a collector script as a module and return its collect function.
+    """
+    spec = importlib.util.spec_from_file_location(f"collector_{name}", script)
+    module = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(module)
+    return module.collect
+
+
+async def schedule(name, collect, interval, jitter, executor, once):
+    """
+    Run one collector every interval seconds, in the thread pool so it may block freely.
+    """
+    loop = asyncio.get_event_loop()
+    # Spread the first runs, so collectors started together do not stay in step
+    await asyncio.sleep(random.uniform(0, jitter))
+    while True:
+        start = loop.time()
+        try:
+            await loop.run_in_executor(executor, collect)
+        except Exception:
+            logging.exception(f"Collector {name} failed")
+        elapsed = loop.time() - start
+        logging.info(f"Collector {name} ran in {elapsed:.1f} s")
+        if once:
+            return
+        if elapsed > interval:
+            logging.warning(f"Collector {name} took {elapsed:.1f} s, longer than its {interval} s interval")
+        # Scheduled from the end of the run: never two runs of the same collector at once
+        await asyncio.sleep(max(0, interval - elapsed) + random.uniform(0, jitter))
+
+
+async def run(collectors, jitter, once):
+    with ThreadPoolExecutor(max_workers=max(1, len(collectors))) as executor:
+        await asyncio.gather(*(schedule(name, collect, interval, jitter, executor, once)
+                               for name, collect, interval in collectors))
+
+
+def main():
+    args = parse_arguments()
+    logging.basicConfig(level=logging.INFO if args.log_stdout else logging.WARNING)
+
+    with open(args.config, 'r') as file:
+        config = yaml.safe_load(file) or {}
+
+    # Before the collectors are loaded: their registries are served as soon as they are created
+    if config.get('metrics', False):
+        metrics.enable_serving()
+
+    collectors = []
+    for name, settings in (config.get('collectors') or {}).items():
+        if not settings.get('enabled', True):
+            continue
+        try:
+            collect = load_collector(name, settings['script'])
+        except Exception:
+            logging.exception(f"Cannot load collector {name} from {settings.get('script')}")
+            continue
+        collectors.append((name, partial(collect, **(settings.get('options') or {})), float(settings.get('interval', 300))))
+        logging.info(f"Loaded collector {name}, every {collectors[-1][2]:g} s")
+
+    if not collectors:
+        logging.error("No collector enabled")
+        sys.exit(1)
+    asyncio.run(run(collectors, float(config.get('jitter', JITTER)), args.once))
+
+
+if __name__ == "__main__":
+    main()
@@ -1,53 +1,104 @@
-import requests
-from bs4 import BeautifulSoup
-import csv
 import os
+import sys
+import argparse
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+# Shared SCANS modules: mounted in ./shared by docker-compose, or found in Modules/Shared of a checkout
+sys.path += [os.path.join(HERE, 'shared'), os.path.join(HERE, '..', '..', '..', '..', 'Shared')]
+
+import csvlog
+import metrics
+import pagescrape
+import fetchcache
 
 # IP address and URL of the webpage
 ip_address = "192.168.103.90"
-url = f"http://{ip_address}/control.html"
 #OUTPUT_DIR = "./"
 OUTPUT_DIR = "/app/logs"
+PAGES_FILE = os.path.join(HERE, "pages.yml") # table and cells holding the levels
+HELIUM_PORT = 9152 # port of the former helium grok-exporter, served by a long-lived collector
+NITROGEN_PORT = 9153 # port of the former nitrogen grok-exporter
+CACHE_FILE = "fetch-cache.json" # validators and hash of the page already logged, in the output directory
+FILE_LIMIT = 289 # i.e. keep 289 level changes and heartbeats (plus header)
+HEARTBEAT = 3600 # seconds after which unchanged levels are logged again, so the log shows the collector is alive
+FILE_HEADER = ["HeliumLevel_%", "NitrogenLevel_%"]
 
-# Send a GET request to the webpage
-response = requests.get(url)
+# Same metrics as configuration/grok/hlmu/helium.yml and nitrogen.yml
+registry = metrics.registry(HELIUM_PORT)
+helium_level = registry.gauge(
+    'helium_level', 'The helium level value exported into the log file from the hmlu scraper')
+nitrogen_level = metrics.registry(NITROGEN_PORT).gauge(
+    'nitrogen_level', 'The nitrogen level value exported into the log file from the hmlu scraper')
 
-# Check if the request was successful
-if response.status_code == 200:
-    # Parse the HTML content using BeautifulSoup
-    soup = BeautifulSoup(response.content, "html.parser")
+# Read the HLMU levels once and log them (also called by the SCANS collector scheduler)
+# The CSV log is only needed by a grok-exporter: the metrics are updated either way
+# The levels change about once a day: a page identical to the one already logged is neither parsed nor logged again,
+# and levels are only appended to the log when they change or every HEARTBEAT seconds
+def collect(ip_address=ip_address, output_dir=OUTPUT_DIR, write_csv=True, pages_file=PAGES_FILE):
+    cache = fetchcache.open_cache(os.path.join(output_dir, CACHE_FILE) if write_csv else None, registry)
+    log = csvlog.open_log(os.path.join(output_dir, "log.txt"), FILE_LIMIT - 1, FILE_HEADER) if write_csv else None
 
-    # Find all tables with the class "body"
-    tables = soup.find_all("table", class_="body")
+    for device, values in pagescrape.load(pages_file).items():
+        # Send a GET request to the webpage, unless it did not change (or the heartbeat is due)
+        heartbeat = log is not None and log.age() >= HEARTBEAT
+        pages, changed = cache.fetch_all(pagescrape.urls(values, ip_address=ip_address), force=heartbeat, timeout=10)
+        if not changed:
+            print(f"{device}: unchanged")
+            cache.done()
+            continue
 
-    # Check if at least two tables with the class "body" exist
-    if len(tables) >= 2:
-        # Get the second table with the class "body"
-        table = tables[1]
+        # Rows of [helium, nitrogen] levels, read from the table in pages.yml
+        csv_rows = pagescrape.scrape(values, lambda url: pages[url].content if pages[url] else None,
+                                     ip_address=ip_address)['levels']
+        if csv_rows is not None:
+            for helium_lvl, nitrogen_lvl in csv_rows:
+                try:
+                    helium_level.set(float(helium_lvl))
+                    nitrogen_level.set(float(nitrogen_lvl))
+                except ValueError:
+                    print(f"Unexpected levels: {helium_lvl}, {nitrogen_lvl}")
 
+            if log is not None and not log.write_changed(csv_rows, HEARTBEAT):
+                print(f"{device}: levels unchanged")
+            cache.done(*pages.values())
+        else:
+            print(f"{device}: levels not found.")
 
-        # Prepare the file path
-        file_path = os.path.join(OUTPUT_DIR, "log.txt")
+# Compact the log written before the levels were deduplicated: collapse the repeated runs and keep the last FILE_LIMIT rows
+# Older versions logged every row of the table on every run, so the log repeats batches of that many rows:
+# unless given, their number is read from the current page
+# A manual one-off (read_HLMU.py --compact): on a deduplicated log it would also collapse the heartbeat rows
+def compact(output_dir=OUTPUT_DIR, rows=None, ip_address=ip_address, pages_file=PAGES_FILE):
+    if rows is None:
+        rows = table_rows(ip_address, pages_file)
+        if rows is None:
+            print("Cannot read the number of table rows from the HLMU: give it with --rows")
+            return
+    removed = csvlog.open_log(os.path.join(output_dir, "log.txt"), FILE_LIMIT - 1, FILE_HEADER).compact(force=True, batch=rows)
+    print(f"Log compacted in batches of {rows} rows: {removed} rows removed")
 
-        # Extract data from the table and output to a file
-        with open(file_path, "a", newline="") as csvfile:
-            writer = csv.writer(csvfile)
+# Rows of levels in the HLMU table, i.e. rows logged per run by older versions (None if the page cannot be read)
+def table_rows(ip_address=ip_address, pages_file=PAGES_FILE):
+    cache = fetchcache.FetchCache()
+    for values in pagescrape.load(pages_file).values():
+        pages = {url: cache.fetch(url, conditional=False, timeout=10) for url in pagescrape.urls(values, ip_address=ip_address)}
+        csv_rows = pagescrape.scrape(values, lambda url: pages[url].content if pages[url] else None,
+                                     ip_address=ip_address)['levels']
+        if csv_rows:
+            return len(csv_rows)
+    return None
 
-            # Check if the file is empty
-            if csvfile.tell() == 0:
-                # Write header if file is empty
-                writer.writerow(["HeliumLevel_%", "NitrogenLevel_%"])
+# Argparse block
+def parse_arguments():
+    parser = argparse.ArgumentParser(description="Log the HLMU helium and nitrogen levels.")
+    parser.add_argument('--compact', action='store_true', help='Compact the log written by older versions once, instead of reading the levels')
+    parser.add_argument('--rows', type=int, help='Table rows logged per run by the older version, for --compact (default: rows of the current page)')
+    parser.add_argument('-o', '--output', default=OUTPUT_DIR, help='Directory of the log')
+    return parser.parse_args()
 
-            for row in table.find_all("tr"):
-                cells = row.find_all("td")
-                if len(cells) >= 3:
-                    helium_lvl = cells[2].text.strip()[:-2]
-                    nitrogen_lvl = cells[3].text.strip()[:-2]
-                    csv_row = [helium_lvl, nitrogen_lvl]
-                    writer.writerow(csv_row)
-                #else:
-                    #print("Insufficient number of columns in the table row.")
+if __name__ == "__main__":
+    args = parse_arguments()
+    if args.compact:
+        compact(args.output, args.rows)
     else:
-        print("Failed to retrieve the webpage.")
-else:
-    print("Request to the webpage failed.")
+        collect(output_dir=args.output)
@@ -0,0 +1,136 @@
+"""
+Benchmark of the one-pass log extractors against the grok path
+
+For each grok configuration, synthetic log lines are generated from its match expression and
+parsed twice:
+  - grok: every line goes through the regex of each metric, as grok-exporter does (emulated
+    here with Python's re), so a configuration of N metrics sharing one match runs it N times
+  - one-pass: the extractors compiled by shared/logschema.py parse every line once and
+    derive all the metrics from the same fields
+The CPU cost per line is reported twice: for parsing alone, where the speed-up is expected to
+be at least the number of metrics per match (compr.yml: 18; a column layout is split rather
+than matched, which is cheaper still), and for parsing plus the metric updates, which both
+paths have to do and which dilute the gain of the smaller configurations.
+Each measure is the best of --repeat runs.
+
+Usage: python3 bench_grok.py [--lines 200000] [grok.yml ...]
+"""
+
+import os
+import re
+import sys
+import time
+import random
+import argparse
+
+import yaml
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+# Shared SCANS modules: mounted in ./shared by docker-compose, or found in Modules/Shared of a checkout
+sys.path += [os.path.join(HERE, 'shared'), os.path.join(HERE, '..', '..', '..', '..', 'Shared')]
+
+import logschema
+
+OTHER_CLIENTS = os.path.join(HERE, '..', '..', '..')
+GROK_CONFIGS = [os.path.join(OTHER_CLIENTS, 'Client-remote', 'configuration', 'grok', 'compr.yml'),
+                os.path.join(OTHER_CLIENTS, 'Client-N2_scraper', 'configuration', 'grok', 'tank.yml'),
+                os.path.join(OTHER_CLIENTS, 'Client-N2_scraper', 'configuration', 'grok', 'spi.yml'),
+                os.path.join(OTHER_CLIENTS, 'Client-UPS', 'configuration', 'grok', 'ups.yml')]
+
+
+# Argparse block
+def parse_arguments():
+    parser = argparse.ArgumentParser(description="Benchmark the one-pass log extractors against the grok regexes.")
+    parser.add_argument('configs', nargs='*', default=GROK_CONFIGS, help='grok-exporter configurations to compare')
+    parser.add_argument('-n', '--lines', type=int, default=200000, help='Synthetic lines parsed per configuration')
+    parser.add_argument('-r', '--repeat', type=int, default=3, help='Runs of each measure (the fastest is kept)')
+    return parser.parse_args()
+
+
+def synthetic_lines(extractor, count):
+    """
+    Lines of an extractor layout: numbers in the value fields, short texts elsewhere.
+    """
+    random.seed(1)
+    values = {spec.value for spec in extractor.metrics if spec.value}
+    fields = extractor.columns or list(re.compile(extractor.match).groupindex)
+    lines = []
+    for i in range(count):
+        row = [f"{random.uniform(0, 300):.1f}" if field in values or field in extractor.numeric else f"{field}_{i % 7}"
+               for field in fields]
+        lines.append((extractor.separator if extractor.columns else ',').join(row))
+    return lines
+
+
+def parse_grok(lines, regexes):
+    for line in lines:
+        for _, regex, _, _ in regexes:
+            regex.search(line)
+    return len(lines)
+
+
+def parse_one_pass(lines, extractors):
+    for line in lines:
+        for extractor in extractors:
+            extractor.fields(line)
+    return len(lines)
+
+
+def run_grok(lines, regexes):
+    values = {}
+    for line in lines:
+        for name, regex, value, labels in regexes:
+            match = regex.search(line)
+            if match:
+                fields = match.groupdict()
+                key = (name, tuple(fields[field] for field in labels.values()))
+                values[key] = float(fields[value]) if value else values.get(key, 0) + 1
+    return len(lines)
+
+
+def run_one_pass(lines, extractors):
+    values = {}
+    for line in lines:
+        for extractor in extractors:
+            for spec, labels, value in extractor.samples(line):
+                key = (spec.name, tuple(labels.values()))
+                values[key] = value if value is not None else values.get(key, 0) + 1
+    return len(lines)
+
+
+def measure(label, repeat, function, *args):
+    costs = []
+    for _ in range(repeat):
+        begin = time.process_time()
+        lines = function(*args)
+        costs.append((time.process_time() - begin) / lines)
+    cost = min(costs)
+    print(f"{label:>18}: {cost * 1e6:.2f} us CPU per line ({1 / cost:,.0f} lines/s)")
+    return cost
+
+
+def main():
+    args = parse_arguments()
+    for path in args.configs:
+        with open(path) as file:
+            config = yaml.safe_load(file)
+        extractors = logschema.compile_grok(config)
+        regexes = [(metric['name'], re.compile(logschema.grok_to_regex(metric['match'])),
+                    logschema.template_field(metric['value']) if metric.get('value') else None,
+                    {label: logschema.template_field(template) for label, template in (metric.get('labels') or {}).items()})
+                   for metric in config['metrics']]
+        lines = [line for extractor in extractors for line in synthetic_lines(extractor, args.lines // len(extractors))]
+
+        print(f"{os.path.basename(path)}: {len(regexes)} metrics, {len(extractors)} layout(s) "
+              f"({', '.join('columns' if extractor.columns else 'regex' for extractor in extractors)}), {len(lines)} lines")
+        per_match = len(regexes) / len(extractors)
+        grok_cost = measure('grok parse', args.repeat, parse_grok, lines, regexes)
+        one_pass_cost = measure('one-pass parse', args.repeat, parse_one_pass, lines, extractors)
+        print(f"{'speed-up':>18}: x{grok_cost / one_pass_cost:.1f} for {per_match:g} metrics per match")
+        grok_cost = measure('grok + updates', args.repeat, run_grok, lines, regexes)
+        one_pass_cost = measure('one-pass + updates', args.repeat, run_one_pass, lines, extractors)
+        print(f"{'speed-up':>18}: x{grok_cost / one_pass_cost:.1f}\n")
+
+
+if __name__ == "__main__":
+    main()
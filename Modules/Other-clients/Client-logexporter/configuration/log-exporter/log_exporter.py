@@ -0,0 +1,154 @@
+"""
+One-pass log exporter for the Other-clients CSV logs
+
+A replacement for the grok-exporter containers reading the logs of the cron-driven
+collectors. grok-exporter evaluates the full match expression of every metric on every
+line; here each line is parsed once (see shared/logschema.py) and all the metrics of its
+layout are updated from the same fields, with the metric names, labels and port of the grok
+configuration it replaces.
+
+The exporter runs from a native configuration, compiled once from a grok configuration or
+from a column schema:
+
+    python log_exporter.py --compile-grok ../../../Client-remote/configuration/grok/compr.yml -o compr.yml
+    python log_exporter.py --compile-columns 'lab_temperature,lab_humidity,lab_pressure' --port 9155 -o env.yml
+    python log_exporter.py -c compr.yml
+
+As with grok's readall: false, a log is followed from its end, and only its last line is
+read when the exporter starts.
+"""
+
+import os
+import sys
+import logging
+import argparse
+
+import yaml
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+# Shared SCANS modules: mounted in ./shared by docker-compose, or found in Modules/Shared of a checkout
+sys.path += [os.path.join(HERE, 'shared'), os.path.join(HERE, '..', '..', '..', '..', 'Shared')]
+
+import logtail
+import logschema
+import metrics
+
+CONFIG_FILE = '/app/config.yml'
+LOG_FILE = '/opt/logs/log.txt' # log followed, as mounted for the grok-exporters
+POLL_INTERVAL = 5 # maximum seconds between checks of the log (inotify usually wakes the exporter sooner)
+
+
+# Argparse block
+def parse_arguments():
+    parser = argparse.ArgumentParser(description="Export the metrics of a CSV log, parsing each line once.")
+    parser.add_argument('-c', '--config', default=CONFIG_FILE, help='Native configuration to run')
+    parser.add_argument('--compile-grok', metavar='GROK_YML', help='Compile a grok-exporter configuration instead of running')
+    parser.add_argument('--compile-columns', metavar='COLUMNS',
+                        help='Compile a column schema (comma-separated names, or @FILE to read the header line of a log)')
+    parser.add_argument('--separator', default=',', help='Separator of the columns of --compile-columns')
+    parser.add_argument('--labels', default='', help='Columns of --compile-columns used as labels (comma-separated)')
+    parser.add_argument('--prefix', default='', help='Prefix of the metric names of --compile-columns')
+    parser.add_argument('--path', default=LOG_FILE, help='Log file of --compile-columns')
+    parser.add_argument('--port', type=int, help='Port of --compile-columns (or to override the grok port)')
+    parser.add_argument('-o', '--output', help='Native configuration written by --compile-grok or --compile-columns (default: STDOUT)')
+    parser.add_argument('-i', '--interval', type=float, default=POLL_INTERVAL, help='Maximum seconds between checks of the log')
+    parser.add_argument('--log-stdout', action='store_true', help='Enable logging messages to STDOUT')
+    return parser.parse_args()
+
+
+def read_columns(text):
+    """
+    Return the column names of a schema given as 'a,b,c' or '@log file' (its first line).
+    """
+    if text.startswith('@'):
+        with open(text[1:], 'r') as file:
+            text = file.readline().strip().strip('"')
+    return [column.strip().lstrip('#') for column in text.split(',') if column.strip()]
+
+
+def compile_config(args):
+    """
+    Return the native configuration asked for on the command line.
+    """
+    if args.compile_grok:
+        with open(args.compile_grok, 'r') as file:
+            grok = yaml.safe_load(file)
+        extractors = logschema.compile_grok(grok)
+        path = (grok.get('input') or {}).get('path', LOG_FILE)
+        port = args.port or (grok.get('server') or {}).get('port')
+        source = os.path.basename(args.compile_grok)
+    else:
+        columns = read_columns(args.compile_columns)
+        labels = [label for label in args.labels.split(',') if label]
+        extractors = [logschema.compile_columns(columns, args.separator, labels, args.prefix)]
+        path, port, source = args.path, args.port, 'a column schema'
+    if not port:
+        sys.exit("No port for the metrics: give --port")
+    return source, {'path': path, 'port': port, 'extractors': [extractor.to_native() for extractor in extractors]}
+
+
+def write_config(source, config, output):
+    text = f"# Compiled from {source} by log_exporter.py\n" + yaml.safe_dump(config, sort_keys=False, width=200)
+    if output:
+        with open(output, 'w') as file:
+            file.write(text)
+    else:
+        sys.stdout.write(text)
+
+
+def bind_metrics(registry, extractors):
+    """
+    Return, for each extractor, the registry metric of each of its MetricSpec.
+    """
+    return [(extractor, [registry.counter(spec.name, spec.help) if spec.type == 'counter' else
+                         registry.gauge(spec.name, spec.help)
+                         for spec in extractor.metrics])
+            for extractor in extractors]
+
+
+def update(bound, lines):
+    for line in lines:
+        for extractor, registry_metrics in bound:
+            for (spec, labels, value), metric in zip(extractor.samples(line), registry_metrics):
+                if spec.type == 'counter':
+                    metric.inc(1 if value is None else value, **labels)
+                else:
+                    metric.set(value, **labels)
+
+
+def run(config, interval):
+    bound = bind_metrics(metrics.registry(config['port']), logschema.load_native(config))
+    metrics.enable_serving()
+
+    tail = logtail.FileTail(config['path'])
+    # Only the latest line of the existing log is reported, as grok does with readall: false
+    seed = tail.last_line()
+    if seed:
+        update(bound, [seed])
+
+    watcher = logtail.Watcher([config['path']])
+    while True:
+        lines = tail.read()
+        while lines:
+            update(bound, lines)
+            lines = tail.read()
+        watcher.wait(interval)
+
+
+def main():
+    args = parse_arguments()
+    if args.log_stdout:
+        logging.basicConfig(level=logging.INFO)
+
+    if args.compile_grok or args.compile_columns:
+        write_config(*compile_config(args), args.output)
+        return
+
+    with open(args.config, 'r') as file:
+        config = yaml.safe_load(file)
+    logging.info(f"Following {config['path']}, metrics on port {config['port']}")
+    run(config, args.interval)
+
+
+if __name__ == "__main__":
+    main()
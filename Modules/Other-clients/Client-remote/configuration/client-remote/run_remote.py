@@ -1,7 +1,21 @@
 import paramiko
 import argparse
-import csv
 import ast
+import time
+import socket
+import os
+import sys
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+import yaml
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+# Shared SCANS modules: mounted in ./shared by docker-compose, or found in Modules/Shared of a checkout
+sys.path += [os.path.join(HERE, 'shared'), os.path.join(HERE, '..', '..', '..', '..', 'Shared')]
+
+import csvlog
+import metrics
 
 # Example usage
 hostname = "192.168.X.X" # IP address of the remote computer
@@ -9,91 +23,260 @@ username = "crmn"
 private_key_path = "/app/private_key"
 command = "/opt/local/bin/python3.9 /SCANS/standalonescripts/comp-scraper.py -s /dev/tty.usbserial-00004004"
 
+CONFIG_FILE = "/app/config.yml" # Optional list of remote hosts and commands
+LOG_FILE = "/app/logs/log.txt" # default log file of the hosts
+KEEPALIVE = 30 # seconds between two SSH keepalive packets on an idle connection
+STREAM_TIMEOUT = 120 # seconds without a record before a stream is considered dead
+MAX_RETRY_DELAY = 300 # longest wait between two attempts to restart a stream
+LOG_LIMIT = 10 # records kept in each log file (and as many in its previous segment)
+METRICS_PORT = 9151 # port of the former compressor grok-exporter
+
+# Same metrics as configuration/grok/compr.yml, in the order of the fields of a record,
+# labelled with the host they come from (several compressors are collected at once)
+registry = metrics.registry(METRICS_PORT)
+compressor_metrics = [registry.gauge(name, help_text) for name, help_text in [
+    ('output_pressure', 'The output pressure of the compressor to the He rack'),
+    ('input_pressure', 'The input pressure of the compressor from the balloon'),
+    ('balloon_level', 'The precentage balloon level'),
+    ('cooling_air_temp', 'The temperature of the cooling air received by the compressor'),
+    ('last_stage_temp', 'The temperature of final compressor stage'),
+    ('stage_1_temp', 'The temperature of first compressor stage'),
+    ('stage_2_temp', 'The temperature of second compressor stage'),
+    ('stage_3_temp', 'The temperature of third compressor stage'),
+    ('stage_4_temp', 'The temperature of fourth compressor stage'),
+    ('total_operating_hours', 'The total operating hours of the compressor'),
+    ('messages_0', 'The code for the first messages block'),
+    ('messages_1', 'The code for the second messages block'),
+    ('alarms_0', 'The code for the first alarms block'),
+    ('alarms_1', 'The code for the second alarms block'),
+    ('alarms_2', 'The code for the third alarms block'),
+    ('alarms_3', 'The code for the fourth alarms block'),
+    ('alarms_4', 'The code for the fifth alarms block'),
+    ('alarms_5', 'The code for the sixth alarms block')]]
+
 # Parse command-line arguments
-parser = argparse.ArgumentParser()
-parser.add_argument('-f', '--filepath', help='Path to the log file')
-args = parser.parse_args()
+def parse_arguments():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('-f', '--filepath', default=LOG_FILE, help='Path to the log file')
+    parser.add_argument('-c', '--config', default=CONFIG_FILE, help='YAML file listing the remote hosts and their commands')
+    parser.add_argument('-i', '--interval', type=float,
+                        help='Keep running and collect every INTERVAL seconds, reusing the SSH connections')
+    parser.add_argument('-s', '--stream', action='store_true',
+                        help='Start the remote collectors once and write their records as they stream in')
+    parser.add_argument('-m', '--metrics', action='store_true',
+                        help=f'Serve the compressor metrics on port {METRICS_PORT} (in place of its grok-exporter); '
+                             'with --filepath "" no log file is written')
+    return parser.parse_args()
 
-# CSV file path
-if args.filepath:
-    csv_file_path = args.filepath
-else:
-    csv_file_path = "/app/logs/log.txt"
+# Persistent SSH connections, one per host and user
+# A connection found dead (remote reboot, network outage) is transparently reopened
+class SSHPool:
+    def __init__(self, keepalive=KEEPALIVE):
+        self.keepalive = keepalive
+        self.lock = threading.Lock()
+        self.clients = {}
+        self.host_locks = {}
+        self.keys = {}
 
-def run_ssh_command(hostname, username, private_key_path, command):
-    # Create an SSH client
-    client = paramiko.SSHClient()
+    # Parse each private key once
+    def load_key(self, key_path):
+        with self.lock:
+            if key_path not in self.keys:
+                self.keys[key_path] = paramiko.RSAKey.from_private_key_file(key_path)
+            return self.keys[key_path]
 
-    # Automatically add the host key
-    client.set_missing_host_key_policy(paramiko.AutoAddPolicy())
+    def host_lock(self, key):
+        with self.lock:
+            return self.host_locks.setdefault(key, threading.Lock())
 
-    try:
-        # Load the private key
-        private_key = paramiko.RSAKey.from_private_key_file(private_key_path)
+    def get(self, hostname, username, key_path):
+        key = (hostname, username)
+        with self.host_lock(key):
+            client = self.clients.get(key)
+            transport = client.get_transport() if client else None
+            if transport is not None and transport.is_active():
+                return client
+            if client:
+                client.close()
 
-        # Connect to the SSH server using the private key
-        client.connect(hostname=hostname, username=username, pkey=private_key)
+            client = paramiko.SSHClient()
+            # Automatically add the host key
+            client.set_missing_host_key_policy(paramiko.AutoAddPolicy())
+            client.connect(hostname=hostname, username=username, pkey=self.load_key(key_path))
+            client.get_transport().set_keepalive(self.keepalive)
+            self.clients[key] = client
+            return client
 
-        # Run the command
-        stdin, stdout, stderr = client.exec_command(command)
+    def discard(self, hostname, username):
+        with self.host_lock((hostname, username)):
+            client = self.clients.pop((hostname, username), None)
+            if client:
+                client.close()
 
-        # Read the STDOUT
-        stdout = stdout.read().decode()
-        output_list = ast.literal_eval(stdout)
-        output_string = ', '.join(output_list)
+    def close(self):
+        with self.lock:
+            for client in self.clients.values():
+                client.close()
+            self.clients.clear()
 
-        # Print the output
-        return output_string
+pool = SSHPool()
 
-    except paramiko.AuthenticationException:
-        print("Authentication failed.")
-    except paramiko.SSHException as e:
-        print("SSH connection error:", str(e))
-    finally:
-        # Close the SSH connection
-        client.close()
+def run_ssh_command(hostname, username, private_key_path, command):
+    # A connection that died since the previous run is reopened once before giving up
+    for attempt in range(2):
+        try:
+            client = pool.get(hostname, username, private_key_path)
 
-def write_to_log_file(output_string):
-    try:
-        with open(csv_file_path, 'a', newline='') as file:
-            file.write(output_string + '\n')
-    except Exception as e:
-        print(f'Error writing to log file: {e}')
+            # Run the command
+            stdin, stdout, stderr = client.exec_command(command)
 
-def clear_data_lines_in_csv():
-    try:
-        with open(csv_file_path, 'r') as csvfile:
-            lines = csvfile.readlines()
-            if len(lines) >= 10:
-                with open(csv_file_path, 'w', newline='') as csvfile:
-                    csvfile.truncate(0)
-    except Exception as e:
-        print(f'Error clearing data lines in CSV: {e}')
+            # Read the STDOUT
+            stdout = stdout.read().decode()
+            output_list = ast.literal_eval(stdout)
+            output_string = ', '.join(output_list)
+
+            # Print the output
+            return output_string
 
-def csv_file_exists():
+        except paramiko.AuthenticationException:
+            print(f"Authentication failed on {hostname}.")
+            return None
+        except (paramiko.SSHException, EOFError, OSError) as e:
+            pool.discard(hostname, username)
+            if attempt:
+                print(f"SSH connection error on {hostname}:", str(e))
+        except (ValueError, SyntaxError) as e:
+            print(f"Unexpected output from {hostname}: {e}")
+            return None
+    return None
+
+# Return the list of targets: the hosts of the config file, or the single example host above
+def read_targets(config_file, csv_file_path=LOG_FILE):
     try:
-        with open(csv_file_path, 'r') as csvfile:
-            return csvfile.read().strip() != ''
+        with open(config_file, 'r') as file:
+            config = yaml.safe_load(file) or {}
     except FileNotFoundError:
-        return False
+        config = {}
+    targets = []
+    for host in config.get("Hosts") or []:
+        targets.append({'hostname': host['hostname'],
+                        'username': host.get('username', username),
+                        'private_key': host.get('private_key', private_key_path),
+                        'command': host.get('command', command),
+                        'stream_command': host.get('stream_command', host.get('command', command) + ' --stream'),
+                        'filepath': host.get('filepath', csv_file_path)})
+    if not targets:
+        targets.append({'hostname': hostname, 'username': username, 'private_key': private_key_path,
+                        'command': command, 'stream_command': command + ' --stream', 'filepath': csv_file_path})
+    return targets
 
+# Append a record to a log file, keeping the last LOG_LIMIT records
+def write_to_log_file(output_string, file_path):
+    try:
+        csvlog.open_log(file_path, LOG_LIMIT).write_lines([output_string])
+    except Exception as e:
+        print(f'Error writing to log file: {e}')
 
-def master_writer():
-    # Clear the data lines in the CSV file
-
-    if csv_file_exists():
-        clear_data_lines_in_csv()
+# Update the compressor metrics of a host with a record (a complete one only, as the grok-exporter did)
+def update_metrics(record, host):
+    values = record.split(', ')
+    if len(values) != len(compressor_metrics):
+        return
+    try:
+        values = [float(value) for value in values]
+    except ValueError:
+        return
+    for metric, value in zip(compressor_metrics, values):
+        metric.set(value, host=host)
 
+# Run the command of one target and write its output to the target's log file
+def collect_target(target):
     # Execute the SSH command
-    output = run_ssh_command(hostname, username, private_key_path, command)
+    output = run_ssh_command(target['hostname'], target['username'], target['private_key'], target['command'])
+    if output is None:
+        return
 
     # Write output to STDOUT
-    print(output)
+    print(f"{target['hostname']}: {output}")
+    update_metrics(output, target['hostname'])
 
     # Write output to the log file if filepath provided
-    if csv_file_path:
-        write_to_log_file(output)
+    if target['filepath']:
+        write_to_log_file(output, target['filepath'])
+
+# Records are lines of numbers separated by ', '
+def is_record(line):
+    try:
+        [float(value) for value in line.split(', ')]
+        return True
+    except ValueError:
+        return False
+
+# Run the streaming collector of one target and write each record as it arrives
+# The remote collector is started once; it is restarted (with a growing delay) whenever the stream breaks
+def stream_target(target):
+    delay = 5
+    while True:
+        try:
+            client = pool.get(target['hostname'], target['username'], target['private_key'])
+            channel = client.get_transport().open_session()
+            # Error messages come through the same stream, so the channel never stalls on an unread stderr
+            channel.set_combine_stderr(True)
+            channel.settimeout(STREAM_TIMEOUT)
+            # The remote collector stops on its next write once the channel is closed
+            channel.exec_command(target['stream_command'])
+            stdout = channel.makefile('r')
+            print(f"{target['hostname']}: streaming started")
+            for line in stdout:
+                record = line.strip()
+                if is_record(record):
+                    update_metrics(record, target['hostname'])
+                    if target['filepath']:
+                        write_to_log_file(record, target['filepath'])
+                    delay = 5
+                elif record:
+                    print(f"{target['hostname']}: {record}")
+            print(f"{target['hostname']}: stream ended (exit status {stdout.channel.recv_exit_status()})")
+        except paramiko.AuthenticationException:
+            print(f"Authentication failed on {target['hostname']}.")
+        except socket.timeout:
+            print(f"{target['hostname']}: no record for {STREAM_TIMEOUT} s, restarting the stream")
+            pool.discard(target['hostname'], target['username'])
+        except (paramiko.SSHException, EOFError, OSError) as e:
+            print(f"SSH connection error on {target['hostname']}:", str(e))
+            pool.discard(target['hostname'], target['username'])
+        time.sleep(delay)
+        delay = min(delay * 2, MAX_RETRY_DELAY)
+
+# Collect from every target at once: a cycle takes as long as the slowest host
+def master_writer(targets, executor):
+    list(executor.map(collect_target, targets))
+
+# Collect once from every host (also called by the SCANS collector scheduler, the SSH connections stay open in between)
+# The log files are only needed by a grok-exporter: the metrics are updated either way
+def collect(config_file=CONFIG_FILE, filepath=LOG_FILE, write_csv=True):
+    targets = read_targets(config_file, filepath)
+    if not write_csv:
+        for target in targets:
+            target['filepath'] = None
+    with ThreadPoolExecutor(max_workers=len(targets)) as executor:
+        master_writer(targets, executor)
 
 # Execute the script
 if __name__ == '__main__':
-    master_writer()
\ No newline at end of file
+    args = parse_arguments()
+    if args.metrics:
+        metrics.enable_serving()
+    targets = read_targets(args.config, args.filepath)
+    with ThreadPoolExecutor(max_workers=len(targets)) as executor:
+        try:
+            if args.stream:
+                list(executor.map(stream_target, targets))
+            while True:
+                start = time.monotonic()
+                master_writer(targets, executor)
+                if not args.interval:
+                    break
+                time.sleep(max(0, args.interval - (time.monotonic() - start)))
+        finally:
+            pool.close()
@@ -1,7 +1,19 @@
 import argparse
 from pymodbus.client import ModbusSerialClient
 import csv
+import io
+import os
+import re
+import sys
 import time
+import threading
+from collections import deque
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+# Shared SCANS modules: copied into ./shared next to this script, or found in Modules/Shared of a checkout
+# Only the log file (--filepath) needs them, so the remote copy runs without them in the other modes
+sys.path += [os.path.join(HERE, 'shared'), os.path.join(HERE, '..', '..', 'Shared')]
 
 # Parse command-line arguments
 parser = argparse.ArgumentParser()
@@ -9,6 +21,16 @@ parser.add_argument('-s', '--serialport', required=True, help='The path to the s
 parser.add_argument('-f', '--filepath', help='Path to the log file')
 parser.add_argument('-p', '--prettyoutput', action='store_true', help='Print pretty output to standard output')
 parser.add_argument('-t', '--timing', action='store_true', help='Enable script timing')
+parser.add_argument('-g', '--max-gap', type=int, default=8,
+                    help='Unused registers allowed between two addresses read in one request (-1 reads every register on its own)')
+parser.add_argument('-d', '--daemon', action='store_true',
+                    help='Keep the serial port open, sample continuously and serve windowed aggregates over HTTP')
+parser.add_argument('--stream', action='store_true',
+                    help='Keep the serial port open and print one line per sample to STDOUT (for run_remote.py --stream)')
+parser.add_argument('--sample-interval', type=float, default=1.0, help='Seconds between two samples in daemon or stream mode')
+parser.add_argument('--window', type=float, default=60, help='Seconds aggregated in one window in daemon mode (at least the Prometheus scrape interval: /metrics only serves the last window)')
+parser.add_argument('--windows', type=int, default=1440, help='Number of windows kept in memory in daemon mode')
+parser.add_argument('--listen', type=int, default=9157, help='HTTP port of the daemon (/metrics and /csv)')
 args = parser.parse_args()
 
 # Serial port
@@ -27,6 +49,8 @@ PARITY = 'N'                 # Parity ('N': None, 'E': Even, 'O': Odd)
 STOPBITS = 1                 # Number of stop bits
 BYTESIZE = 8                 # Number of data bits
 UNIT_ID = 1                  # Modbus unit ID
+MAX_READ = 125               # Registers allowed in one read request by the Modbus specification
+LOG_LIMIT = 10               # Rows kept in the log file (and as many in its previous segment)
 
 # A dictionary with register addresses and their properties (from BAUER documentation)
 address_dict = {
@@ -50,27 +74,73 @@ address_dict = {
     57: {'name': 'alarms & messages 8', 'scale': 1, 'result': None, 'unit': ''}
 }
 
-def read_modbus_registers():
-    try:
-        client = ModbusSerialClient(method='rtu', port=SERIAL_PORT, baudrate=BAUDRATE, parity=PARITY,
-                                    stopbits=STOPBITS, bytesize=BYTESIZE, timeout=1)
-        if not client.connect():
-            print('Connection failed!')
-            return
+# Merge the register addresses into as few block reads as possible
+# Returns a list of (first address, number of registers) tuples
+def plan_reads(addresses, max_gap, max_read=MAX_READ):
+    blocks = []
+    for address in sorted(addresses):
+        if blocks and max_gap >= 0:
+            start, count = blocks[-1]
+            if address - (start + count) <= max_gap and address - start < max_read:
+                blocks[-1] = (start, address - start + 1)
+                continue
+        blocks.append((address, 1))
+    return blocks
+
+# Store the scaled value of every register found in a block of registers read from start
+def scatter_registers(start, registers):
+    for offset, value in enumerate(registers):
+        properties = address_dict.get(start + offset)
+        if properties is None:
+            continue
+        if properties['scale'] >1:
+            properties['result'] = value / properties['scale']
+        else:
+            properties['result'] = value
 
-        for address, properties in address_dict.items():
+# Open the Modbus RTU connection, or return None if the device cannot be reached
+def connect_client():
+    client = ModbusSerialClient(method='rtu', port=SERIAL_PORT, baudrate=BAUDRATE, parity=PARITY,
+                                stopbits=STOPBITS, bytesize=BYTESIZE, timeout=1)
+    if not client.connect():
+        print('Connection failed!')
+        return None
+    return client
+
+# Read every register of address_dict over an open connection
+# Returns the number of Modbus requests made
+def read_registers(client):
+    requests = 0
+    for start, count in plan_reads(address_dict, args.max_gap):
+        result = client.read_holding_registers(start, count=count, unit=UNIT_ID)
+        requests += 1
+        if not result.isError():
+            scatter_registers(start, result.registers)
+            continue
+        if count == 1:
+            print(f'Error reading register {start}: {result}')
+            continue
+        # The unused registers of a block may not exist on the device: read its addresses one by one
+        for address in [a for a in address_dict if start <= a < start + count]:
             result = client.read_holding_registers(address, count=1, unit=UNIT_ID)
+            requests += 1
             if result.isError():
                 print(f'Error reading register {address}: {result}')
             else:
-                value = result.registers[0]
-                
-                if properties['scale'] >1:
-                    properties['result'] = value / properties['scale']
-                else:
-                    properties['result'] = value
+                scatter_registers(address, result.registers)
+    return requests
+
+def read_modbus_registers():
+    try:
+        client = connect_client()
+        if client is None:
+            return
+
+        requests = read_registers(client)
 
         client.close()
+        if args.timing:
+            print(f'Modbus requests: {requests} for {len(address_dict)} registers')
         
     except Exception as e:
         print(f'Error: {e}')
@@ -80,71 +150,230 @@ def write_to_stdout_pretty():
     for address, properties in address_dict.items():
         print(f"Address: {address}, Name: {properties['name']}, Result: {properties['result']} {properties['unit']}")
 
-def write_to_log_file():
+def masterWriter():
+    # Append a data row, keeping the last LOG_LIMIT rows below the header row
+    header_row = ['#' + item['name'] for item in address_dict.values()]
+    try:
+        import csvlog
+    except ImportError:
+        print(f"Error writing to log file: csvlog.py not found (copy Modules/Shared into {os.path.join(HERE, 'shared')})")
+        return
     try:
-        with open(csv_file_path, 'a', newline='') as file:
-            writer = csv.writer(file)
-            writer.writerow([properties['name'], properties['result'], properties['unit']])
+        csvlog.open_log(csv_file_path, LOG_LIMIT, header_row).write(create_csv_row())
     except Exception as e:
         print(f'Error writing to log file: {e}')
 
-def csv_file_exists():
+def create_csv_row():
+    return [str(item['result']) for item in address_dict.values()]
+
+# Aggregates (min, max, mean, last) of every register over one window of samples
+class Window:
+    def __init__(self, start):
+        self.start = start
+        self.end = start
+        self.samples = 0
+        self.stats = {}
+
+    def add(self, timestamp, values):
+        self.end = timestamp
+        self.samples += 1
+        for address, value in values.items():
+            stats = self.stats.get(address)
+            if stats is None:
+                self.stats[address] = [value, value, value, 1, value]
+            else:
+                stats[0] = min(stats[0], value)
+                stats[1] = max(stats[1], value)
+                stats[2] += value
+                stats[3] += 1
+                stats[4] = value
+
+    # Returns {address: (min, max, mean, last)}
+    def aggregates(self):
+        return {address: (low, high, total / count, last) for address, (low, high, total, count, last) in self.stats.items()}
+
+# Fixed-size ring of the completed windows, plus the window being filled
+class SampleRing:
+    def __init__(self, window, size):
+        self.window = window
+        self.lock = threading.Lock()
+        self.completed = deque(maxlen=size)
+        self.total = 0
+        self.current = None
+
+    def add(self, timestamp, values):
+        with self.lock:
+            if self.current is not None and timestamp - self.current.start >= self.window:
+                self.completed.append(self.current)
+                self.total += 1
+                self.current = None
+            if self.current is None:
+                self.current = Window(timestamp - timestamp % self.window)
+            self.current.add(timestamp, values)
+
+    def windows(self):
+        with self.lock:
+            return list(self.completed)
+
+    def completed_total(self):
+        with self.lock:
+            return self.total
+
+# Prometheus name of a register, e.g. 'compressor_1st_stage_temp'
+def metric_name(properties):
+    return 'compressor_' + re.sub(r'[^a-z0-9]+', '_', properties['name'].lower()).strip('_')
+
+# Prometheus exposition of the latest completed window, stamped with its end time
+# A scrape holds one sample per series, so a scrape interval longer than --window skips windows:
+# compressor_windows_completed_total shows it (it grows by more than one between two scrapes),
+# and /csv still serves every window kept in the ring
+def render_metrics(ring):
+    windows = ring.windows()
+    total = ring.completed_total()
+    if not windows:
+        return ''
+    window = windows[-1]
+    stamp = int(window.end * 1000)
+    aggregates = window.aggregates()
+    lines = []
+    for address, properties in address_dict.items():
+        if address not in aggregates:
+            continue
+        name = metric_name(properties)
+        lines.append(f"# HELP {name} {properties['name']} ({properties['unit'] or 'raw'}) over the last {ring.window:g} s window")
+        lines.append(f"# TYPE {name} gauge")
+        for stat, value in zip(('min', 'max', 'mean', 'last'), aggregates[address]):
+            lines.append(f'{name}{{stat="{stat}"}} {value!r} {stamp}')
+    lines.append('# HELP compressor_window_samples Samples read in the last window')
+    lines.append('# TYPE compressor_window_samples gauge')
+    lines.append(f'compressor_window_samples {window.samples} {stamp}')
+    lines.append('# HELP compressor_windows_completed_total Windows completed since the daemon started')
+    lines.append('# TYPE compressor_windows_completed_total counter')
+    lines.append(f'compressor_windows_completed_total {total}')
+    return '\n'.join(lines) + '\n'
+
+# CSV of every completed window: start, end, samples, then min/max/mean/last of each register
+def render_csv(ring):
+    output = io.StringIO()
+    writer = csv.writer(output)
+    writer.writerow(['#window start', 'window end', 'samples'] +
+                    [f"{properties['name']} {stat}" for properties in address_dict.values() for stat in ('min', 'max', 'mean', 'last')])
+    for window in ring.windows():
+        aggregates = window.aggregates()
+        row = [time.strftime('%Y-%m-%dT%H:%M:%S', time.localtime(window.start)),
+               time.strftime('%Y-%m-%dT%H:%M:%S', time.localtime(window.end)), window.samples]
+        for address in address_dict:
+            row += list(aggregates.get(address, ('', '', '', '')))
+        writer.writerow(row)
+    return output.getvalue()
+
+def make_handler(ring):
+    class AggregateHandler(BaseHTTPRequestHandler):
+        def do_GET(self):
+            path = self.path.split('?')[0]
+            if path in ('/', '/metrics'):
+                body, content_type = render_metrics(ring), 'text/plain; version=0.0.4; charset=utf-8'
+            elif path == '/csv':
+                body, content_type = render_csv(ring), 'text/csv; charset=utf-8'
+            else:
+                self.send_error(404)
+                return
+            body = body.encode('utf-8')
+            self.send_response(200)
+            self.send_header('Content-Type', content_type)
+            self.send_header('Content-Length', str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def log_message(self, format, *args):
+            pass
+
+    return AggregateHandler
+
+# Sample the registers every --sample-interval seconds over a connection kept open
+# Calls handle_sample(timestamp, {address: value}) for every sample with at least one value
+# handle_sample may raise SystemExit to stop sampling: the serial port is closed on the way out
+def sample_forever(handle_sample):
+    client = None
+    next_sample = time.monotonic()
     try:
-        with open(csv_file_path, 'r') as csvfile:
-            return csvfile.read().strip() != ''
-    except FileNotFoundError:
-        return False
-    
-def write_header_to_csv():
-    with open(csv_file_path, 'w', newline='') as csvfile:
-        writer = csv.writer(csvfile)
-        header_row = ['#' + item['name'] for item in address_dict.values()]
-        writer.writerow(header_row)
-
-def clear_data_lines_in_csv():
-    with open(csv_file_path, 'r') as csvfile:
-        lines = csvfile.readlines()
-        if len(lines) >= 11:
-            with open(csv_file_path, 'w', newline='') as csvfile:
-                csvfile.write(lines[0])
-
-def write_data_to_csv(data_row):
-    with open(csv_file_path, 'a', newline='') as csvfile:
-        writer = csv.writer(csvfile)
-        writer.writerow(data_row)
+        while True:
+            try:
+                if client is None:
+                    client = connect_client()
+                if client is not None:
+                    for properties in address_dict.values():
+                        properties['result'] = None
+                    read_registers(client)
+                    values = {address: properties['result'] for address, properties in address_dict.items()
+                              if properties['result'] is not None}
+                    if values:
+                        handle_sample(time.time(), values)
+            except Exception as e:
+                # Reopen the serial port on the next sample (e.g. USB adapter unplugged)
+                print(f'Error: {e}')
+                if client is not None:
+                    client.close()
+                client = None
 
-def masterWriter():
-     # Check if csv file exists or is empty
-    if not csv_file_exists():
-        # Write the header row to the CSV file
-        write_header_to_csv()
-    else:
-        # Clear data lines in the csv file if it exists and is 10 lines or longer
-        clear_data_lines_in_csv()
+            next_sample += args.sample_interval
+            delay = next_sample - time.monotonic()
+            if delay < 0:
+                # Reads slower than the interval: sample again straight away, without catching up
+                next_sample = time.monotonic()
+                delay = 0
+            time.sleep(delay)
+    finally:
+        if client is not None:
+            client.close()
 
-    # Create a data row and write to file
-    csv_row = create_csv_row()
-    write_data_to_csv(csv_row)
+# Sample continuously, serving the aggregates over HTTP
+def run_daemon():
+    ring = SampleRing(args.window, args.windows)
+    server = ThreadingHTTPServer(('', args.listen), make_handler(ring))
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    print(f'Serving compressor aggregates on port {args.listen} (/metrics, /csv)')
+    sample_forever(ring.add)
 
-def create_csv_row():
-    return [str(item['result']) for item in address_dict.values()]
+# Sample continuously, writing one line per complete sample to STDOUT (same format as the log of run_remote.py)
+def run_stream():
+    # Only records go to STDOUT, so the reader at the other end of the pipe never sees an error message
+    records = sys.stdout
+    sys.stdout = sys.stderr
+
+    def write_record(timestamp, values):
+        if len(values) == len(address_dict):
+            try:
+                records.write(', '.join(create_csv_row()) + '\n')
+                records.flush()
+            except OSError:
+                # The reader went away (e.g. the SSH session of run_remote.py closed): stop, releasing the serial port
+                # STDOUT is pointed at /dev/null first, so flushing it on exit does not fail again
+                os.dup2(os.open(os.devnull, os.O_WRONLY), records.fileno())
+                sys.exit(0)
 
-# Read Modbus registers
-read_modbus_registers()
+    sample_forever(write_record)
 
-# Write output to STDOUT or log file based on the presence of filepath and prettyoutput flag
-if args.filepath and args.prettyoutput:
-    masterWriter()
-    write_to_stdout_pretty()
-elif args.prettyoutput:
-    write_to_stdout_pretty()
+if args.daemon:
+    run_daemon()
+elif args.stream:
+    run_stream()
 else:
-    csv_row = create_csv_row()
-    print(csv_row)
+    # Read Modbus registers
+    read_modbus_registers()
 
-# Calculate and print the script execution time if timing is enabled
-if args.timing:
-    end_time = time.time()
-    execution_time = end_time - start_time
-    print(f'Script execution time: {execution_time} seconds')
+    # Write output to STDOUT or log file based on the presence of filepath and prettyoutput flag
+    if args.filepath and args.prettyoutput:
+        masterWriter()
+        write_to_stdout_pretty()
+    elif args.prettyoutput:
+        write_to_stdout_pretty()
+    else:
+        csv_row = create_csv_row()
+        print(csv_row)
 
+    # Calculate and print the script execution time if timing is enabled
+    if args.timing:
+        end_time = time.time()
+        execution_time = end_time - start_time
+        print(f'Script execution time: {execution_time} seconds')
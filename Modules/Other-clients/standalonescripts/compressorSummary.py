@@ -1,11 +1,60 @@
+"""
+Monthly summary of the compressor output pressure, read from prom-long
+
+A month of output_pressure{} at a 300 s step is queried in day (or week) sized chunks
+instead of one query_range call, so no query comes near the 11,000 points per series that
+Prometheus accepts and no response holds the whole month. The chunks are fetched
+concurrently over one pooled HTTP session, and every chunk that ended a day ago (so the points
+prom-long receives late are in it) is kept in a local cache (one NumPy .npz file per query,
+step and chunk, holding the labels of its series and their timestamps and values as columns),
+so the next reports only fetch the chunks not cached yet.
+
+Usage: python3 compressorSummary.py [-u http://prom-long:9091] [-m 2026-09] [--chunk week]
+"""
+
+import os
+import re
 import time
+import json
+import hashlib
+import argparse
 import datetime
 import calendar
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
 import requests
 
-def query_prometheus(prometheus_url, query, params):
+PROMETHEUS_URL = 'http://192.168.X.X:9091' # prom-long, replace with the actual URL of the Prometheus server
+QUERY = 'output_pressure{}'
+STEP = 300 # seconds between two points of a series
+CHUNKS = {'day': 24 * 60 * 60, 'week': 7 * 24 * 60 * 60} # seconds queried at once
+MAX_POINTS = 11000 # points per series accepted by Prometheus in one query_range
+WORKERS = 4 # chunks fetched at the same time
+SETTLE = 24 * 60 * 60 # seconds after its end before a chunk is cached, so points arriving late (federation, remote-write) are in it
+CACHE_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'prom-cache')
+
+# Argparse block
+def parse_arguments():
+    parser = argparse.ArgumentParser(description="Print a month of compressor output pressure from Prometheus.")
+    parser.add_argument('-u', '--url', default=PROMETHEUS_URL, help='URL of the Prometheus server')
+    parser.add_argument('-q', '--query', default=QUERY, help='PromQL query of the report')
+    parser.add_argument('-m', '--month', help='Month of the report, as YYYY-MM (default: last month)')
+    parser.add_argument('-s', '--step', type=int, default=STEP, help='Seconds between two points')
+    parser.add_argument('--chunk', choices=CHUNKS, default='day', help='Time range of one query')
+    parser.add_argument('-w', '--workers', type=int, default=WORKERS, help='Chunks fetched concurrently')
+    parser.add_argument('--cache-dir', default=CACHE_DIR, help='Directory of the cached chunks')
+    parser.add_argument('--settle', type=int, default=SETTLE, help='Seconds after its end before a chunk is cached')
+    parser.add_argument('--no-cache', action='store_true', help='Fetch every chunk, neither reading nor writing the cache')
+    return parser.parse_args()
+
+def query_prometheus(session, prometheus_url, params):
     headers = {'Content-Type': 'application/x-www-form-urlencoded'}
-    response = requests.get(prometheus_url, headers=headers, params=params)
+    try:
+        response = session.get(prometheus_url, headers=headers, params=params, timeout=60)
+    except requests.exceptions.RequestException as e:
+        print(f"Error: Unable to reach Prometheus: {e}")
+        return None
 
     if response.status_code == 200:
         data = response.json()
@@ -22,42 +71,116 @@ def last_month():
     last_month = first - datetime.timedelta(days=1)
     return (last_month.year,last_month.month)
 
-if __name__ == "__main__":
-    # Replace this URL with the actual URL of your Prometheus server.
-    prometheus_url = 'http://192.168.X.X:9091/api/v1/query_range'
-    # Calculate the timestamp for the current time
-    current_time = int(time.time())
+def month_range(year, month):
+    # Start and end timestamps (UTC) of a month
+    start = calendar.timegm((year, month, 1, 0, 0, 0))
+    days = calendar.monthrange(year, month)[1]
+    return start, start + days * 24 * 60 * 60
+
+def chunks(start, end, size):
+    # Chunks of the range, aligned on multiples of their size so that they are the same from one report to the next
+    chunk = start - start % size
+    while chunk < end:
+        yield chunk
+        chunk += size
 
-    lastMonth = last_month()
-    lastMonthDays = calendar.monthrange(lastMonth[0], lastMonth[1])[1]
+def cache_path(cache_dir, query, step, chunk, size):
+    # One file per query (name and hash, as label matchers do not make file names), step and chunk
+    name = re.sub(r'[^a-zA-Z0-9_]+', '_', query).strip('_')[:40]
+    digest = hashlib.sha1(query.encode('utf-8')).hexdigest()[:12]
+    return os.path.join(cache_dir, f"{name}-{digest}", f"{step}-{size}-{chunk}.npz")
 
-    # Calculate the timestamp for 24 hours ago
-    start_time = current_time - (lastMonthDays * 24 * 60 * 60)
+def save_chunk(path, series):
+    # Series as columns: labels of every series, and their concatenated timestamps and values
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    temporary = path + '.tmp.npz'
+    np.savez_compressed(temporary,
+                        labels=np.array([json.dumps(labels, sort_keys=True) for labels, _, _ in series]),
+                        lengths=np.array([len(timestamps) for _, timestamps, _ in series], dtype=np.int64),
+                        timestamps=np.concatenate([timestamps for _, timestamps, _ in series] or [np.empty(0, np.int64)]),
+                        values=np.concatenate([values for _, _, values in series] or [np.empty(0)]))
+    os.replace(temporary, path)
 
-    # Construct the PromQL query to retrieve data for the metric "output_pressure"
-    # within the last 24 hours across all jobs and instances.
-    prometheus_query = f'output_pressure{{}}'
+def load_chunk(path):
+    with np.load(path) as data:
+        offsets = np.cumsum(np.concatenate([[0], data['lengths']]))
+        timestamps, values = data['timestamps'], data['values']
+        return [(json.loads(labels), timestamps[begin:end], values[begin:end])
+                for labels, begin, end in zip(data['labels'], offsets, offsets[1:])]
 
-    # Create the parameters for the query range
+def fetch_chunk(session, args, chunk, size):
+    """
+    Return the series of one whole chunk as [(labels, timestamps, values)], or None on error.
+    """
+    path = cache_path(args.cache_dir, args.query, args.step, chunk, size)
+    if not args.no_cache and os.path.exists(path):
+        return load_chunk(path)
+
+    # Points from the start of the chunk to the last step before the next one (or now)
+    now = int(time.time())
     params = {
-        'query': prometheus_query,
-        'start': start_time,
-        'end': current_time,
-        'step': 300,  # Specify the step interval in seconds (e.g., 15 seconds)
+        'query': args.query,
+        'start': chunk,
+        'end': min(chunk + size - args.step, now),
+        'step': args.step,
     }
+    data = query_prometheus(session, args.url.rstrip('/') + '/api/v1/query_range', params)
+    if not data or data.get('status') != 'success':
+        return None
+    series = [(result['metric'],
+               np.array([timestamp for timestamp, _ in result['values']], dtype=np.int64),
+               np.array([float(value) for _, value in result['values']]))
+              for result in data['data']['result']]
 
-    # Call the function to query Prometheus
-    data = query_prometheus(prometheus_url, prometheus_query, params)
+    # Only chunks that ended --settle seconds ago are cached: the current one still gets new points,
+    # and the last ones may still get points delivered late to prom-long
+    if not args.no_cache and chunk + size <= now - args.settle:
+        save_chunk(path, series)
+    return series
+
+def query_range(args, start, end):
+    """
+    Return {labels: (timestamps, values)} of the query over [start, end), or None if a chunk failed.
+    """
+    size = CHUNKS[args.chunk]
+    if size // args.step > MAX_POINTS:
+        raise SystemExit(f"A {args.chunk} of {args.step} s steps exceeds the {MAX_POINTS} points of a query: use a smaller chunk")
+
+    session = requests.Session()
+    adapter = requests.adapters.HTTPAdapter(pool_connections=1, pool_maxsize=args.workers)
+    session.mount('http://', adapter)
+    session.mount('https://', adapter)
+    with session, ThreadPoolExecutor(max_workers=args.workers) as executor:
+        results = list(executor.map(lambda chunk: fetch_chunk(session, args, chunk, size), chunks(start, end, size)))
+    if any(result is None for result in results):
+        return None
+
+    # Join the chunks of every series in time order, without the points of the first and last
+    # chunks outside the range
+    joined = {}
+    for series in results:
+        for labels, timestamps, values in series:
+            inside = (timestamps >= start) & (timestamps < end)
+            joined.setdefault(json.dumps(labels, sort_keys=True), []).append((timestamps[inside], values[inside]))
+    return {labels: (np.concatenate([timestamps for timestamps, _ in parts]), np.concatenate([values for _, values in parts]))
+            for labels, parts in joined.items()}
+
+if __name__ == "__main__":
+    args = parse_arguments()
+
+    if args.month:
+        year, month = (int(part) for part in args.month.split('-'))
+    else:
+        year, month = last_month()
+    start_time, end_time = month_range(year, month)
+    end_time = min(end_time, int(time.time()))
+
+    # Retrieve output_pressure across all jobs and instances over the month, chunk by chunk
+    data = query_range(args, start_time, end_time)
 
     # Process the data if it's available
     if data:
-        # The 'data' dictionary will contain the Prometheus query result.
-        # You can access the actual values using data['data']['result'].
-
-        # Example: Print the retrieved data
-        for result in data['data']['result']:
-            print(result['metric'], result['values'])
+        for labels, (timestamps, values) in data.items():
+            print(json.loads(labels), [[int(timestamp), value] for timestamp, value in zip(timestamps, values)])
     else:
         print("No data returned from Prometheus.")
-
-    
@@ -0,0 +1,218 @@
+"""
+Bounded CSV logs shared by the Other-clients collectors
+
+The collectors used to re-read their whole log before every write, and to empty it once it
+reached its line limit, so the grok-exporter reading it saw the file (and the history
+behind it) vanish. RingLog appends in O(1) instead: records are counted once when the log
+is first written to, and when the current segment is full it is renamed to <log>.1
+(replacing the previous one) and a fresh segment, header included, is renamed into place.
+The last `capacity` records are therefore always on disk, in <log> and <log>.1.
+
+Every batch of rows is written with a single append, and a new segment is complete before
+it appears under the log name, so a tailer never reads a partial line or a missing header.
+
+For readings that rarely change (e.g. the HLMU levels), write_changed only appends rows that
+differ from the last ones written, or once a heartbeat interval has passed since the last
+write, so the log grows with the changes rather than with time. compact() rewrites a log
+written before that (unbounded, full of repeated rows or batches of rows) in a single
+streaming pass.
+"""
+
+import io
+import os
+import csv
+import time
+import threading
+from collections import deque
+
+READ_SIZE = 1024 * 1024 # bytes read at once when counting the records of an existing log
+TAIL_SIZE = 64 * 1024 # bytes read at most from the end of a log to find its last records
+
+_logs = {}
+_logs_lock = threading.Lock()
+
+
+class RingLog:
+    """
+    Append-only CSV log keeping at least the last `capacity` records.
+
+    Args:
+        path (str): The log file.
+        capacity (int): Records per segment (header excluded).
+        header (list): Header row written at the top of every segment, or None.
+    """
+
+    def __init__(self, path, capacity, header=None):
+        self.path = path
+        self.capacity = capacity
+        self.header = header
+        self.count = None
+        self.last = None
+        self.lock = threading.Lock()
+
+    def write(self, row):
+        self.write_rows([row])
+
+    def write_rows(self, rows):
+        """
+        Append rows (lists of fields) to the log, starting a new segment first if they do not fit.
+        """
+        self._append(format_rows(rows), len(rows))
+
+    def write_lines(self, lines):
+        """
+        Append already formatted lines (without line endings), e.g. records in a fixed layout.
+        """
+        self._append(''.join(line + '\n' for line in lines).encode('utf-8'), len(lines))
+
+    def write_changed(self, rows, heartbeat):
+        """
+        Append rows only if they differ from the last rows written, or if more than heartbeat
+        seconds passed since the log was last written. Return True if they were written.
+        """
+        data = format_rows(rows)
+        with self.lock:
+            if self.last is None:
+                self.last = self._tail(len(rows))
+            if data == self.last and self.age() < heartbeat:
+                return False
+            self._append_locked(data, len(rows))
+        return True
+
+    def age(self):
+        """
+        Return the seconds since the log was last written (infinite if there is no log).
+        """
+        try:
+            return time.time() - os.path.getmtime(self.path)
+        except OSError:
+            return float('inf')
+
+    def compact(self, force=False, batch=1):
+        """
+        Rewrite the log (previous segment included) keeping its last `capacity` records, with
+        runs of identical consecutive batches of `batch` records collapsed to one. A log written
+        batch by batch (e.g. several table rows per run) must be compacted with the size of its
+        batches, as write_changed compares them: its records alternate and never repeat one by one.
+        Unless forced, only a log holding more than `capacity` records (written without a bound)
+        is compacted. Return the number of records removed.
+        """
+        with self.lock:
+            if self.count is None:
+                self.count = self._count()
+            if not force and self.count <= self.capacity:
+                return 0
+            header = format_rows([self.header]) if self.header else None
+            records = deque(maxlen=self.capacity)
+            current = []
+            previous = None
+            total = 0
+            # The previous segment holds the older records
+            for path in (self.path + '.1', self.path):
+                try:
+                    with open(path, 'rb') as file:
+                        for line in file:
+                            # Logs written by csv.writer directly end their lines with \r\n
+                            line = line.rstrip(b'\r\n') + b'\n'
+                            if line == header or line == b'\n':
+                                continue
+                            total += 1
+                            current.append(line)
+                            if len(current) == batch:
+                                if current != previous:
+                                    records.extend(current)
+                                previous, current = current, []
+                except FileNotFoundError:
+                    continue
+            # An incomplete last batch is kept as it is
+            records.extend(current)
+            temporary = self.path + '.tmp'
+            with open(temporary, 'wb') as file:
+                if header:
+                    file.write(header)
+                file.writelines(records)
+            os.replace(temporary, self.path)
+            if os.path.exists(self.path + '.1'):
+                os.remove(self.path + '.1')
+            self.count = len(records)
+            self.last = None
+            return total - len(records)
+
+    def _append(self, data, records):
+        if not records:
+            return
+        with self.lock:
+            self._append_locked(data, records)
+
+    def _append_locked(self, data, records):
+        if self.count is None:
+            self.count = self._count()
+        if self.count and self.count + records > self.capacity:
+            self._rotate()
+        elif self.header and self._empty():
+            self._rotate()
+        fd = os.open(self.path, os.O_WRONLY | os.O_APPEND | os.O_CREAT, 0o644)
+        try:
+            os.write(fd, data)
+        finally:
+            os.close(fd)
+        self.count += records
+        self.last = data
+
+    def _tail(self, records):
+        # The last `records` lines of the log, as written
+        try:
+            with open(self.path, 'rb') as file:
+                file.seek(0, os.SEEK_END)
+                file.seek(max(0, file.tell() - TAIL_SIZE))
+                lines = file.read().splitlines(keepends=True)
+        except OSError:
+            return b''
+        return b''.join(lines[-records:])
+
+    def _count(self):
+        # Records of the current segment: its lines, less the header
+        lines = 0
+        try:
+            with open(self.path, 'rb') as file:
+                chunk = file.read(READ_SIZE)
+                while chunk:
+                    lines += chunk.count(b'\n')
+                    chunk = file.read(READ_SIZE)
+        except FileNotFoundError:
+            return 0
+        return max(0, lines - (1 if self.header else 0))
+
+    def _empty(self):
+        try:
+            return os.path.getsize(self.path) == 0
+        except OSError:
+            return True
+
+    def _rotate(self):
+        # The new segment is complete (header included) before it takes the name of the log
+        temporary = self.path + '.tmp'
+        with open(temporary, 'wb') as file:
+            if self.header:
+                file.write(format_rows([self.header]))
+        if os.path.exists(self.path):
+            os.replace(self.path, self.path + '.1')
+        os.replace(temporary, self.path)
+        self.count = 0
+
+
+def format_rows(rows):
+    buffer = io.StringIO()
+    csv.writer(buffer, lineterminator='\n').writerows(rows)
+    return buffer.getvalue().encode('utf-8')
+
+
+def open_log(path, capacity, header=None):
+    """
+    Return the RingLog of a path, shared by every writer of the process.
+    """
+    with _logs_lock:
+        if path not in _logs:
+            os.makedirs(os.path.dirname(path) or '.', exist_ok=True)
+            _logs[path] = RingLog(path, capacity, header)
+        return _logs[path]
@@ -0,0 +1,251 @@
+"""
+Concurrent discovery of the SCANS exporters running on a set of machines
+
+Every machine/port pair is probed at the same time: the port is connected to and its
+/metrics page fetched, all within a single deadline, so a whole lab is scanned in about one
+timeout period however many exporters are down. The probes in flight are only bounded by the
+open file limit of the process (each holds a socket); a scan needing more probes than that
+(e.g. a /24 subnet with many live hosts) takes one more timeout period per extra batch. The page tells which
+exporter actually answers, so a port reused by something else is not mistaken for SCANS.
+
+Only the standard library is used, so setup_scans.py can run it on a bare host.
+"""
+
+import os
+import json
+import asyncio
+try:
+    import resource
+except ImportError: # Windows
+    resource = None
+from collections import namedtuple
+
+PROBE_TIMEOUT = 3 # seconds allowed to connect and read /metrics
+MAX_CONCURRENCY = 4096 # probes in flight at most, further bounded by the open file limit
+RESERVED_FILES = 64 # file descriptors left to the rest of the process
+MAX_PAGE = 4 * 1024 * 1024 # bytes of /metrics read at most
+
+# Service name -> (port, kind of exporter expected behind it)
+SERVICES = {
+    'workstation': (9100, 'node'),
+    'hardware': (9137, 'dellhw'),
+    'helium': (9144, 'grok'),
+    'nitrogen': (9145, 'grok'),
+    'field': (9146, 'grok'),
+    'shim': (9147, 'grok'),
+    'events': (9148, 'grok'),
+    'tanks': (9149, 'grok'),
+    'spi': (9150, 'grok'),
+    'compressor': (9151, 'grok'),
+    'hlmu_helium': (9152, 'grok'),
+    'hlmu_nitrogen': (9153, 'grok'),
+    'ups': (9154, 'grok'),
+    'envsensor': (9155, 'grok'),
+    'spectrometer': (9156, 'scans'),
+}
+
+# Services made redundant by another one on the same machine: the SCANS exporter also
+# serves the metrics of the legacy per-metric ports, which would otherwise be scraped twice
+SUPERSEDED = {'spectrometer': ['helium', 'nitrogen', 'field', 'shim', 'events']}
+
+# Kinds of exporter that may answer in place of the expected one: the Other-clients
+# collectors serve the metrics of their grok-exporter themselves, on the same port
+ALTERNATIVES = {'grok': ['collector']}
+
+# A metric name found on the page of each kind of exporter
+SIGNATURES = [
+    ('scans', 'scans_exporter_info'),
+    ('collector', 'scans_collector_info'),
+    ('grok', 'grok_exporter_'),
+    ('dellhw', 'dell_hw_'),
+    ('node', 'node_exporter_build_info'),
+]
+
+# Outcome of one probe: kind is None if the port is closed, 'unknown' if the page is not recognised
+Probe = namedtuple('Probe', ['machine', 'service', 'port', 'kind'])
+
+
+def identify(page):
+    """
+    Return the kind of exporter that produced a /metrics page, or 'unknown'.
+    """
+    for kind, signature in SIGNATURES:
+        if signature in page:
+            return kind
+    return 'unknown'
+
+
+async def fetch_metrics(ip, port):
+    """
+    Connect to ip:port and return its /metrics page, or None if nothing listens there.
+    An open port that does not answer HTTP returns an empty page. No consumer parameter is
+    sent, so a SCANS exporter in --timestamps mode keeps its new readings for prom-long.
+    """
+    try:
+        reader, writer = await asyncio.open_connection(ip, port)
+    except OSError:
+        return None
+    try:
+        writer.write(f"GET /metrics HTTP/1.0\r\nHost: {ip}:{port}\r\n\r\n".encode())
+        await writer.drain()
+        data = await reader.read(MAX_PAGE)
+        chunks = [data]
+        while data and sum(map(len, chunks)) < MAX_PAGE:
+            data = await reader.read(MAX_PAGE)
+            chunks.append(data)
+        return b''.join(chunks).decode('utf-8', 'replace')
+    except OSError:
+        return ''
+    finally:
+        writer.close()
+
+
+async def probe(semaphore, machine, ip, service, port, timeout):
+    async with semaphore:
+        try:
+            page = await asyncio.wait_for(fetch_metrics(ip, port), timeout)
+        except asyncio.TimeoutError:
+            page = None
+    return Probe(machine, service, port, None if page is None else identify(page))
+
+
+async def discover_async(machines, services, timeout, concurrency):
+    semaphore = asyncio.Semaphore(concurrency)
+    probes = [probe(semaphore, machine, ip, service, port, timeout)
+              for machine, ip in machines.items()
+              for service, (port, _) in services.items()]
+    return await asyncio.gather(*probes)
+
+
+def max_concurrency():
+    """
+    Return the number of probes that may be in flight at once without running out of file descriptors.
+    """
+    if resource is None:
+        return MAX_CONCURRENCY
+    soft, _ = resource.getrlimit(resource.RLIMIT_NOFILE)
+    if soft == resource.RLIM_INFINITY:
+        return MAX_CONCURRENCY
+    return max(1, min(MAX_CONCURRENCY, soft - RESERVED_FILES))
+
+
+def discover(machines, services=None, timeout=PROBE_TIMEOUT, concurrency=None):
+    """
+    Probe every service port of every machine concurrently.
+
+    Args:
+        machines (dict): Machine name -> IP address (or host name).
+        services (dict): Service name -> (port, expected kind); defaults to SERVICES.
+        timeout (float): Seconds allowed for each probe; the whole scan takes about as long
+            when every probe is in flight at once, and one more timeout per extra batch otherwise.
+        concurrency (int): Maximum number of probes in flight; defaults to every probe
+            (machines x services), within the open file limit.
+
+    Returns:
+        list: Probe tuples for every machine/service pair, in input order.
+    """
+    services = services or SERVICES
+    if concurrency is None:
+        concurrency = max(1, min(len(machines) * len(services), max_concurrency()))
+    return asyncio.run(discover_async(machines, services, timeout, concurrency))
+
+
+def is_expected(kind, expected):
+    """
+    Tell whether a probe found the expected kind of exporter (or one that may replace it).
+    """
+    return kind is not None and (kind == expected or kind in ALTERNATIVES.get(expected, ()))
+
+
+def found_services(probes, services=None):
+    """
+    Keep the probes where the expected exporter answered.
+
+    Returns:
+        dict: Machine name -> {service name: port}, without superseded services.
+    """
+    services = services or SERVICES
+    found = {}
+    for result in probes:
+        if is_expected(result.kind, services[result.service][1]):
+            found.setdefault(result.machine, {})[result.service] = result.port
+    return prune_superseded(found)
+
+
+def prune_superseded(found):
+    for services_found in found.values():
+        for service, superseded in SUPERSEDED.items():
+            if service in services_found:
+                for name in superseded:
+                    services_found.pop(name, None)
+    return found
+
+
+def target_groups(found, hosts, services=None):
+    """
+    Build the Prometheus file_sd target groups of every service.
+
+    Targets are scraped by IP address, so new machines need no extra_hosts entry in the
+    Prometheus containers, while the instance label keeps the usual 'alias:port' form.
+
+    Args:
+        found (dict): Machine name -> {service name: port}, as from found_services.
+        hosts (dict): Machine name -> IP address.
+
+    Returns:
+        dict: Service name -> list of target groups (empty for services found nowhere).
+    """
+    groups = {service: [] for service in services or SERVICES}
+    for machine in sorted(found):
+        for service, port in sorted(found[machine].items()):
+            groups[service].append({'targets': [f"{hosts[machine]}:{port}"],
+                                    'labels': {'instance': f"{machine}:{port}"}})
+    return groups
+
+
+def write_target_files(directory, groups):
+    """
+    Write one <service>.json file_sd file per service. Files are replaced atomically, so
+    Prometheus never reads a half-written one, and only if their content changed.
+
+    Returns:
+        list: Services whose file was (re)written.
+    """
+    os.makedirs(directory, exist_ok=True)
+    changed = []
+    for service, service_groups in groups.items():
+        path = os.path.join(directory, f"{service}.json")
+        text = json.dumps(service_groups, indent=2) + '\n'
+        try:
+            with open(path, 'r') as file:
+                if file.read() == text:
+                    continue
+        except OSError:
+            pass
+        temporary = path + '.tmp'
+        with open(temporary, 'w') as file:
+            file.write(text)
+        os.replace(temporary, path)
+        changed.append(service)
+    return changed
+
+
+def read_target_files(directory):
+    """
+    Read back the targets of existing file_sd files.
+
+    Returns:
+        dict: Machine name -> {service name: port}.
+    """
+    found = {}
+    for service in SERVICES:
+        try:
+            with open(os.path.join(directory, f"{service}.json"), 'r') as file:
+                groups = json.load(file)
+        except (OSError, ValueError):
+            continue
+        for group in groups:
+            machine, _, port = group.get('labels', {}).get('instance', '').rpartition(':')
+            if machine and port.isdigit():
+                found.setdefault(machine, {})[service] = int(port)
+    return found
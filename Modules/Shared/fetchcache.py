@@ -0,0 +1,171 @@
+"""
+Conditional fetching of the device pages polled by the Other-clients collectors
+
+The UPS, HLMU and environment sensor pages are polled every few minutes but rarely change
+(the HLMU helium level moves about once a day). FetchCache remembers, for every URL, the
+ETag and Last-Modified validators and a hash of the last body processed:
+  - a device honouring If-None-Match / If-Modified-Since answers 304 and sends no body,
+  - otherwise the body is downloaded and hashed, and an identical body is reported unchanged,
+so the collector can skip parsing and logging it altogether.
+
+The cache is kept in a small JSON file, so it also works for collectors run once from cron
+whose CSV log keeps the values between runs. A collector that only updates in-process metrics
+uses an in-memory cache instead (no file), so its first run after a restart fills the metrics.
+A page only counts as processed once the collector calls done(): a body whose processing
+failed is processed again on the next run.
+
+Requests go through one requests.Session per cache, so a long-lived collector keeps its
+connections to the (slow to accept) embedded web servers alive between polls.
+
+Every request is counted by result (changed, unchanged, not_modified, error) in the JSON
+file and, through expose(), as the scans_fetch_requests_total counter of a metrics registry.
+"""
+
+import os
+import json
+import hashlib
+import logging
+import threading
+from collections import namedtuple
+
+import requests
+
+_caches = {}
+_caches_lock = threading.Lock()
+
+# A fetched page: content is None for a 304 whose body is not in memory (see fetch_all)
+Page = namedtuple('Page', ['url', 'content', 'changed', 'etag', 'last_modified', 'digest'])
+
+
+class FetchCache:
+    """
+    Validators and body hashes of the pages fetched by a collector.
+
+    Args:
+        path (str): JSON file keeping them between runs (None for in-memory only).
+    """
+
+    def __init__(self, path=None):
+        self.path = path
+        self.lock = threading.Lock()
+        self.entries = {}
+        self.counts = {}
+        self.bodies = {}
+        self.counter = None
+        self.session = requests.Session()
+        if path and os.path.exists(path):
+            try:
+                with open(path, 'r') as file:
+                    saved = json.load(file)
+                self.entries, self.counts = saved.get('entries', {}), saved.get('counts', {})
+            except (OSError, ValueError) as e:
+                logging.error(f"Cannot read the fetch cache {path}: {e}")
+
+    def expose(self, registry):
+        """
+        Count the requests in a metrics registry, starting from the counts kept on file.
+        """
+        with self.lock:
+            if self.counter is not None:
+                return
+            self.counter = registry.counter('scans_fetch_requests_total',
+                                            'Device page requests by result: changed, unchanged (same body), '
+                                            'not_modified (HTTP 304) or error')
+            for url, results in self.counts.items():
+                for result, count in results.items():
+                    self.counter.set(count, url=url, result=result)
+
+    def fetch(self, url, conditional=True, **kwargs):
+        """
+        GET a URL (kwargs are passed to Session.get) and return a Page, or None on error.
+        """
+        entry = self.entries.get(url, {})
+        headers = dict(kwargs.pop('headers', None) or {})
+        if conditional and entry.get('etag'):
+            headers['If-None-Match'] = entry['etag']
+        if conditional and entry.get('last_modified'):
+            headers['If-Modified-Since'] = entry['last_modified']
+
+        try:
+            response = self.session.get(url, headers=headers, **kwargs)
+        except requests.exceptions.RequestException as e:
+            print(f"Failed to fetch {url}: {e}")
+            self._count(url, 'error')
+            return None
+
+        if response.status_code == 304 and conditional:
+            self._count(url, 'not_modified')
+            return Page(url, self.bodies.get(url), False, entry.get('etag'), entry.get('last_modified'), entry.get('digest'))
+        if response.status_code != 200:
+            print(f"Failed to fetch {url}. Status code: {response.status_code}")
+            self._count(url, 'error')
+            return None
+
+        digest = hashlib.sha1(response.content).hexdigest()
+        changed = digest != entry.get('digest')
+        self._count(url, 'changed' if changed else 'unchanged')
+        self.bodies[url] = response.content
+        return Page(url, response.content, changed, response.headers.get('ETag'), response.headers.get('Last-Modified'), digest)
+
+    def fetch_all(self, urls, force=False, **kwargs):
+        """
+        Fetch the pages of one device: return ({url: Page or None}, whether any of them changed).
+
+        When one page changed, the bodies of the others are needed too: those answered with
+        a 304 and not held in memory (first run of the process) are fetched again in full.
+        With force, the pages are reported changed (and their bodies fetched) even if they
+        are not, e.g. to log a heartbeat of unchanged values.
+        """
+        pages = {url: self.fetch(url, **kwargs) for url in urls}
+        changed = force or any(page is None or page.changed for page in pages.values())
+        if changed:
+            for url, page in pages.items():
+                if page is not None and page.content is None:
+                    pages[url] = self.fetch(url, conditional=False, **kwargs)
+        return pages, changed
+
+    def done(self, *pages):
+        """
+        Record pages as processed, and save the cache.
+        """
+        with self.lock:
+            for page in pages:
+                if page is not None and page.digest:
+                    self.entries[page.url] = {'etag': page.etag, 'last_modified': page.last_modified, 'digest': page.digest}
+        self.save()
+
+    def save(self):
+        if not self.path:
+            return
+        with self.lock:
+            data = json.dumps({'entries': self.entries, 'counts': self.counts})
+        try:
+            with open(self.path + '.tmp', 'w') as file:
+                file.write(data)
+            os.replace(self.path + '.tmp', self.path)
+        except OSError as e:
+            logging.error(f"Cannot save the fetch cache {self.path}: {e}")
+
+    def _count(self, url, result):
+        with self.lock:
+            results = self.counts.setdefault(url, {})
+            results[result] = results.get(result, 0) + 1
+        if self.counter is not None:
+            self.counter.inc(url=url, result=result)
+
+
+def open_cache(path, registry=None):
+    """
+    Return the FetchCache of a file, shared by every collector of the process, counting its
+    requests in registry if given. Without a file, the in-memory cache of the registry is returned.
+    """
+    key = path or ('memory', registry)
+    with _caches_lock:
+        if key not in _caches:
+            if path:
+                os.makedirs(os.path.dirname(path) or '.', exist_ok=True)
+            _caches[key] = FetchCache(path)
+        cache = _caches[key]
+    if registry is not None:
+        cache.expose(registry)
+    return cache
@@ -0,0 +1,209 @@
+"""
+One-pass extraction of metrics from log lines
+
+grok-exporter evaluates the match expression of every metric of its configuration on every
+line, even when all the metrics share the same expression: compr.yml runs its 18-field regex
+18 times per compressor record, tank.yml its 5-field regex 4 times. Here the metrics are
+grouped by the line layout they read, and each layout is parsed once per line into its
+fields, from which all its metrics are updated.
+
+A layout is either a column schema (fields separated by a fixed string, split with
+str.split, no regex at all) or, for grok expressions that are not a plain list of columns,
+one compiled Python regex. Grok configurations are compiled into this form by compile_grok,
+and column schemas (e.g. the header of a CSV log) by compile_columns; both can be saved as a
+small YAML "native" configuration and loaded back with load_native.
+
+Unlike grok, a column schema is anchored to the whole line: a line with the wrong number of
+fields, or a text where a number is expected, is skipped.
+"""
+
+import re
+from collections import namedtuple
+
+# Python equivalents of the grok patterns used by the SCANS configurations
+GROK_PATTERNS = {
+    'NUMBER': r'[+-]?(?:\d+(?:\.\d+)?|\.\d+)',
+    'INT': r'[+-]?\d+',
+    'WORD': r'\w+',
+    'NOTSPACE': r'\S+',
+    'DATA': r'.*?',
+    'GREEDYDATA': r'.*',
+    'TIMESTAMP_ISO8601': r'\d{4}-\d{2}-\d{2}[T ]\d{2}:?\d{2}(?::?\d{2}(?:\.\d+)?)?(?:Z|[+-]\d{2}:?\d{2})?',
+}
+NUMERIC_PATTERNS = {'NUMBER', 'INT'}
+
+GROK_FIELD = re.compile(r'%\{(\w+)(?::(\w+))?\}')
+TEMPLATE_FIELD = re.compile(r'^\{\{\s*\.(\w+)\s*\}\}$')
+
+# One metric of a layout: value is the field holding its value (None for a counter of matching
+# lines), labels maps each label name to the field holding its value
+MetricSpec = namedtuple('MetricSpec', ['name', 'type', 'help', 'value', 'labels'])
+
+
+class Extractor:
+    """
+    The metrics read from one line layout, with the parser of that layout.
+
+    Args:
+        metrics (list): MetricSpec of every metric of the layout.
+        columns (list): Field names of a column schema, in line order.
+        separator (str): Separator of the columns.
+        numeric (list): Columns that must hold a number for the line to match.
+        match (str): Python regex with named groups, for layouts that are not a column schema.
+    """
+
+    def __init__(self, metrics, columns=None, separator=',', numeric=(), match=None):
+        self.metrics = list(metrics)
+        self.columns = list(columns) if columns else None
+        self.separator = separator
+        self.numeric = [name for name in self.columns or () if name in numeric]
+        self.match = match
+        self.regex = re.compile(match) if match is not None else None
+        self.numbers = set(self.numeric) | {spec.value for spec in self.metrics if spec.value}
+        self.specs = [(spec, tuple(spec.labels.items())) for spec in self.metrics]
+
+    def fields(self, line):
+        """
+        Parse a line once: return {field: text}, or None if the line does not match the layout.
+        """
+        if self.regex is not None:
+            found = self.regex.search(line)
+            return found.groupdict() if found else None
+        values = line.split(self.separator)
+        if len(values) != len(self.columns):
+            return None
+        return dict(zip(self.columns, values))
+
+    def samples(self, line):
+        """
+        Return (MetricSpec, labels, value) for every metric of a line; value is None for counters of lines.
+        """
+        fields = self.fields(line)
+        if fields is None:
+            return []
+        try:
+            # Every number is converted once, however many metrics read it
+            numbers = {name: float(fields[name]) for name in self.numbers}
+        except (TypeError, ValueError):
+            return []
+        return [(spec, {label: fields[field] for label, field in labels}, numbers.get(spec.value))
+                for spec, labels in self.specs]
+
+    def to_native(self):
+        native = {}
+        if self.regex is not None:
+            native['match'] = self.match
+        else:
+            native['separator'] = self.separator
+            native['columns'] = self.columns
+            native['numeric'] = self.numeric
+        native['metrics'] = [{'name': spec.name, 'type': spec.type, 'help': spec.help,
+                              'value': spec.value, 'labels': dict(spec.labels)}
+                             for spec in self.metrics]
+        return native
+
+
+def template_field(template):
+    """
+    Return the field of a grok value or label template such as '{{.tank_level}}'.
+    """
+    found = TEMPLATE_FIELD.match(str(template).strip())
+    if not found:
+        raise ValueError(f"Unsupported grok template (only '{{{{.field}}}}' is): {template}")
+    return found.group(1)
+
+
+def grok_to_regex(match):
+    """
+    Translate a grok match expression into a Python regex with named groups.
+    """
+    def replace(found):
+        pattern, name = found.group(1), found.group(2)
+        if pattern not in GROK_PATTERNS:
+            raise ValueError(f"Unsupported grok pattern: {pattern}")
+        return f"(?P<{name}>{GROK_PATTERNS[pattern]})" if name else f"(?:{GROK_PATTERNS[pattern]})"
+    return GROK_FIELD.sub(replace, match)
+
+
+def grok_columns(match):
+    """
+    Return (columns, separator, numeric columns) if a grok expression is a plain list of
+    named fields separated by the same literal string, else None.
+    """
+    fields = list(GROK_FIELD.finditer(match))
+    if not fields or fields[0].start() != 0 or fields[-1].end() != len(match):
+        return None
+    separators = {match[previous.end():field.start()] for previous, field in zip(fields, fields[1:])}
+    if len(separators) > 1 or any(not field.group(2) for field in fields):
+        return None
+    separator = separators.pop() if separators else ','
+    if not separator or any(character in '()[]{}?*+|^$\\.' for character in separator):
+        # Empty, or a regex rather than a literal string
+        return None
+    columns = [field.group(2) for field in fields]
+    return columns, separator, [field.group(2) for field in fields if field.group(1) in NUMERIC_PATTERNS]
+
+
+def compile_grok(config):
+    """
+    Compile a grok-exporter configuration (the parsed YAML) into one Extractor per distinct match.
+    """
+    layouts = {}
+    for metric in config.get('metrics') or []:
+        spec = MetricSpec(metric['name'], metric.get('type', 'gauge'), metric.get('help', metric['name']),
+                          template_field(metric['value']) if metric.get('value') else None,
+                          {label: template_field(template) for label, template in (metric.get('labels') or {}).items()})
+        layouts.setdefault(metric['match'], []).append(spec)
+
+    extractors = []
+    for match, specs in layouts.items():
+        columns = grok_columns(match)
+        if columns:
+            extractors.append(Extractor(specs, columns[0], columns[1], columns[2]))
+        else:
+            extractors.append(Extractor(specs, match=grok_to_regex(match)))
+    return extractors
+
+
+def compile_columns(columns, separator=',', labels=(), prefix='', help_text='{name}'):
+    """
+    Compile a column schema into an Extractor: every column is a gauge, labelled with the
+    label columns.
+
+    Args:
+        columns (list): Column names, in line order (e.g. the header of a CSV log).
+        separator (str): Separator of the columns.
+        labels (list): Columns used as labels rather than values.
+        prefix (str): Prefix of the metric names.
+        help_text (str): HELP text, formatted with the column name.
+    """
+    names = [metric_name(column) for column in columns]
+    label_names = [metric_name(label) for label in labels]
+    specs = [MetricSpec(prefix + name, 'gauge', help_text.format(name=column), name,
+                        {label: label for label in label_names})
+             for column, name in zip(columns, names) if name not in label_names]
+    return Extractor(specs, names, separator, [spec.value for spec in specs])
+
+
+def metric_name(text):
+    """
+    Turn a column title ('1st stage temp', '#Battery%') into a metric or label name.
+    """
+    name = re.sub(r'[^a-zA-Z0-9_]+', '_', text).strip('_').lower()
+    return name if name and not name[0].isdigit() else '_' + name
+
+
+def load_native(config):
+    """
+    Return the extractors of a native configuration (the parsed YAML written from to_native).
+    """
+    extractors = []
+    for layout in config.get('extractors') or []:
+        specs = [MetricSpec(metric['name'], metric.get('type', 'gauge'), metric.get('help', metric['name']),
+                            metric.get('value'), metric.get('labels') or {})
+                 for metric in layout['metrics']]
+        if 'match' in layout:
+            extractors.append(Extractor(specs, match=layout['match']))
+        else:
+            extractors.append(Extractor(specs, layout['columns'], layout.get('separator', ','), layout.get('numeric', ())))
+    return extractors
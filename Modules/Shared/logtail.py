@@ -0,0 +1,290 @@
+"""
+Rotation-safe log tailing shared by the SCANS log readers
+
+FileTail follows one log file and returns the complete lines appended since the previous
+read. The file is identified by its inode as well as its path, so that:
+  - a file renamed away (rotation) is read to its end before the new file is followed,
+  - a file truncated in place (smaller than the offset, or with different first bytes than
+    when it was read, for a file rewritten past its old size between two reads) is read again
+    from the start,
+  - a file replaced while the reader was stopped is read from its start.
+
+Offsets always point just past a complete line and can be saved to a small JSON state file
+(TailState), so a restarted reader carries on from where it stopped: only the new bytes are
+read, and no line is dropped or read twice.
+
+Watcher sleeps until one of the followed files changes, using inotify where available and a
+plain timeout otherwise (e.g. logs on a network share, where inotify sees nothing).
+"""
+
+import os
+import json
+import time
+import select
+import struct
+import ctypes
+import ctypes.util
+import logging
+
+READ_SIZE = 1024 * 1024 # maximum bytes returned by a single read
+HEAD_SIZE = 256 # leading bytes remembered to recognise a file rewritten in place
+
+# inotify event masks (see inotify(7))
+IN_MODIFY = 0x002
+IN_CLOSE_WRITE = 0x008
+IN_MOVED_FROM = 0x040
+IN_MOVED_TO = 0x080
+IN_CREATE = 0x100
+IN_DELETE = 0x200
+WATCH_MASK = IN_MODIFY | IN_CLOSE_WRITE | IN_MOVED_FROM | IN_MOVED_TO | IN_CREATE | IN_DELETE
+EVENT_HEADER = struct.Struct('iIII') # wd, mask, cookie, len
+
+
+class TailState:
+    """
+    Small JSON file keeping the position of every tail, plus any data a reader wants
+    saved with it (e.g. counters that must stay consistent with the offset).
+
+    Args:
+        path (str): State file; None keeps the state in memory only.
+    """
+
+    def __init__(self, path=None):
+        self.path = path
+        self.data = {}
+        self._saved = None
+        if path and os.path.exists(path):
+            try:
+                with open(path, 'r') as file:
+                    self.data = json.load(file)
+            except (OSError, ValueError) as e:
+                logging.warning(f"Ignoring unreadable state file {path}: {e}")
+
+    def save(self):
+        """
+        Write the state atomically: a crash never leaves a half-written file behind.
+        Nothing is written if the state did not change since the previous save.
+        """
+        text = json.dumps(self.data)
+        if not self.path or text == self._saved:
+            return
+        temporary = self.path + '.tmp'
+        try:
+            with open(temporary, 'w') as file:
+                file.write(text)
+            os.replace(temporary, self.path)
+            self._saved = text
+        except OSError as e:
+            logging.warning(f"Could not save the tail state to {self.path}: {e}")
+
+
+class FileTail:
+    """
+    Follow a single log file.
+
+    Args:
+        path (str): The log file.
+        state (TailState): Where the position is kept between runs (None for in-memory only).
+        from_start (bool): Where to begin when the state knows nothing of the file: its
+            start (read the whole history) or its end (only lines written from now on).
+    """
+
+    def __init__(self, path, state=None, from_start=False):
+        self.path = path
+        self.state = state if state is not None else TailState()
+        self.file = None
+        self.inode = None
+        self.offset = 0
+        self.head = ''
+        self.resumed = False
+
+        saved = self.state.data.get(path)
+        stat = self._stat()
+        # Keep a handle on the file from the start, so a rotation never loses its last lines
+        if stat:
+            self._open()
+        if saved and stat:
+            self.inode, self.offset, self.head, self.resumed = saved['inode'], saved['offset'], saved.get('head', ''), True
+            if self._rewritten(stat):
+                # Rotated or truncated while stopped: the new file has not been read at all
+                logging.info(f"{path} changed since the last run, reading it from the start")
+                self.inode, self.offset, self.head = stat.st_ino, 0, ''
+        elif stat:
+            self.inode, self.offset = stat.st_ino, 0 if from_start else self._line_start(stat.st_size)
+            self._read_head()
+        self._remember()
+
+    def read(self, max_bytes=READ_SIZE):
+        """
+        Return the complete lines (without line endings) appended since the previous read.
+
+        At most about max_bytes are read at once; call again until it returns nothing to
+        drain a large backlog without holding it all in memory.
+        """
+        stat = self._stat()
+        lines = []
+
+        if self.file is not None and (stat is None or stat.st_ino != self.inode):
+            # Rotated: finish the old file through the handle still open on it
+            lines = self._read_open_file(max_bytes)
+            if lines:
+                return lines
+            logging.info(f"{self.path} was rotated, following the new file")
+            self._close()
+            self.inode, self.offset, self.head = (stat.st_ino if stat else None), 0, ''
+
+        if stat is None:
+            return lines
+
+        if self.inode != stat.st_ino:
+            self.inode, self.offset, self.head = stat.st_ino, 0, ''
+        elif self._rewritten(stat):
+            logging.info(f"{self.path} was truncated, reading from the start")
+            self.offset, self.head = 0, ''
+        self._remember()
+
+        if stat.st_size == self.offset or not self._open():
+            return lines
+        return self._read_open_file(max_bytes)
+
+    def last_line(self, max_bytes=4096):
+        """
+        Return the last complete line before the current offset (e.g. to seed a reader
+        that starts at the end of the file), or None.
+        """
+        try:
+            with open(self.path, 'rb') as file:
+                file.seek(max(0, self.offset - max_bytes))
+                data = file.read(self.offset - file.tell())
+        except OSError:
+            return None
+        lines = [line for line in data.split(b'\n') if line.strip()]
+        return lines[-1].decode('utf-8', 'replace').rstrip('\r') if lines else None
+
+    def _read_open_file(self, max_bytes):
+        self.file.seek(self.offset)
+        data = self.file.read(max_bytes)
+        end = data.rfind(b'\n')
+        if end < 0:
+            # No complete line yet, or one longer than max_bytes: read it with a larger buffer
+            if len(data) == max_bytes:
+                return self._read_open_file(max_bytes * 2)
+            return []
+        self.offset += end + 1
+        if len(self.head) < HEAD_SIZE:
+            self._read_head()
+        self._remember()
+        return [line.decode('utf-8', 'replace').rstrip('\r') for line in data[:end].split(b'\n')]
+
+    def _rewritten(self, stat):
+        # Shorter than what was read, a different file, or different leading bytes
+        if stat.st_ino != self.inode or stat.st_size < self.offset:
+            return True
+        if not self.head or self.file is None:
+            return False
+        self.file.seek(0)
+        return self.file.read(len(self.head)).decode('latin-1') != self.head
+
+    def _line_start(self, size):
+        # Offset just past the last complete line, so a line being written is not skipped
+        if self.file is None:
+            return size
+        start = max(0, size - READ_SIZE)
+        self.file.seek(start)
+        end = self.file.read(size - start).rfind(b'\n')
+        return start + end + 1 if end >= 0 or start == 0 else size
+
+    def _read_head(self):
+        if self.file is not None:
+            self.file.seek(0)
+            self.head = self.file.read(min(HEAD_SIZE, self.offset)).decode('latin-1')
+
+    def _open(self):
+        if self.file is None:
+            try:
+                self.file = open(self.path, 'rb')
+            except OSError:
+                return False
+        return True
+
+    def _stat(self):
+        try:
+            return os.stat(self.path)
+        except OSError:
+            return None
+
+    def _remember(self):
+        if self.inode is not None:
+            self.state.data[self.path] = {'inode': self.inode, 'offset': self.offset, 'head': self.head}
+
+    def _close(self):
+        if self.file is not None:
+            self.file.close()
+            self.file = None
+
+
+class Watcher:
+    """
+    Wait for changes to a set of files, with inotify if the platform offers it.
+
+    The parent directories are watched rather than the files, so creations and renames
+    (rotation) are seen as well as writes.
+    """
+
+    def __init__(self, paths):
+        self.names = {}
+        self.fd = None
+        libc_name = ctypes.util.find_library('c')
+        try:
+            libc = ctypes.CDLL(libc_name, use_errno=True)
+            fd = libc.inotify_init1(os.O_NONBLOCK | os.O_CLOEXEC)
+        except (OSError, AttributeError, TypeError):
+            logging.info("inotify is not available, polling the log files")
+            return
+        if fd < 0:
+            logging.info("inotify is not available, polling the log files")
+            return
+
+        for path in paths:
+            directory, name = os.path.split(os.path.abspath(path))
+            wd = libc.inotify_add_watch(fd, directory.encode(), WATCH_MASK)
+            if wd < 0:
+                logging.info(f"Cannot watch {directory}, polling it instead")
+                continue
+            self.names.setdefault(wd, set()).add(name)
+        if self.names:
+            self.fd = fd
+        else:
+            os.close(fd)
+
+    def wait(self, timeout):
+        """
+        Return once a followed file changed, or after timeout seconds at the latest.
+
+        The timeout still matters with inotify: changes made on another machine (network
+        shares) produce no event.
+        """
+        if self.fd is None:
+            select.select([], [], [], timeout)
+            return
+        deadline = time.monotonic() + timeout
+        while True:
+            ready, _, _ = select.select([self.fd], [], [], max(0, deadline - time.monotonic()))
+            if not ready or self._changed():
+                return
+
+    def _changed(self):
+        # Drain the pending events, telling whether any of them concerns a followed file
+        changed = False
+        while True:
+            try:
+                data = os.read(self.fd, 65536)
+            except BlockingIOError:
+                return changed
+            position = 0
+            while position < len(data):
+                wd, _, _, length = EVENT_HEADER.unpack_from(data, position)
+                position += EVENT_HEADER.size
+                name = data[position:position + length].rstrip(b'\0').decode('utf-8', 'replace')
+                position += length
+                changed = changed or name in self.names.get(wd, ())
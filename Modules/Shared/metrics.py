@@ -0,0 +1,156 @@
+"""
+In-process Prometheus metrics for the Other-clients collectors
+
+The collectors used to write CSV lines that a grok-exporter container re-parsed with
+regular expressions. Here they update typed gauges and counters directly, and each registry
+serves its /metrics page on the port the grok container used, with the same metric names
+and labels, so Prometheus and the dashboards see no difference.
+
+Registries are created per port on first use. Serving is off by default, so a collector
+run once from cron only fills an in-memory registry; a long-lived process (the collector
+scheduler, run_remote.py --interval) calls enable_serving() first and each registry is then
+served as soon as it is created.
+
+Every page also carries scans_collector_info, which tells discovery.py that a SCANS
+collector (rather than grok-exporter) answers on the port.
+"""
+
+import logging
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+_registries = {}
+_lock = threading.Lock()
+_serving = False
+
+
+class Metric:
+    """
+    A gauge or counter with labelled series.
+
+    Args:
+        registry (Registry): The registry holding the series.
+        name (str): Metric name.
+        help_text (str): HELP line of the metric.
+        kind (str): 'gauge' or 'counter'.
+        max_series (int): Label series kept, as grok-exporter keeps every one it has seen; once
+            there are more (e.g. a measurement_time label that changes with every reading),
+            the series updated least recently are dropped. None for no bound.
+    """
+
+    def __init__(self, registry, name, help_text, kind, max_series=None):
+        self.registry = registry
+        self.name = name
+        self.help = help_text
+        self.kind = kind
+        self.max_series = max_series
+
+    def set(self, value, **labels):
+        self._update(labels, lambda old: float(value))
+
+    def inc(self, amount=1, **labels):
+        self._update(labels, lambda old: (old or 0.0) + amount)
+
+    def _update(self, labels, compute):
+        key = tuple(sorted((name, str(value)) for name, value in labels.items()))
+        with self.registry.lock:
+            series = self.registry.series.setdefault(self.name, {})
+            # Series are kept in the order they were last updated
+            series[key] = compute(series.pop(key, None))
+            if self.max_series is not None:
+                while len(series) > self.max_series:
+                    del series[next(iter(series))]
+
+
+class Registry:
+    """
+    The metrics served on one port.
+    """
+
+    def __init__(self, port):
+        self.port = port
+        self.lock = threading.Lock()
+        self.metrics = {}
+        self.series = {}
+        self.server = None
+        self.gauge('scans_collector_info', 'SCANS collector serving these metrics').set(1)
+
+    def gauge(self, name, help_text, max_series=None):
+        return self._metric(name, help_text, 'gauge', max_series)
+
+    def counter(self, name, help_text, max_series=None):
+        return self._metric(name, help_text, 'counter', max_series)
+
+    def _metric(self, name, help_text, kind, max_series):
+        with self.lock:
+            if name not in self.metrics:
+                self.metrics[name] = Metric(self, name, help_text, kind, max_series)
+            return self.metrics[name]
+
+    def render(self):
+        lines = []
+        with self.lock:
+            for name, metric in sorted(self.metrics.items()):
+                series = self.series.get(name)
+                if not series:
+                    continue
+                lines.append(f"# HELP {name} {metric.help}")
+                lines.append(f"# TYPE {name} {metric.kind}")
+                for labels, value in sorted(series.items()):
+                    lines.append(f"{name}{format_labels(labels)} {value!r}")
+        return '\n'.join(lines) + '\n'
+
+    def serve(self):
+        if self.server is None:
+            self.server = ThreadingHTTPServer(('', self.port), make_handler(self))
+            threading.Thread(target=self.server.serve_forever, daemon=True).start()
+            logging.info(f"Serving metrics on port {self.port}")
+
+
+def format_labels(labels):
+    if not labels:
+        return ''
+    return '{' + ','.join('{}="{}"'.format(name, value.replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n'))
+                          for name, value in labels) + '}'
+
+
+def make_handler(registry):
+    class MetricsHandler(BaseHTTPRequestHandler):
+        def do_GET(self):
+            if self.path.split('?')[0] not in ('/', '/metrics'):
+                self.send_error(404)
+                return
+            body = registry.render().encode('utf-8')
+            self.send_response(200)
+            self.send_header('Content-Type', 'text/plain; version=0.0.4; charset=utf-8')
+            self.send_header('Content-Length', str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def log_message(self, format, *args):
+            logging.debug(format % args)
+
+    return MetricsHandler
+
+
+def registry(port):
+    """
+    Return the registry of a port, creating it (and serving it, if enabled) on first use.
+    """
+    with _lock:
+        if port not in _registries:
+            _registries[port] = Registry(port)
+            if _serving:
+                _registries[port].serve()
+        return _registries[port]
+
+
+def enable_serving():
+    """
+    Serve every registry over HTTP, those already created and those created from now on.
+    """
+    global _serving
+    with _lock:
+        _serving = True
+        for existing in _registries.values():
+            existing.serve()
@@ -0,0 +1,131 @@
+"""
+Declarative extraction of values from instrument web pages
+
+The UPS and HLMU collectors used to parse their pages with BeautifulSoup's pure-Python
+parser, and the UPS one then rendered every table back to text for pandas.read_html, only to
+read a single cell. Here each device lists the values it exposes in a small YAML file (page
+URL, element class, table, row and cell), compiled once into XPath expressions, and pages are
+parsed by lxml's C HTML parser; neither pandas nor BeautifulSoup is imported.
+
+A value is read with the keys of its YAML entry:
+  url:         page of the value ({name} placeholders are filled from the arguments of scrape)
+  class:       element with this CSS class, whose text is the value (or with table, the class
+               of the tables counted)
+  require:     class of an element that must be on the page for the value to be read
+  table:       index of the <table> on the page (or among the tables of that class)
+  row, cell:   data row (rows of <td> cells, header rows excluded) and cell of the table
+  cells:       cells read on every data row having them, instead of row and cell: the value
+               is then a list of rows
+  trim:        characters dropped at the end of every text (e.g. a unit)
+
+Every page is fetched and parsed once per scrape, however many values it holds.
+"""
+
+import threading
+
+import yaml
+import lxml.html
+from lxml import etree
+
+_devices = {}
+_devices_lock = threading.Lock()
+
+
+def class_test(name):
+    return f"contains(concat(' ', normalize-space(@class), ' '), ' {name} ')"
+
+
+class Value:
+    """
+    One value of a device page, compiled from its YAML entry.
+    """
+
+    def __init__(self, name, spec):
+        self.name = name
+        self.url = spec['url']
+        self.trim = int(spec.get('trim', 0))
+        self.row = spec.get('row')
+        self.cell = spec.get('cell')
+        self.cells = spec.get('cells')
+        self.required = None
+        if 'table' in spec:
+            tables = f"//table[{class_test(spec['class'])}]" if 'class' in spec else '//table'
+            self.xpath = etree.XPath(f"({tables})[{int(spec['table']) + 1}]")
+        elif 'class' in spec:
+            self.xpath = etree.XPath(f"(//*[{class_test(spec['class'])}])[1]")
+        else:
+            raise ValueError(f"{name}: a value needs a class or a table")
+        if spec.get('require'):
+            self.required = etree.XPath(f"boolean(//*[{class_test(spec['require'])}])")
+            self.required_class = spec['require']
+
+    def text(self, element):
+        text = element.text_content().strip()
+        return text[:-self.trim].strip() if self.trim else text
+
+    def extract(self, tree):
+        """
+        Return the value found in a parsed page, or None.
+        """
+        if self.required is not None and not self.required(tree):
+            print(f"{self.name}: element with class '{self.required_class}' not found on the page.")
+            return None
+        found = self.xpath(tree)
+        if not found:
+            print(f"{self.name}: element not found on the page.")
+            return None
+        element = found[0]
+        if element.tag != 'table':
+            return self.text(element)
+
+        rows = [[cell for cell in row if cell.tag in ('td', 'th')]
+                for row in element.iter('tr') if row.find('td') is not None]
+        if self.cells is not None:
+            return [[self.text(row[index]) for index in self.cells]
+                    for row in rows if len(row) > max(self.cells)]
+        try:
+            return self.text(rows[self.row][self.cell])
+        except (IndexError, TypeError):
+            print(f"{self.name}: no cell ({self.row}, {self.cell}) in the table.")
+            return None
+
+
+def load(path):
+    """
+    Return {device: [Value]} from a YAML file of {device: {value name: entry}}, compiled
+    once per process.
+    """
+    with _devices_lock:
+        if path not in _devices:
+            with open(path, 'r') as file:
+                config = yaml.safe_load(file) or {}
+            _devices[path] = {device: [Value(name, spec) for name, spec in (values or {}).items()]
+                              for device, values in config.items()}
+        return _devices[path]
+
+
+def urls(values, **placeholders):
+    """
+    Return the distinct page URLs of the values of one device, in order.
+    """
+    return list(dict.fromkeys(value.url.format(**placeholders) for value in values))
+
+
+def scrape(values, fetch, **placeholders):
+    """
+    Return {value name: value} for the values of one device.
+
+    Args:
+        values (list): Value objects of the device (see load).
+        fetch (callable): Returns the content of a URL, or None if it could not be read.
+        placeholders: Substituted in the URLs, e.g. ip_address.
+    """
+    pages = {}
+    results = {}
+    for value in values:
+        url = value.url.format(**placeholders)
+        if url not in pages:
+            content = fetch(url)
+            pages[url] = lxml.html.document_fromstring(content) if content else None
+        results[value.name] = value.extract(pages[url]) if pages[url] is not None else None
+    return results
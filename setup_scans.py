@@ -17,10 +17,14 @@ import sys
 import shutil
 import socket
 import re
-import glob
+import copy
 import subprocess
 import yaml
 
+# Modules shared with the SCANS containers (e.g., exporter discovery)
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), 'Modules', 'Shared'))
+import discovery
+
 # List of required program dependencies
 core_dependencies = ['docker', 'docker-compose']
 
@@ -28,6 +32,23 @@ core_dependencies = ['docker', 'docker-compose']
 container_blocks = './Modules/Client-spec/setup/blocks.yml'
 default_diskless_logs = '/usr/diskless/prog/logfiles'
 default_mics_logs = '/opt/Bruker/mics/logs'
+exporter_config = './Modules/Client-spec/setup/scripts/exporter'
+shared_modules = './Modules/Shared'
+
+# Historical grok-exporter port of each spectrometer metric group
+legacy_ports = {"helium": "9144", "nitrogen": "9145", "field": "9146", "shim": "9147", "events": "9148"}
+exporter_port = "9156"
+discovery_config = './Modules/Monitor/setup/scripts/discovery'
+monitor_targets = './Modules/Monitor/configuration/targets'
+
+# Spectrometer log formats: setup method and the reference log identifying it
+log_formats = [('combined', 'heliumlog'), ('separate', 'helium.log'), ('mics', 'heliumlogcache.log')]
+header_lines = 10 # leading lines searched for the header comments of a log
+sniff_bytes = 4096 # bytes read from the end of a log to find its last line
+
+# Log parsers of the SCANS exporter, reused to recognise the log formats
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), 'Modules', 'Client-spec', 'setup', 'scripts', 'exporter'))
+import speclogs
 
 def check_core_dependencies(dependencies):
     """
@@ -166,11 +187,43 @@ def check_existing_config(path, items):
             print("Setup cancelled.")
             sys.exit(0)
 
+def read_log_edges(file_path, tail_bytes=sniff_bytes):
+    """
+    Read the header comment lines and the last data line of a log, without reading the
+    whole file: only the first lines and the last few KB (found by seeking from the end)
+    are read, so even years of logs are sniffed in constant time and memory.
+
+    Args:
+        file_path (str): Path to the log file.
+        tail_bytes (int): Number of bytes read from the end of the file.
+
+    Returns:
+        tuple: List of header comment lines (without '#') and the last data line (None if there is none).
+    """
+    header = []
+    with open(file_path, 'rb') as file:
+        # The header comes first, possibly after blank lines (MICS)
+        for _ in range(header_lines):
+            line = file.readline(tail_bytes).decode('utf-8', 'replace').strip()
+            if line.startswith('#'):
+                header.append(line.lstrip('#').strip())
+            elif line or not file.peek(1):
+                break
+        size = file.seek(0, os.SEEK_END)
+        file.seek(max(0, size - tail_bytes))
+        lines = file.read().decode('utf-8', 'replace').splitlines()
+
+    # The first line of a partial read is probably cut
+    if size > tail_bytes:
+        lines = lines[1:]
+    lines = [line.strip() for line in lines if line.strip() and not line.lstrip().startswith('#')]
+    return header, lines[-1] if lines else None
+
 def extract_labels(file_path):
     # Read the last line of the file
-    with open(file_path, 'r') as file:
-        lines = file.readlines()
-        last_line = lines[-1].strip()
+    _, last_line = read_log_edges(file_path)
+    if last_line is None:
+        return []
     
     # Find the position of the last colon
     last_colon_pos = last_line.rfind(':')
@@ -189,6 +242,49 @@ def extract_labels(file_path):
     
     return labels
 
+def sniff_log_format(path):
+    """
+    Identify the spectrometer log format of a directory from the edges of its logs.
+
+    The formats are told apart by their reference log (heliumlog, helium.log or
+    heliumlogcache.log), whose last line must parse the way the exporter reads it. Only
+    the known log names of that format are then looked at, instead of every file of the
+    directory, and a log is kept if it holds at least one data line.
+
+    Args:
+        path (str): Directory containing the spectrometer logs.
+
+    Returns:
+        tuple: The setup method ('combined', 'separate' or 'mics') and the list of metrics
+        (labels of heliumlog, or names of the usable log files), or None if no format matches.
+    """
+    for method, reference in log_formats:
+        reference_path = os.path.join(path, reference)
+        if not os.path.isfile(reference_path):
+            continue
+        _, last_line = read_log_edges(reference_path)
+        if last_line is None or not speclogs.get_parser(reference)(last_line):
+            continue
+
+        if method == 'combined':
+            return method, extract_labels(reference_path)
+
+        metrics = []
+        for log_name in speclogs.METHOD_LOGS[method]:
+            log_path = os.path.join(path, log_name)
+            if not os.path.isfile(log_path):
+                continue
+            header, last_line = read_log_edges(log_path)
+            if last_line is None:
+                continue
+            columns = header[0].split(' ; ')[1:] if header else []
+            if len(columns) > 4:
+                columns = [f"{len(columns)} columns"]
+            print(f"Found {log_name}" + (f" ({', '.join(columns)})" if columns else ''))
+            metrics.append(log_name)
+        return method, metrics
+    return None
+
 def load_configurations(yaml_file):
     """
     Load configurations from a YAML file.
@@ -203,13 +299,16 @@ def load_configurations(yaml_file):
         configurations = yaml.safe_load(file)
     return configurations
 
-def build_container_file(metrics, path):
+def build_container_file(metrics, path, method, exporter='grok'):
     """
     Build Docker Compose configuration file based on provided metrics and path.
 
     Args:
         metrics (list): List of metrics to determine which Docker containers to include.
         path (str): Path to the directory containing log files.
+        method (str): The log layout ('mics', 'separate', or 'combined').
+        exporter (str): 'native' for the single SCANS exporter, 'legacy' for the SCANS exporter
+            also serving the historical per-metric ports, or 'grok' for one grok-exporter per metric.
 
     This function reads a template Docker Compose file, appends necessary blocks based on provided metrics,
     and inserts the log path into the Docker Compose configuration.
@@ -226,26 +325,36 @@ def build_container_file(metrics, path):
     # Initialize an empty list to store non-empty blocks
     non_empty_blocks = []
     
-    # Evaluate conditions and collect non-empty blocks
-    if any(item in metrics for item in ['helium.log', 'heliumlogcache.log','helium level']) and 'helium' in containers:
-        helium_block = containers['helium']
-        non_empty_blocks.append(format_container_block(helium_block))
-    
-    if any(item in metrics for item in ['nitrogen.log', 'nitrogenlogcache.log','nitrogen level']) and 'nitrogen' in containers:
-        nitrogen_block = containers['nitrogen']
-        non_empty_blocks.append(format_container_block(nitrogen_block))
-    
-    if any(item in metrics for item in ['field.log','field']) and 'field' in containers:
-        field_block = containers['field']
-        non_empty_blocks.append(format_container_block(field_block))
+    # A single SCANS exporter reads every log, optionally mirroring the old grok ports
+    if exporter in ('native', 'legacy') and 'exporter' in containers:
+        exporter_block = copy.deepcopy(containers['exporter'])
+        if exporter == 'legacy':
+            for service in exporter_block.values():
+                service['command'].append('--legacy-ports')
+                service['ports'].extend(f"{port}:{port}" for port in legacy_ports.values())
+                service['expose'].extend(legacy_ports.values())
+        non_empty_blocks.append(format_container_block(exporter_block))
+    else:
+        # Otherwise, evaluate conditions and collect one grok-exporter block per metric
+        if any(item in metrics for item in ['helium.log', 'heliumlogcache.log','helium level']) and 'helium' in containers:
+            helium_block = containers['helium']
+            non_empty_blocks.append(format_container_block(helium_block))
 
-    if any(item in metrics for item in ['rtshims.log']) and 'shims' in containers:
-        shims_block = containers['shims']
-        non_empty_blocks.append(format_container_block(shims_block))
+        if any(item in metrics for item in ['nitrogen.log', 'nitrogenlogcache.log','nitrogen level']) and 'nitrogen' in containers:
+            nitrogen_block = containers['nitrogen']
+            non_empty_blocks.append(format_container_block(nitrogen_block))
 
-    if any(item in metrics for item in ['events.log']) and 'events' in containers:
-        events_block = containers['events']
-        non_empty_blocks.append(format_container_block(events_block))
+        if any(item in metrics for item in ['field.log','field']) and 'field' in containers:
+            field_block = containers['field']
+            non_empty_blocks.append(format_container_block(field_block))
+
+        if any(item in metrics for item in ['rtshims.log']) and 'shims' in containers:
+            shims_block = containers['shims']
+            non_empty_blocks.append(format_container_block(shims_block))
+
+        if any(item in metrics for item in ['events.log']) and 'events' in containers:
+            events_block = containers['events']
+            non_empty_blocks.append(format_container_block(events_block))
     
     blank_dkr_cmp = './Modules/Client-spec/setup/scripts/docker-compose/blank_docker-compose.yml'
     destination = './Modules/Client-spec/docker-compose.yml'
@@ -262,6 +371,7 @@ def build_container_file(metrics, path):
         with open(destination, 'r') as file:
             file_contents = file.read()
         file_contents = file_contents.replace('{$log_path}', path)
+        file_contents = file_contents.replace('{$method}', method)
         with open(destination, 'w') as file:
             file.write(file_contents)
     
@@ -331,6 +441,48 @@ def build_grok_config(method):
         print(f"An error occurred while configuring: {e}")
         sys.exit(1)
 
+def build_exporter_config():
+    """
+    Copy the SCANS exporter sources into the Client-spec configuration directory.
+
+    The exporter reads the log layout from its command line (set in the docker-compose file),
+    so the same sources serve the 'mics', 'separate', and 'combined' methods. The shared SCANS
+    modules (e.g., log tailing) are copied alongside them into ./shared.
+
+    Raises:
+        OSError: If an error occurs during file operations (e.g., copying files).
+    """
+    try:
+        destination = './Modules/Client-spec/configuration/exporter'
+        shutil.copytree(exporter_config, destination, dirs_exist_ok=True,
+                        ignore=shutil.ignore_patterns('__pycache__'))
+        shutil.copytree(shared_modules, os.path.join(destination, 'shared'), dirs_exist_ok=True,
+                        ignore=shutil.ignore_patterns('__pycache__'))
+        print("\nExporter files copied\n")
+
+    except Exception as e:
+        print(f"An error occurred while configuring: {e}")
+        sys.exit(1)
+
+def build_discovery_config():
+    """
+    Copy the scans-discovery daemon sources, and the shared modules it uses, into the
+    Monitor configuration directory.
+
+    Raises:
+        OSError: If an error occurs during file operations (e.g., copying files).
+    """
+    try:
+        destination = './Modules/Monitor/configuration/discovery'
+        shutil.copytree(discovery_config, destination, dirs_exist_ok=True,
+                        ignore=shutil.ignore_patterns('__pycache__'))
+        shutil.copytree(shared_modules, os.path.join(destination, 'shared'), dirs_exist_ok=True,
+                        ignore=shutil.ignore_patterns('__pycache__'))
+
+    except Exception as e:
+        print(f"An error occurred while configuring: {e}")
+        sys.exit(1)
+
 def get_machines():
     ip_pattern = re.compile(r'^((25[0-5]|2[0-4][0-9]|[0-1]?[0-9][0-9]?)\.){3}(25[0-5]|2[0-4][0-9]|[0-1]?[0-9][0-9]?)$')
     print("\nYou must provide the network information for all of your clients.\n")
@@ -375,16 +527,26 @@ def get_machines():
         else:
             print("Entry discarded. Please re-enter the details.")
 
-def is_port_open(ip, port):
-    try:
-        sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
-        sock.settimeout(2)  # Set timeout to 1 second
-        sock.connect((ip, int(port)))
-        sock.close()
-        return True
-    except socket.error:
-        return False
-    
+def discover_services(hosts):
+    """
+    Find the SCANS exporters running on each machine.
+
+    All machine/port pairs are probed concurrently and the /metrics page of each open port
+    is checked, so only ports served by the expected exporter are kept. Machines running
+    the SCANS exporter are not scraped on the legacy per-metric ports as well.
+
+    Args:
+        hosts (dict): Machine name -> IP address.
+
+    Returns:
+        dict: Machine name -> {service name: port} for every exporter found.
+    """
+    probes = discovery.discover(hosts)
+    for probe in probes:
+        if probe.kind is not None and not discovery.is_expected(probe.kind, discovery.SERVICES[probe.service][1]):
+            print(f"{probe.machine}: port {probe.port} is open but not served by the expected exporter, skipping it")
+    return discovery.found_services(probes)
+
 def main():
     """
     Main function to run the setup script.
@@ -451,41 +613,35 @@ def setup_spectrometer(ip_address):
     else:
         path, log_file = check_log_file(default_mics_logs, log_file)
 
-    # Identify what logs and metrics you have
-    # Cater for new diskless style logs
-    if log_answer == 1 and log_file == 'heliumlog':
-        metrics = extract_labels(os.path.join(path,log_file))
-        #print(f'Found metrics: '+', '.join(metrics))
-        method = 'combined'
-        
-    # Cater for old diskless style logs
-    elif log_answer == 1 and log_file == 'helium.log':
-        metrics = [os.path.basename(f) for f in glob.glob(os.path.join(path,'*.log')) if os.path.getsize(f) > 0]
-        #print(f'Found logs: '+', '.join(metrics))
-        method = 'separate'
-        
-    # Cater for MICS logs
-    elif log_answer == 2:
-        metrics = [os.path.basename(f) for f in glob.glob(os.path.join(path,'*.log')) if os.path.getsize(f) > 0]
-        #print(f'Found logs: '+', '.join(metrics))
-        method = 'mics'
-
-    # Else, something is wrong..
-    else:
+    # Identify what logs and metrics you have from the edges of the logs
+    log_format = sniff_log_format(path)
+    if log_format is None:
         print("The log file configuration doesn't match with known format. Please contact the developer for assistance.")
         sys.exit(1)
+    method, metrics = log_format
        
+    exporter_choices = ["SCANS exporter (one container, all metrics on port 9156)",
+                        "SCANS exporter, also serving the legacy per-metric ports (9144-9148)",
+                        "Legacy grok-exporter containers (one per metric)"]
+    exporter_answer = ask_multiple_choice("\nWhich exporter should serve the spectrometer metrics?", exporter_choices)
+    exporter = ['native', 'legacy', 'grok'][exporter_answer - 1]
+
     # Create the appropriate containers
-    build_container_file(metrics,path)
-    # Create the grok configuration files
-    build_grok_config(method)
+    build_container_file(metrics, path, method, exporter)
+    if exporter == 'grok':
+        # Create the grok configuration files
+        build_grok_config(method)
+    else:
+        # Provide the SCANS exporter sources
+        build_exporter_config()
     # Print user message
     print(f'\nBuilt containers for: '+', '.join(metrics)+" metrics.")
     print(f'Setup complete.')
     print(f'\nLocal IP = {ip_address}\nPlease note this information for configuration of your monitoring module.\n')
     print('\nTo run your containers, please run the following:')
     print('cd ./Modules/Client-spec/')
-    #print('sudo docker-compose build') #Required for custom images!
+    if exporter != 'grok':
+        print('sudo docker-compose build') #Required for custom images!
     print('sudo docker-compose up &\n')
 
 def setup_monitor(ip_address):
@@ -525,11 +681,21 @@ def setup_monitor(ip_address):
         config_dir = './Modules/Monitor/setup/configuration'
         destination = './Modules/Monitor/configuration'
         shutil.copytree(config_dir, destination, dirs_exist_ok=True)
+        build_discovery_config()
 
         prom_short_yml = './Modules/Monitor/configuration/prom-short.yml'
         prom_long_yml = './Modules/Monitor/configuration/prom-long.yml'
-        all_clients = [re.sub(r':[^"]+', ':9100"', item) for item in machines]
-        all_clients = ', '.join(all_clients)
+
+        print("\nSetup will now scan for active containers on these machines.")
+        print("Containers that are not up and running yet will be picked up later by the scans-discovery container.")
+        input("Press enter when ready!")
+
+        # Probe every exporter port of every machine at once, checking which exporter answers
+        hosts = dict(entry.strip('"').split(':', 1) for entry in machines)
+        machine_services = discover_services(hosts)
+
+        # Write the initial Prometheus targets (file_sd), later kept up to date by scans-discovery
+        discovery.write_target_files(monitor_targets, discovery.target_groups(machine_services, hosts))
 
         # Deal with prom short file
         with open(prom_short_yml, 'r') as file:
@@ -537,75 +703,10 @@ def setup_monitor(ip_address):
 
         # Update place-holders in new docker-compose file
         file_contents = file_contents.replace('{$server_name}', server_alias)
-        file_contents = file_contents.replace('{$all_clients}', all_clients)
 
         with open(prom_short_yml, 'w') as file:
             file.write(file_contents)
 
-         # Deal with prom long file
-        print("\nSetup will now scan for active containers on these machines.")
-        print("If any containers are not up and running, they will be missed, but can be added at a later date.")
-        input("Press enter when ready!")
-
-        services_ports = {"helium": "9144", "nitrogen": "9145", "field": "9146", "shim": "9147", "events": "9148"}
-        # Initialize lists for each service
-        helium_list = []
-        nitrogen_list = []
-        field_list = []
-        shim_list = []
-        events_list = []
-
-        # Initialize dictionary to store services found for each machine name  (purely aesthetic!)
-        machine_services = {}
-
-         # Process each machine IP
-        for machine_ip in machines:
-            # Extract machine name and IP address
-            parts = machine_ip.strip('"').split(':')
-            machine_name = parts[0]
-            ip_address = parts[1]
-
-            # Initialize list to store services found for current machine
-            if machine_name not in machine_services:
-                machine_services[machine_name] = []
-
-            # Check each service port for activity
-            for service, port in services_ports.items():
-                if ',' in port:
-                    port_list = port.split(',')
-                    for p in port_list:
-                        if is_port_open(ip_address, p):
-                            machine_services[machine_name].append(service)
-                            if service == "helium":
-                                helium_list.append(f'"{machine_name}:{p}"')
-                            elif service == "nitrogen":
-                                nitrogen_list.append(f'"{machine_name}:{p}"')
-                            elif service == "field":
-                                field_list.append(f'"{machine_name}:{p}"')
-                            elif service == "shim":
-                                shim_list.append(f'"{machine_name}:{p}"')
-                            elif service == "events":
-                                events_list.append(f'"{machine_name}:{p}"')
-                else:
-                    if is_port_open(ip_address, port):
-                        machine_services[machine_name].append(service)
-                        if service == "helium":
-                            helium_list.append(f'"{machine_name}:{port}"')
-                        elif service == "nitrogen":
-                            nitrogen_list.append(f'"{machine_name}:{port}"')
-                        elif service == "field":
-                            field_list.append(f'"{machine_name}:{port}"')
-                        elif service == "shim":
-                            shim_list.append(f'"{machine_name}:{port}"')
-                        elif service == "events":
-                            events_list.append(f'"{machine_name}:{port}"')
-
-        helium_list = ', '.join(helium_list)
-        nitrogen_list = ', '.join(nitrogen_list)
-        field_list = ', '.join(field_list)
-        shim_list = ', '.join(shim_list)
-        events_list = ', '.join(events_list)
-
         # Deal with prom long file
         with open(prom_long_yml, 'r') as file:
             file_contents = file.read()
@@ -613,19 +714,14 @@ def setup_monitor(ip_address):
         # Update place-holders in new docker-compose file
         file_contents = file_contents.replace('{$server_name}', server_alias)
         file_contents = file_contents.replace('{$server_ip}', ip_address)
-        file_contents = file_contents.replace('{$helium_clients}', helium_list)
-        file_contents = file_contents.replace('{$nitrogen_clients}', nitrogen_list)
-        file_contents = file_contents.replace('{$field_clients}', field_list)
-        file_contents = file_contents.replace('{$shim_clients}', shim_list)
-        file_contents = file_contents.replace('{$events_clients}', events_list)
 
         with open(prom_long_yml, 'w') as file:
             file.write(file_contents)
 
         # PRINT SUMMARY
         print("\nService summary:")
-        for machine_name, services_found in machine_services.items():
-            services_list = ', '.join(set(services_found))  # Use set to remove duplicates
+        for machine_name in hosts:
+            services_list = ', '.join(machine_services.get(machine_name, {})) or 'none found'
             print(f"{machine_name}: {services_list}")
 
     except FileNotFoundError as e:
@@ -634,7 +730,7 @@ def setup_monitor(ip_address):
     print(f'\nSetup complete.')
     print('\nTo run your containers, please run the following:')
     print('cd ./Modules/Monitor/')
-    #print('sudo docker-compose build') #Required for custom images!
+    print('sudo docker-compose build') #Required for custom images!
     print('sudo docker-compose up &')
     print(f'\nYou will then be able to access your grafana instance at http://{ip_address}:3000')
 